@@ -0,0 +1,71 @@
+"""
+Benchmark classify_priority_types_to_groups against the chained str.contains() assignments it replaced. The classifier
+resolves the Grouper once per distinct chokeStatusAction, so its cost should follow the number of distinct actions, 
+with only a cheap code lookup per row. Both are checked to put every row in the same group.
+
+Run from the repository root: python benchmarks/bench_classify.py
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+BENCHMARK_DIR=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, 'stand_in'))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+from soha_priorities import classify_priority_types_to_groups
+
+#Real codings, padded out with numbered variants to test more distinct values
+ACTIONS=['Waiting on Engineering', 'Operations - Troubleshoot', 'No Action', 'Maintenance - Compressor', 
+         'Natural Decline', 'Midstream Constraint', 'Work Complete', 'Waiting on Optimization', 
+         'Waiting on Construction', 'TA - P&A Candidate']
+PRIORITIES=['Deferment', 'Enbase Work Management', 'Flood Alert', 'Site Inspection', 'Automation-RTU Issue']
+
+def build_priority_df(rows, distinct_actions, seed=0):
+    """
+    Build a priority frame with the given number of rows and distinct chokeStatusAction values (plus some nulls).
+    """
+    rng=np.random.default_rng(seed)
+    actions=np.array([ACTIONS[i % len(ACTIONS)]+' %d' % i for i in range(distinct_actions)]+[None], dtype=object)
+    return pd.DataFrame({'chokeStatusAction': actions[rng.integers(0, len(actions), rows)],
+                         'Priority': np.array(PRIORITIES, dtype=object)[rng.integers(0, len(PRIORITIES), rows)]})
+
+def baseline_classify(priority_df):
+    """
+    The chained assignments the classifier replaced, one str.contains() pass over every row per rule.
+    """
+    for action, group in [('Engineering', 'Engineering'), ('Operations', 'Operations'), ('No Action', 'Operations'), 
+                          ('Maintenance', 'Operations'), ('Natural Decline', 'Operations'), ('Midstream', 'Operations'),
+                          ('Work Complete', 'Operations'), ('Optimization', 'Operations'), ('Construction', 'Construction')]:
+        priority_df.loc[priority_df.chokeStatusAction.str.contains(action, na=False), 'Grouper']=group
+    for priority, group in [('Automation', 'Automation'), ('Flood Alert', 'Site Manager'), ('Site Inspection', 'Operations')]:
+        priority_df.loc[priority_df.Priority==priority, 'Grouper']=group
+    return priority_df
+
+def time_classifier(classify, df, repeats=5):
+    """
+    Best of several runs in seconds, and the last run's Grouper
+    """
+    timings=[]
+    for _ in range(repeats):
+        frame=df.copy()
+        start=time.perf_counter()
+        frame=classify(frame)
+        timings.append(time.perf_counter()-start)
+    return min(timings), frame['Grouper']
+
+def main():
+    print('%10s %10s %12s %12s %14s %14s %8s' % ('rows', 'distinct', 'chained s', 'grouper s', 'chained ns/row', 
+                                                 'grouper ns/row', 'groups'))
+    for rows in [10000, 100000, 1000000]:
+        for distinct_actions in [10, 50, 500]:
+            df=build_priority_df(rows, distinct_actions)
+            baseline_seconds, baseline=time_classifier(baseline_classify, df)
+            seconds, grouper=time_classifier(classify_priority_types_to_groups, df)
+            same='same' if baseline.astype(object).fillna('').equals(grouper.astype(object).fillna('')) else 'DIFFER'
+            print('%10d %10d %12.4f %12.4f %14.1f %14.1f %8s' % (rows, distinct_actions, baseline_seconds, seconds, 
+                                                                 baseline_seconds/rows*1e9, seconds/rows*1e9, same))
+
+if __name__=='__main__':
+    main()
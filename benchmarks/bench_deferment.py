@@ -0,0 +1,76 @@
+"""
+Scaling benchmark of deferment banding: the quantile cuts (np.partition around each band edge for global ranking, one
+sort by group and deferment for Area and Route ranking) and one banding pass, against the rank() and sort_values() 
+they replaced. Deferment is rounded so there are plenty of ties, and both ways are checked to give every well the same
+band. Time per row should stay roughly flat as the rows grow.
+
+Run from the repository root: python benchmarks/bench_deferment.py --rows 10000 100000 1000000 10000000
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+BENCHMARK_DIR=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, 'stand_in'))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+import soha_priorities
+from synthetic_fleet import AREAS, WELLS_PER_ROUTE
+
+def deferring_wells(rows, seed=0):
+    """
+    A frame of deferring wells with Deferment, Area and Route.
+    """
+    rng=np.random.default_rng(seed)
+    well_numbers=np.arange(rows)
+    return pd.DataFrame({'Deferment': rng.gamma(2, 150, rows).round(),
+                         'Area': np.array(AREAS, dtype=object)[well_numbers*len(AREAS)//max(rows, 1)],
+                         'Route': well_numbers//WELLS_PER_ROUTE})
+
+def rank_quantiles(df, ranking):
+    """
+    The quantiles the way they used to be found: rank() and a full sort, per ranking group.
+    """
+    column=soha_priorities.DEFERMENT_RANKING_COLUMNS.get(ranking)
+    groups=[df] if column is None else [group for value, group in df.groupby(column)]
+    quantiles=[]
+    for group in groups:
+        group=group.assign(DefermentRanking=group['Deferment'].rank(ascending=0)).sort_values(by='Deferment')
+        quantiles.append(1-(group.shape[0]-group['DefermentRanking'])/group.shape[0])
+    return pd.concat(quantiles).reindex(df.index).to_numpy()
+
+def cut_quantiles(df, ranking):
+    return soha_priorities.deferment_quantiles(df, soha_priorities.deferment_quantile_cuts(df, ranking), ranking)
+
+def bands(quantiles):
+    return soha_priorities.find_priority_bands('Deferment', len(quantiles), lambda column: quantiles)[0]
+
+def best_seconds(function, repeats, *args):
+    seconds=[]
+    for repeat in range(repeats):
+        start=time.perf_counter()
+        result=function(*args)
+        seconds.append(time.perf_counter()-start)
+    return min(seconds), result
+
+def main():
+    parser=argparse.ArgumentParser(description='Benchmark deferment quantile banding as the fleet grows.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000, 10000000])
+    parser.add_argument('--ranking', nargs='+', default=['global', 'area', 'route'], choices=['global', 'area', 'route'])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args=parser.parse_args()
+    print('%-8s %10s %12s %12s %14s %14s %8s' % ('ranking', 'rows', 'rank s', 'cuts s', 'rank ns/row', 'cuts ns/row', 'bands'))
+    for ranking in args.ranking:
+        for rows in args.rows:
+            df=deferring_wells(rows, args.seed)
+            rank_seconds, rank_result=best_seconds(rank_quantiles, args.repeats, df, ranking)
+            cut_seconds, cut_result=best_seconds(cut_quantiles, args.repeats, df, ranking)
+            same='same' if (bands(rank_result)==bands(cut_result)).all() else 'DIFFER'
+            print('%-8s %10d %12.3f %12.3f %14.1f %14.1f %8s' % (ranking, rows, rank_seconds, cut_seconds,
+                                                                 rank_seconds/rows*1e9, cut_seconds/rows*1e9, same))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Per-stage benchmark of the priority pipeline on synthetic fleets, served by the in-process sql_helpers stand-in.
+Runs main() and reports the run report's wall time, rows and peak RSS for every stage, so regressions show up before
+they reach production and the job can be sized for new assets.
+
+Run from the repository root: python benchmarks/bench_pipeline.py --wells 1000 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+BENCHMARK_DIR=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, 'stand_in'))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+#The benchmark should always hit the stand-in, never a stored snapshot
+os.environ['SOHA_SNAPSHOT_MODE']='live'
+import sql_helpers
+import soha_priorities
+from synthetic_fleet import build_fleet
+
+def run_pipeline(wells, seed=0):
+    """
+    Run the pipeline on a synthetic fleet through main(), the way the CLI does (SOHA_EXECUTION_MODE, 
+    SOHA_SHARD_COLUMN and the other settings apply), with the deferment state and the run report in a temporary 
+    directory. Returns the run report.
+    """
+    sql_helpers.load_fleet(build_fleet(wells, seed))
+    paths=soha_priorities.DEFERMENT_STATE_PATH, soha_priorities.RUN_REPORT_PATH
+    with tempfile.TemporaryDirectory() as directory:
+        soha_priorities.DEFERMENT_STATE_PATH=os.path.join(directory, 'deferment_state.parquet')
+        soha_priorities.RUN_REPORT_PATH=os.path.join(directory, 'run_report.json')
+        try:
+            soha_priorities.main()
+            with open(soha_priorities.RUN_REPORT_PATH) as f:
+                return json.load(f)
+        finally:
+            soha_priorities.DEFERMENT_STATE_PATH, soha_priorities.RUN_REPORT_PATH=paths
+
+def print_report(wells, report):
+    """
+    Print every stage of a run report in the order they finished, with the process' peak RSS when each did.
+    """
+    print('\n%d wells' % wells)
+    print('%-44s %10s %12s %12s %10s' % ('stage', 'seconds', 'rows in', 'rows out', 'peak MB'))
+    for stage in report['stages']:
+        rows_in, rows_out=['-' if stage[field] is None else stage[field] for field in ['rows_in', 'rows_out']]
+        peak='-' if stage['peak_rss_bytes'] is None else '%.1f' % (stage['peak_rss_bytes']/2**20)
+        print('%-44s %10.3f %12s %12s %10s' % (stage['stage'][:44], stage['seconds'], rows_in, rows_out, 
+                                               stage['error'] or peak))
+    print('%-44s %10.3f' % ('run', report['run_seconds']))
+
+def main():
+    parser=argparse.ArgumentParser(description='Benchmark the SoHa priority pipeline on synthetic fleets.')
+    parser.add_argument('--wells', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--seed', type=int, default=0)
+    args=parser.parse_args()
+    for wells in args.wells:
+        print_report(wells, run_pipeline(wells, args.seed))
+
+if __name__=='__main__':
+    main()
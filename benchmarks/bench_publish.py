@@ -0,0 +1,122 @@
+"""
+Write throughput of the publish modes (replace, delta and swap) against a local SQLite database, or DuckDB if
+duckdb_engine is installed, using priority frames built from a synthetic fleet. Every mode writes both tables over
+one engine, like a run does. Swap isn't expected to beat replace, since it loads a staging table before renaming it in.
+What it buys is atomic visibility: readers see the old table or the new one, never a half written or missing one.
+
+Run from the repository root: python benchmarks/bench_publish.py --wells 10000 100000 --database sqlite
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+import sqlalchemy
+
+BENCHMARK_DIR=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, 'stand_in'))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+os.environ['SOHA_SNAPSHOT_MODE']='live'
+import sql_helpers
+import soha_priorities
+from synthetic_fleet import build_fleet
+
+#The two tables a run publishes, with their delta keys
+TARGETS=[('SoHa', 'Priorities_Test', ['Corp_ID', 'Priority']),
+         ('VRP_Details', 'SoHa_Priorities', ['LocationID', 'PriorityType'])]
+
+def priority_frames(wells, seed=0):
+    """
+    The frames a run would publish to each target, for a synthetic fleet, from the enabled priority sources.
+    """
+    sql_helpers.load_fleet(build_fleet(wells, seed))
+    names=soha_priorities.enabled_priority_sources()
+    sources, well_metadata=soha_priorities.fetch_run_sources(soha_priorities.pull_well_specific_data,
+                                                             soha_priorities.priority_run_sources(names))
+    #Roll a throwaway deferment state forward, never the stored one
+    with tempfile.TemporaryDirectory() as directory:
+        soha_priorities.DEFERMENT_STATE_PATH=os.path.join(directory, 'deferment_state.parquet')
+        sources.update(soha_priorities.local_priority_sources(well_metadata, names))
+    priorities=soha_priorities.run_priority_sources(well_metadata, sources, names)
+    priority_df=soha_priorities.apply_schema(soha_priorities.combine_priorities(priorities.values()),
+                                             soha_priorities.PRIORITY_SCHEMA)
+    test_df=soha_priorities.format_priorities_test_table(soha_priorities.classify_priority_types_to_groups(priority_df))
+    return [test_df, soha_priorities.format_vrp_priorities(test_df)]
+
+def create_engine(database, directory):
+    """
+    A local engine with the SoHa and VRP_Details schemas.
+    """
+    if database=='duckdb':
+        engine=sqlalchemy.create_engine('duckdb:///'+os.path.join(directory, 'publish.duckdb'))
+        with engine.begin() as connection:
+            for schema, table, key_columns in TARGETS:
+                connection.execute(sqlalchemy.text('CREATE SCHEMA IF NOT EXISTS '+schema))
+        return engine
+    engine=sqlalchemy.create_engine('sqlite:///'+os.path.join(directory, 'publish.sqlite'))
+
+    @sqlalchemy.event.listens_for(engine, 'connect')
+    def attach_schemas(connection, record):
+        #SQLite schemas are attached databases
+        for schema, table, key_columns in TARGETS:
+            connection.execute("ATTACH DATABASE '%s' AS %s" % (os.path.join(directory, schema+'.sqlite'), schema))
+    return engine
+
+def publish(mode, frames, engine, batch_rows):
+    """
+    Publish both frames in the given mode, and return the seconds it took.
+    """
+    start=time.perf_counter()
+    for df, (schema, table, key_columns) in zip(frames, TARGETS):
+        if mode=='replace':
+            df.to_sql(table, engine, schema=schema, if_exists='replace', index=False)
+            with engine.begin() as connection:
+                soha_priorities.drop_key_hashes(connection, table, schema)
+        elif mode=='swap':
+            soha_priorities.publish_priority_swap(df, table, schema, engine, batch_rows)
+        else:
+            soha_priorities.publish_priority_delta(df, table, schema, key_columns, engine)
+    return time.perf_counter()-start
+
+def run_benchmark(wells, database='sqlite', seed=0, batch_rows=None, repeats=3):
+    """
+    Time each publish mode on one fleet size. Delta is timed both on a full rewrite (every key changed) and on an
+    unchanged rerun, its usual case. Returns rows per publish and the best seconds per mode.
+    """
+    frames=priority_frames(wells, seed)
+    #The same priorities with every reason changed, so a delta has to rewrite every key
+    changed=[df.assign(**{column: df[column].astype(str)+' (changed)'}) for df, column in zip(frames, ['Description', 'Reason'])]
+    rows=sum(len(df) for df in frames)
+    results={}
+    with tempfile.TemporaryDirectory() as directory:
+        engine=create_engine(database, directory)
+        for mode in ['replace', 'swap']:
+            results[mode]=min(publish(mode, frames, engine, batch_rows) for repeat in range(repeats))
+        delta_full, delta_rerun=[], []
+        for repeat in range(repeats):
+            publish('replace', changed, engine, batch_rows)
+            delta_full.append(publish('delta', frames, engine, batch_rows))
+            delta_rerun.append(publish('delta', frames, engine, batch_rows))
+        results['delta (all keys changed)']=min(delta_full)
+        results['delta (unchanged rerun)']=min(delta_rerun)
+        engine.dispose()
+    return rows, results
+
+def main():
+    parser=argparse.ArgumentParser(description='Benchmark the write throughput of the priority publish modes.')
+    parser.add_argument('--wells', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--database', choices=['sqlite', 'duckdb'], default='sqlite')
+    parser.add_argument('--batch-rows', type=int, default=soha_priorities.PUBLISH_BATCH_ROWS)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args=parser.parse_args()
+    for wells in args.wells:
+        rows, results=run_benchmark(wells, args.database, args.seed, args.batch_rows, args.repeats)
+        print('\n%d wells, %d rows over both tables (%s)' % (wells, rows, args.database))
+        print('%-26s %10s %14s' % ('mode', 'seconds', 'rows/second'))
+        for mode, seconds in results.items():
+            print('%-26s %10.3f %14.0f' % (mode, seconds, rows/seconds))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Rows and bytes each SQL pull transfers with and without predicate and projection pushdown (see SOURCE_PUSHDOWN). The
+synthetic fleet is loaded into a temporary SQLite database, with a .sql file per source selecting its table, and the
+sql_helpers stand-in hands out that database's engine, so pushed down pulls really run as filtered subqueries. Sources
+on the Arrow and CurrentState servers have no engine and are narrowed locally, so their transfer doesn't change. Full
+pulls read the same database, so both sides pay for the same round trips.
+
+Run from the repository root: python benchmarks/bench_pushdown.py --wells 10000 100000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+import sqlalchemy
+
+BENCHMARK_DIR=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, 'stand_in'))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+os.environ['SOHA_SNAPSHOT_MODE']='live'
+import sql_helpers
+import soha_priorities
+from synthetic_fleet import build_fleet
+
+def load_database(frames, directory):
+    """
+    Write every frame to a table of a SQLite database in directory, and a .sql file selecting it. Returns the engine.
+    """
+    engine=sqlalchemy.create_engine('sqlite:///'+os.path.join(directory, 'fleet.db'))
+    for query, df in frames.items():
+        table=os.path.splitext(query)[0]
+        df.to_sql(table, engine, index=False)
+        with open(os.path.join(directory, query), 'w') as f:
+            f.write('SELECT * FROM "%s"\n' % table)
+    return engine
+
+def fetch_transfer(pushdown):
+    """
+    Fetch the run's sources the way a run does, and return the seconds taken and the rows and bytes of every pull.
+    """
+    soha_priorities.PUSHDOWN_ENABLED=pushdown
+    soha_priorities.CURRENT_TELEMETRY=soha_priorities.RunTelemetry()
+    try:
+        start=time.perf_counter()
+        soha_priorities.fetch_run_sources(soha_priorities.pull_well_specific_data)
+        seconds=time.perf_counter()-start
+        stages=soha_priorities.CURRENT_TELEMETRY.report()['stages']
+    finally:
+        soha_priorities.CURRENT_TELEMETRY=None
+    return seconds, {stage['stage'][len('pull:'):]: (stage['rows_out'], stage['raw_bytes']) for stage in stages
+                     if stage['stage'].startswith('pull:') and stage['error'] is None}
+
+def main():
+    parser=argparse.ArgumentParser(description='Benchmark the transfer saved by pushing filters and columns into the SQL pulls.')
+    parser.add_argument('--wells', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--seed', type=int, default=0)
+    args=parser.parse_args()
+    for wells in args.wells:
+        with tempfile.TemporaryDirectory() as directory:
+            frames=build_fleet(wells, args.seed)
+            sql_helpers.load_fleet(frames)
+            engine=load_database(frames, directory)
+            sql_helpers.get_future_state_engine=lambda database: engine
+            sql_helpers._pull=lambda query: pd.read_sql(sqlalchemy.text(open(os.path.join(directory, query)).read()), engine)
+            soha_priorities.SQL_QUERY_DIR=directory
+            soha_priorities.SOURCE_ENGINES.clear()
+            full_seconds, full=fetch_transfer(False)
+            pushed_seconds, pushed=fetch_transfer(True)
+            engine.dispose()
+        print('\n%d wells' % wells)
+        print('%-26s %10s %10s %12s %12s %8s' % ('source', 'rows', 'rows', 'MB', 'MB', 'saved'))
+        print('%-26s %10s %10s %12s %12s' % ('', 'full', 'pushdown', 'full', 'pushdown'))
+        for name in sorted(full):
+            rows, transferred=full[name]
+            print('%-26s %10d %10d %12.2f %12.2f %7.0f%%' % (name, rows, pushed[name][0], transferred/2**20, pushed[name][1]/2**20,
+                                                           100*(1-pushed[name][1]/max(transferred, 1))))
+        print('%-26s %10s %10s %12.2f %12.2f' % ('total', '', '', sum(v[1] for v in full.values())/2**20,
+                                                 sum(v[1] for v in pushed.values())/2**20))
+        print('fetch seconds: %.3f full, %.3f pushdown' % (full_seconds, pushed_seconds))
+
+if __name__=='__main__':
+    main()
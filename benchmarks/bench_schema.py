@@ -0,0 +1,72 @@
+"""
+Memory of every pulled frame before and after its ingest schema (see SOURCE_SCHEMAS), on synthetic fleets served by
+the in-process sql_helpers stand-in. With --rss, the whole pipeline is also run in a fresh process with and without
+the schemas and its peak RSS compared.
+
+Run from the repository root: python benchmarks/bench_schema.py --wells 100000 1000000 --rss
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+BENCHMARK_DIR=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, 'stand_in'))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+#The benchmark should always hit the stand-in, never a stored snapshot
+os.environ['SOHA_SNAPSHOT_MODE']='live'
+import sql_helpers
+import soha_priorities
+from synthetic_fleet import build_fleet
+from bench_pipeline import run_pipeline
+
+def pull_memory(wells, seed=0):
+    """
+    Fetch a run's sources through the schema, as a run does, and return the raw and compact bytes of each from the pull telemetry.
+    """
+    sql_helpers.load_fleet(build_fleet(wells, seed))
+    soha_priorities.CURRENT_TELEMETRY=soha_priorities.RunTelemetry()
+    try:
+        soha_priorities.fetch_run_sources(soha_priorities.pull_well_specific_data)
+        stages=soha_priorities.CURRENT_TELEMETRY.report()['stages']
+    finally:
+        soha_priorities.CURRENT_TELEMETRY=None
+    return sorted((stage['stage'][len('pull:'):], stage['raw_bytes'], stage['bytes']) for stage in stages
+                  if stage['stage'].startswith('pull:') and stage['error'] is None)
+
+def child_peak_rss(wells, seed, schema):
+    """
+    Peak RSS of the pipeline (bench_pipeline.run_pipeline(), a whole run through main()) in a fresh process, with or
+    without the schemas.
+    """
+    command=[sys.executable, os.path.abspath(__file__), '--child', '--wells', str(wells), '--seed', str(seed)]
+    output=subprocess.run(command+([] if schema else ['--no-schema']), check=True, capture_output=True, text=True).stdout
+    return int(output.split()[-1])
+
+def main():
+    parser=argparse.ArgumentParser(description='Benchmark the memory saved by the ingest schemas.')
+    parser.add_argument('--wells', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rss', action='store_true', help='also compare the peak RSS of the pipeline with and without the schemas')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--no-schema', action='store_true', help=argparse.SUPPRESS)
+    args=parser.parse_args()
+    if args.child:
+        if args.no_schema:
+            soha_priorities.SOURCE_SCHEMAS.clear()
+            soha_priorities.PRIORITY_SCHEMA.clear()
+        run_pipeline(args.wells[0], args.seed)
+        print(soha_priorities.peak_rss_bytes())
+        return
+    for wells in args.wells:
+        print('\n%d wells' % wells)
+        print('%-26s %12s %12s %8s' % ('source', 'raw MB', 'schema MB', 'saved'))
+        report=pull_memory(wells, args.seed)
+        for name, raw_bytes, compact_bytes in report+[('total', sum(r[1] for r in report), sum(r[2] for r in report))]:
+            print('%-26s %12.1f %12.1f %7.0f%%' % (name, raw_bytes/2**20, compact_bytes/2**20, 100*(1-compact_bytes/max(raw_bytes, 1))))
+        if args.rss:
+            raw_rss, compact_rss=child_peak_rss(wells, args.seed, False), child_peak_rss(wells, args.seed, True)
+            print('%-26s %12.1f %12.1f %7.0f%%' % ('pipeline peak RSS', raw_rss/2**20, compact_rss/2**20, 100*(1-compact_rss/raw_rss)))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Scaling benchmark of job sequencing (Job_Rank and JobTime), grouped by Route and by Grouper, on synthetic open jobs
+spread over the fleet. With --brute-force the KD tree is switched off, to compare against every group being searched
+job by job. Time per job should stay roughly flat as the jobs grow.
+
+Run from the repository root: python benchmarks/bench_sequence.py --jobs 10000 50000 100000
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+BENCHMARK_DIR=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, 'stand_in'))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+import soha_priorities
+from synthetic_fleet import WELLS_PER_ROUTE
+
+def open_jobs(jobs, seed=0):
+    """
+    Coordinates, Route, Grouper, PriorityLevel and PriorityType of synthetic open jobs. Routes cover neighbouring
+    wells, and about one well in five has a second job on the same site.
+    """
+    rng=np.random.default_rng(seed)
+    wells=max(int(jobs*.8), 1)
+    well_numbers=np.concatenate([np.arange(wells), rng.integers(0, wells, jobs-wells)])
+    #Wells are laid out route by route across a 2x2 degree patch, so each route covers one area of it
+    routes=well_numbers//WELLS_PER_ROUTE
+    route_count=routes.max()+1
+    side=int(np.ceil(np.sqrt(route_count)))
+    latitude=31+2*((routes//side)+rng.random(jobs))/side
+    longitude=-94.5+2*((routes%side)+rng.random(jobs))/side
+    groupers=rng.choice(soha_priorities.GROUPER_GROUPS, jobs)
+    levels=rng.choice([1., 2., 3., 4., 5.], jobs, p=[.05, .15, .25, .25, .3])
+    priority_types=rng.choice(list(soha_priorities.JOB_SERVICE_MINUTES), jobs)
+    return latitude, longitude, {'Route': routes, 'Grouper': groupers}, levels, priority_types
+
+def main():
+    parser=argparse.ArgumentParser(description='Benchmark job sequencing as the open jobs grow.')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[10000, 50000, 100000])
+    parser.add_argument('--by', nargs='+', default=['Route', 'Grouper'], choices=['Route', 'Grouper'])
+    parser.add_argument('--brute-force', action='store_true', help='sequence without the KD tree')
+    parser.add_argument('--seed', type=int, default=0)
+    args=parser.parse_args()
+    if args.brute_force:
+        soha_priorities.JOB_BRUTE_FORCE_LIMIT=float('inf')
+    print('%-8s %10s %8s %10s %12s %14s' % ('by', 'jobs', 'groups', 'seconds', 'us/job', 'mean JobTime'))
+    for by in args.by:
+        for jobs in args.jobs:
+            latitude, longitude, groups, levels, priority_types=open_jobs(jobs, args.seed)
+            start=time.perf_counter()
+            ranks, ranked, minutes=soha_priorities.sequence_jobs(latitude, longitude, groups[by], levels, priority_types)
+            seconds=time.perf_counter()-start
+            print('%-8s %10d %8d %10.3f %12.1f %14.1f' % (by, jobs, len(np.unique(groups[by])), seconds,
+                                                         seconds/jobs*1e6, np.nanmean(minutes)))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+In-process stand-in for sql_helpers, for benchmarking soha_priorities.py without the EDH/ODS servers. Put this 
+directory first on sys.path, load a fleet with load_fleet(), and every pull is served from memory. Pushes are kept
+in PUSHES instead of being written anywhere.
+"""
+import time
+
+#Query file to frame, see synthetic_fleet.build_fleet()
+FRAMES={}
+#(schema, table, frame) for every push
+PUSHES=[]
+#Simulated round trip per pull, in seconds, by query file
+LATENCY={}
+
+def load_fleet(frames):
+    """
+    Serve the given frames for every following pull, and forget earlier pushes.
+    """
+    FRAMES.clear()
+    FRAMES.update(frames)
+    PUSHES.clear()
+
+def _pull(query):
+    time.sleep(LATENCY.get(query, 0))
+    #Every real pull returns a new frame, and the pipeline is free to modify it
+    return FRAMES[query].copy()
+
+def pull_data_from_sql_query_future_state(query, server):
+    return _pull(query)
+
+def pull_data_from_sql_query_arrow_future_state(query):
+    return _pull(query)
+
+def pull_data_from_sql_query_current_state(query):
+    return _pull(query)
+
+def sql_push_future_state_arrow_test(df, table, schema, if_exists, database):
+    PUSHES.append((schema, table, df))
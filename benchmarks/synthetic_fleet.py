@@ -0,0 +1,80 @@
+"""
+Synthetic SoHa fleet for benchmarking. build_fleet() returns a frame for every .sql file soha_priorities.py pulls,
+with the same columns (and roughly the same types) as the production queries, scaled to any number of wells.
+"""
+import numpy as np
+import pandas as pd
+
+AREAS=['Area 1', 'Area 2', 'Area 3', 'Area 4', 'Area 5', 'Area 6']
+#Roughly how many wells a lease operator covers on one route
+WELLS_PER_ROUTE=150
+CHOKE_STATUS_TYPES=['Producing', 'Down - Weather', 'Down - Mechanical', 'Down - Midstream', 'Shut In']
+CHOKE_STATUS_ACTIONS=['Waiting on Engineering', 'Operations - Troubleshoot', 'No Action', 'Maintenance - Compressor', 
+                      'Natural Decline', 'Midstream Constraint', 'Work Complete', 'Waiting on Optimization', 
+                      'Waiting on Construction', 'TA - P&A Candidate']
+#Share of wells that show up in the sparser sources
+FLOOD_SHARE=.05
+WORK_MANAGEMENT_SHARE=.03
+
+def build_fleet(wells, seed=0, calc_date='2021-06-01'):
+    """
+    Build a dictionary of query file to synthetic frame for a fleet of the given number of wells.
+    """
+    rng=np.random.default_rng(seed)
+    calc_date=pd.Timestamp(calc_date)
+    well_numbers=np.arange(wells)
+    corp_ids=pd.Series(well_numbers).map('SOHA%07d'.__mod__).values
+    apis=pd.Series(well_numbers).map('17%08d0000'.__mod__).values
+    api10=pd.Series(apis).str[:10].values
+    well_names=pd.Series(well_numbers).map('SOHA WELL %d'.__mod__).values
+    areas=np.array(AREAS, dtype=object)[well_numbers*len(AREAS)//max(wells, 1)]
+    routes=pd.Series(well_numbers//WELLS_PER_ROUTE).map('Route %d'.__mod__).values
+    clean_average=rng.gamma(2, 400, wells)
+    frames={}
+    frames['well_metadata.sql']=pd.DataFrame({'WellName': well_names,
+                                              'Corp_ID': corp_ids,
+                                              'Facility_ID': 100000+well_numbers,
+                                              'Area': areas,
+                                              'Route': routes,
+                                              'Latitude': 31+rng.random(wells)*2,
+                                              'Longitude': -94.5+rng.random(wells)*2,
+                                              'API': apis})
+    frames['most_recent_well_coding.sql']=pd.DataFrame({'apinumber': api10,
+                                                        'chokeStatusCreatedBy': rng.choice(['jdoe', 'asmith', 'bwayne'], wells),
+                                                        'chokeStatusDate': calc_date-pd.to_timedelta(rng.integers(0, 365, wells), unit='D'),
+                                                        'chokeStatusType': rng.choice(CHOKE_STATUS_TYPES, wells, p=[.7, .05, .1, .1, .05]),
+                                                        'chokeStatusAction': rng.choice(CHOKE_STATUS_ACTIONS, wells),
+                                                        'chokeStatusComments': rng.choice(['', 'Checked on site', 'See work order'], wells)})
+    frames['yday_production_soha.sql']=pd.DataFrame({'Corp_ID': corp_ids,
+                                                     'production_date_utc': (calc_date-pd.Timedelta(days=1)).strftime('%Y-%m-%d'),
+                                                     'wellhead_extrapolated_24_hr_gas': clean_average*rng.normal(.95, .2, wells).clip(0)})
+    frames['clean_average.sql']=pd.DataFrame({'Corp_ID': corp_ids,
+                                              'CleanAvgGas': clean_average,
+                                              'CleanAvgLowerBoundGas': clean_average*.85})
+    flooding=rng.choice(wells, int(wells*FLOOD_SHARE), replace=False)
+    frames['Flood_Priorities_Prediction.sql']=pd.DataFrame({'API': apis[flooding],
+                                                            'WellName': well_names[flooding],
+                                                            'HoursUntilFlood': rng.random(len(flooding))*120,
+                                                            'AffectedFloodHeight': rng.random(len(flooding))*6,
+                                                            'EarliestPredictedFloodDate': calc_date+pd.to_timedelta(rng.integers(0, 120, len(flooding)), unit='h')})
+    work_orders=rng.choice(wells, int(wells*WORK_MANAGEMENT_SHARE), replace=False)
+    frames['work_management_entries.sql']=pd.DataFrame({'APINumber': api10[work_orders],
+                                                        'Route': routes[work_orders],
+                                                        'workOrderDescription': rng.choice(['Replace dump valve', 'Check separator', 'Repair fence'], len(work_orders)),
+                                                        'workOrderPriorityLevel': rng.choice([1, 2, 3, 4, 5, np.nan], len(work_orders)),
+                                                        'workOrderRequester': rng.choice(['jdoe', 'asmith', 'bwayne'], len(work_orders))})
+    frames['site_inspections.sql']=pd.DataFrame({'APINumber': api10,
+                                                 'DaysSinceLastInspection': rng.integers(0, 120, wells)})
+    #RTU values come back as text
+    frames['rtu_battery_voltages.sql']=pd.DataFrame({'Corp_ID': corp_ids,
+                                                     'Meter': pd.Series(well_numbers).map('M%07d'.__mod__).values,
+                                                     'LastBatteryVoltageReading': calc_date,
+                                                     'BatteryVoltage': rng.normal(12.8, .8, wells).round(2).astype(str)})
+    frames['percent_successful_comms.sql']=pd.DataFrame({'Corp_ID': corp_ids,
+                                                         'Meter': frames['rtu_battery_voltages.sql']['Meter'].values,
+                                                         'LastPercentSuccessfulCommsReading': calc_date,
+                                                         'PercentSuccessfulComms': (100-rng.exponential(10, wells)).clip(0).round(1).astype(str)})
+    frames['cumulative_deferment.sql']=pd.DataFrame({'CorpID': corp_ids,
+                                                     'CumulativeDeferment': rng.gamma(1, 1500, wells),
+                                                     'ConsecutiveDaysDeferring': rng.integers(0, 30, wells)})
+    return frames
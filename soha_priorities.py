@@ -1,78 +1,1360 @@
 import sql_helpers
+import numpy as np
 import pandas as pd
+import sqlalchemy
+import argparse
+import contextlib
+import cProfile
+import fnmatch
+import hashlib
+import json
+import logging
+import math
+import operator
+import os
+import re
+import string
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+try:
+    import resource
+except ImportError:
+    resource=None
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa=None
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree=None
 
-def pull_well_specific_data():
+#Failures that are handled and don't stop the run (a dropped priority source, a failed service cycle) are logged here
+LOGGER=logging.getLogger('soha_priorities')
+
+#Every SQL pull the priority run makes, keyed by source name: (query file, target server).
+#'Arrow' pulls go through the arrow future state helper, 'CurrentState' pulls through the current state helper.
+SQL_SOURCES={'well_metadata': ('well_metadata.sql', 'EnterpriseDataHub'),
+             'well_codes': ('most_recent_well_coding.sql', 'ODS'),
+             'yday_gas_production': ('yday_production_soha.sql', 'EnterpriseDataHub'),
+             'clean_average': ('clean_average.sql', 'Arrow'),
+             'flood_data': ('Flood_Priorities_Prediction.sql', 'Arrow'),
+             'work_management': ('work_management_entries.sql', 'ODS'),
+             'site_inspections': ('site_inspections.sql', 'ODS'),
+             'battery_voltages': ('rtu_battery_voltages.sql', 'EnterpriseDataHub'),
+             'percent_successful_comms': ('percent_successful_comms.sql', 'EnterpriseDataHub'),
+             'cumulative_deferment': ('cumulative_deferment.sql', 'CurrentState')}
+
+#Declare the site manager so he can be assigned specific 'site manager' priorities
+SITE_MANAGER='name'
+
+#Sources that are independent of each other and are fetched up front by main(). Only the well index's sources and 
+#the inputs of the enabled priority sources (see PRIORITY_SOURCES) are fetched.
+PRIORITY_RUN_SOURCES=['well_metadata', 'well_codes', 'yday_gas_production', 'clean_average', 'flood_data',
+                      'work_management', 'site_inspections', 'battery_voltages', 'percent_successful_comms']
+#Sources behind the well index
+WELL_INDEX_SOURCES=['well_metadata', 'well_codes', 'yday_gas_production', 'clean_average']
+
+#Concurrency settings for the fetch stage. Deadlines are in seconds from the start of the fetch stage, and a
+#source that misses its deadline only drops the priority type(s) built from it. Pushed down pulls (see 
+#SOURCE_PUSHDOWN) also pass what's left of their deadline to the driver as a query timeout, so the database stops 
+#them. Pulls through the sql_helpers functions can't be interrupted: one that misses its deadline keeps running on
+#its fetch thread and holds its server slot until it returns, and the interpreter still waits for it at exit, so 
+#the deadlines don't bound the wall time of a CLI run.
+FETCH_MAX_WORKERS=8
+FETCH_MAX_PER_SERVER=2
+FETCH_DEFAULT_DEADLINE=600
+FETCH_DEADLINES={'flood_data': 300,
+                 'battery_voltages': 180,
+                 'percent_successful_comms': 180}
+
+#Run telemetry settings. Every run writes a JSON report of its stages to SOHA_RUN_REPORT, and a Prometheus text 
+#file to SOHA_PROMETHEUS_FILE if it's set. SOHA_PROFILE_STAGES is a comma separated list of stage name patterns 
+#(e.g. 'rules:*,push:*') to run under cProfile and tracemalloc, with the profiles written next to the report.
+RUN_REPORT_PATH=os.environ.get('SOHA_RUN_REPORT', 'run_report.json')
+PROMETHEUS_PATH=os.environ.get('SOHA_PROMETHEUS_FILE')
+PROFILE_STAGES=[pattern for pattern in os.environ.get('SOHA_PROFILE_STAGES', '').split(',') if pattern]
+#Telemetry of the run in progress, set by main()
+CURRENT_TELEMETRY=None
+
+def peak_rss_bytes():
+    """
+    Peak resident memory of the process so far, or None where the resource module isn't available (Windows).
+    """
+    if resource is None:
+        return None
+    peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #Linux reports kilobytes, macOS bytes
+    return peak if sys.platform=='darwin' else peak*1024
+
+def frame_bytes(df):
+    """
+    Memory used by a frame, including the strings in object columns.
+    """
+    return int(df.memory_usage(deep=True, index=False).sum())
+
+class RunTelemetry:
+    """
+    Metrics for every stage of one priority run: wall time, rows in and out, bytes, the process' peak RSS and the
+    error class if the stage failed. Stages can be recorded from several threads at once.
+    """
+    
+    def __init__(self, profile_stages=PROFILE_STAGES, profile_dir=None):
+        self.started=datetime.now()
+        self.start=time.perf_counter()
+        self.stages=[]
+        self.lock=threading.Lock()
+        self.profile_stages=list(profile_stages)
+        self.profile_dir=profile_dir or os.path.dirname(os.path.abspath(RUN_REPORT_PATH))
+        #Profilers don't nest, so only the outermost matching stage in a thread is profiled
+        self.profiling=threading.local()
+    
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Record a stage. The stage fills in record['rows_out'] (and record['bytes'] where it applies) itself.
+        An exception is recorded with its class and re-raised.
+        """
+        record={'stage': name, 'rows_in': rows_in, 'rows_out': None, 'bytes': None, 'seconds': None, 
+                'peak_rss_bytes': None, 'error': None}
+        profiler=self.start_profile(name)
+        start=time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record['error']=type(e).__name__
+            record['error_message']=str(e)[:500]
+            raise
+        finally:
+            record['seconds']=time.perf_counter()-start
+            if profiler is not None:
+                self.stop_profile(record, *profiler)
+            record['peak_rss_bytes']=peak_rss_bytes()
+            with self.lock:
+                self.stages.append(record)
+    
+    def start_profile(self, name):
+        """
+        Start cProfile and tracemalloc if the stage matches one of the profile patterns.
+        """
+        if getattr(self.profiling, 'active', False) or not any(fnmatch.fnmatch(name, p) for p in self.profile_stages):
+            return None
+        profiler=cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            #Another thread's profiler is already active
+            return None
+        self.profiling.active=True
+        started_tracing=not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        return profiler, started_tracing
+    
+    def stop_profile(self, record, profiler, started_tracing):
+        """
+        Stop profiling a stage, write its cProfile stats and record its traced peak memory.
+        """
+        profiler.disable()
+        self.profiling.active=False
+        record['traced_peak_bytes']=tracemalloc.get_traced_memory()[1]
+        if started_tracing:
+            tracemalloc.stop()
+        os.makedirs(self.profile_dir, exist_ok=True)
+        record['profile']=os.path.join(self.profile_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', record['stage'])+'.prof')
+        profiler.dump_stats(record['profile'])
+    
+    def report(self):
+        """
+        The run report, as a JSON serializable dictionary.
+        """
+        with self.lock:
+            stages=list(self.stages)
+        return {'run_started': self.started.strftime("%Y-%m-%d %H:%M:%S"),
+                'run_seconds': time.perf_counter()-self.start,
+                'peak_rss_bytes': peak_rss_bytes(),
+                'failed_stages': [stage['stage'] for stage in stages if stage['error'] is not None],
+                'stages': stages}
+    
+    def write_report(self, path):
+        """
+        Write the run report as JSON.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+    
+    def prometheus_text(self):
+        """
+        The run report in the Prometheus text format, with stages that ran several times summed.
+        """
+        report=self.report()
+        metrics={'soha_stage_seconds': ('Wall time of each pipeline stage', 'seconds'),
+                 'soha_stage_rows_in': ('Rows going into each pipeline stage', 'rows_in'),
+                 'soha_stage_rows_out': ('Rows coming out of each pipeline stage', 'rows_out'),
+                 'soha_stage_bytes': ('Bytes fetched or pushed by each pipeline stage', 'bytes'),
+                 'soha_stage_raw_bytes': ('Bytes fetched by each pull before its schema was applied', 'raw_bytes'),
+                 'soha_stage_failures': ('Failed runs of each pipeline stage', 'error')}
+        lines=[]
+        for metric, (description, field) in metrics.items():
+            lines+=['# HELP '+metric+' '+description, '# TYPE '+metric+' gauge']
+            totals={}
+            for stage in report['stages']:
+                if field=='error':
+                    value=0 if stage['error'] is None else 1
+                elif stage.get(field) is None:
+                    continue
+                else:
+                    value=stage[field]
+                totals[stage['stage']]=totals.get(stage['stage'], 0)+value
+            lines+=['%s{stage="%s"} %s' % (metric, name.replace('"', "'"), value) for name, value in totals.items()]
+        lines+=['# HELP soha_run_seconds Wall time of the priority run', '# TYPE soha_run_seconds gauge',
+                'soha_run_seconds %s' % report['run_seconds']]
+        if report['peak_rss_bytes'] is not None:
+            lines+=['# HELP soha_run_peak_rss_bytes Peak resident memory of the priority run', 
+                    '# TYPE soha_run_peak_rss_bytes gauge', 'soha_run_peak_rss_bytes %s' % report['peak_rss_bytes']]
+        return '\n'.join(lines)+'\n'
+
+def telemetry_stage(name, rows_in=None):
+    """
+    Record a stage on the current run's telemetry. Outside of a run (e.g. when a generator is called on its own)
+    nothing is recorded.
+    """
+    if CURRENT_TELEMETRY is None:
+        return contextlib.nullcontext({})
+    return CURRENT_TELEMETRY.stage(name, rows_in)
+
+#Snapshot cache settings. Pulls can be stored as parquet snapshots keyed by target server and query file.
+#SOHA_SNAPSHOT_MODE is 'live' (always query, never touch snapshots), 'cache' (reuse snapshots younger than their 
+#TTL, refresh the rest) or 'replay' (run entirely off stored snapshots with no database access, pushes included).
+#Production runs are live: the TTLs are wall clock, so a daily run that starts a little earlier than the day before
+#would reuse yesterday's production, and the deferment state would lose a day. Cache and replay are for development.
+SNAPSHOT_DIR=os.environ.get('SOHA_SNAPSHOT_DIR', 'snapshots')
+SNAPSHOT_MODE=os.environ.get('SOHA_SNAPSHOT_MODE', 'live')
+#How long each source's snapshot stays fresh in cache mode, in seconds. Sources without an entry are never cached.
+SNAPSHOT_TTLS={'well_metadata': 24*3600,
+               'well_codes': 3600,
+               'yday_gas_production': 24*3600,
+               'clean_average': 24*3600,
+               'flood_data': 3600,
+               'work_management': 15*60,
+               'site_inspections': 6*3600,
+               'battery_voltages': 5*60,
+               'percent_successful_comms': 5*60,
+               'cumulative_deferment': 24*3600}
+
+def snapshot_path(name, snapshot_dir=None, variant=''):
+    """
+    Path of the parquet snapshot for a source, e.g. snapshots/EnterpriseDataHub/well_metadata.parquet. Pulls narrowed
+    to a list of wells (see pull_variant()) are stored under their own variant, e.g. site_inspections.3f2a9c01d4e7.parquet
+    """
+    query, server=SQL_SOURCES[name]
+    return os.path.join(snapshot_dir or SNAPSHOT_DIR, server, os.path.splitext(query)[0]+variant+'.parquet')
+
+def snapshot_is_fresh(name, snapshot_dir=None, variant=''):
+    """
+    Check if a source has a snapshot on disk that is younger than its TTL.
+    """
+    path=snapshot_path(name, snapshot_dir, variant)
+    if name not in SNAPSHOT_TTLS or not os.path.exists(path):
+        return False
+    return time.time()-os.path.getmtime(path)<SNAPSHOT_TTLS[name]
+
+def prune_variant_snapshots(name, snapshot_dir=None):
+    """
+    Delete a source's variant snapshots (see pull_variant()) that are past its TTL. Every run narrows its keyed pulls
+    to its own wells, so without this a cached source would gain a new variant on nearly every run.
+    """
+    path=snapshot_path(name, snapshot_dir)
+    directory=os.path.dirname(path)
+    variant=re.compile(re.escape(os.path.splitext(os.path.basename(path))[0])+r'\.[0-9a-f]{12}\.parquet$')
+    expired=time.time()-SNAPSHOT_TTLS[name]
+    for file in os.listdir(directory):
+        variant_path=os.path.join(directory, file)
+        try:
+            if variant.match(file) and os.path.getmtime(variant_path)<expired:
+                os.remove(variant_path)
+        except FileNotFoundError:
+            #Pruned by a concurrent pull
+            pass
+
+def write_snapshot(df, path):
+    """
+    Write a pulled frame to its snapshot. The file is written next to the target and swapped in, so a concurrent
+    reader never sees a partial snapshot.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path=path+'.%d.tmp' % threading.get_ident()
+    df.to_parquet(temp_path, index=False)
+    os.replace(temp_path, path)
+
+#Declared column types of every source, applied once as the frame is pulled (see apply_schema()). Repeated text is
+#categorical, dates are parsed, and numbers downcast: 'integer' to the smallest integer type that holds them (nulls
+#keep them as floats), sensor readings to float32. Gas volumes stay float64, since deferment is the difference of two
+#of them. Columns a source doesn't return are skipped, and columns left out keep the type they came with.
+SOURCE_SCHEMAS={'well_metadata': {'Facility_ID': 'integer', 'Area': 'category', 'Route': 'category',
+                                  'Latitude': 'float64', 'Longitude': 'float64'},
+                'well_codes': {'chokeStatusCreatedBy': 'category', 'chokeStatusDate': 'datetime',
+                               'chokeStatusType': 'category', 'chokeStatusAction': 'category'},
+                'yday_gas_production': {'production_date_utc': 'datetime', 'wellhead_extrapolated_24_hr_gas': 'float64'},
+                'clean_average': {'CleanAvgGas': 'float64', 'CleanAvgLowerBoundGas': 'float64'},
+                'flood_data': {'HoursUntilFlood': 'float32', 'AffectedFloodHeight': 'float32',
+                               'EarliestPredictedFloodDate': 'datetime'},
+                'work_management': {'Route': 'category', 'workOrderPriorityLevel': 'float32', 'workOrderRequester': 'category'},
+                'site_inspections': {'DaysSinceLastInspection': 'integer'},
+                'battery_voltages': {'LastBatteryVoltageReading': 'datetime', 'BatteryVoltage': 'float32'},
+                'percent_successful_comms': {'LastPercentSuccessfulCommsReading': 'datetime', 'PercentSuccessfulComms': 'float32'},
+                'cumulative_deferment': {'CumulativeDeferment': 'float64', 'ConsecutiveDaysDeferring': 'integer'}}
+#How each declared type is applied. Values that don't parse become nulls.
+SCHEMA_CONVERTERS={'category': lambda values: values.astype('category'),
+                   'datetime': lambda values: pd.to_datetime(values, errors='coerce'),
+                   'integer': lambda values: pd.to_numeric(values, errors='coerce', downcast='integer'),
+                   'float32': lambda values: pd.to_numeric(values, errors='coerce').astype('float32'),
+                   'float64': lambda values: pd.to_numeric(values, errors='coerce').astype('float64')}
+
+def apply_schema(df, schema):
+    """
+    Convert a frame's columns to their declared types, in place. Converting a column that already has its type
+    changes nothing, so a schema can be applied to a snapshot that was stored with it.
+    """
+    for column, kind in schema.items():
+        if column in df.columns:
+            df[column]=SCHEMA_CONVERTERS[kind](df[column])
+    return df
+
+#Predicate and projection pushdown. Each source can declare the columns the priority run uses, filters that drop rows 
+#no priority can come from (column, operator, value), and its well key as (column, 'API' or 'Corp_ID'), so a pull can
+#be narrowed to the wells in the current well metadata. Where sql_helpers can hand out an
+#engine for the source's server (get_future_state_engine()) and the .sql file is in SQL_QUERY_DIR, the query is run as
+#a subquery with the columns, filters and keys applied by the database. Otherwise, or if the database rejects the 
+#subquery, the whole result is pulled and they are applied locally, so a source comes out the same either way. 
+#Sources with 'local_filters': False only have their filters applied by the database, a whole pull is filtered by 
+#their priority generator instead. SOHA_PUSHDOWN=0 turns pushdown off.
+PUSHDOWN_ENABLED=os.environ.get('SOHA_PUSHDOWN', '1')!='0'
+SQL_QUERY_DIR=os.environ.get('SOHA_SQL_DIR', '.')
+#Key lists longer than this aren't sent to the database (the filtering is left to the joins on the well index)
+PUSHDOWN_MAX_KEYS=2000
+SOURCE_PUSHDOWN={'well_metadata': {'columns': ['WellName', 'Corp_ID', 'Facility_ID', 'Area', 'Route', 'Latitude', 'Longitude', 'API']},
+                 'well_codes': {'columns': ['apinumber', 'chokeStatusCreatedBy', 'chokeStatusDate', 'chokeStatusType', 
+                                            'chokeStatusAction', 'chokeStatusComments']},
+                 'yday_gas_production': {'columns': ['Corp_ID', 'production_date_utc', 'wellhead_extrapolated_24_hr_gas']},
+                 'clean_average': {'columns': ['Corp_ID', 'CleanAvgGas', 'CleanAvgLowerBoundGas']},
+                 'flood_data': {'columns': ['API', 'HoursUntilFlood', 'AffectedFloodHeight', 'EarliestPredictedFloodDate']},
+                 'work_management': {'columns': ['APINumber', 'Route', 'workOrderDescription', 'workOrderPriorityLevel', 
+                                                 'workOrderRequester'],
+                                     'well_key': ('APINumber', 'API')},
+                 'site_inspections': {'columns': ['APINumber', 'DaysSinceLastInspection'],
+                                      'filters': [('DaysSinceLastInspection', '>', 60)],
+                                      'well_key': ('APINumber', 'API')},
+                 #A meter is an RTU issue if either reading is bad, so both are filtered after they're joined unless the
+                 #database filtered them, see complete_rtu_readings()
+                 'battery_voltages': {'columns': ['Corp_ID', 'Meter', 'LastBatteryVoltageReading', 'BatteryVoltage'],
+                                      'filters': [('BatteryVoltage', '<=', 11)], 'local_filters': False,
+                                      'well_key': ('Corp_ID', 'Corp_ID')},
+                 'percent_successful_comms': {'columns': ['Corp_ID', 'Meter', 'LastPercentSuccessfulCommsReading', 'PercentSuccessfulComms'],
+                                              'filters': [('PercentSuccessfulComms', '<=', 75)], 'local_filters': False,
+                                              'well_key': ('Corp_ID', 'Corp_ID')},
+                 'cumulative_deferment': {'columns': ['CorpID', 'CumulativeDeferment', 'ConsecutiveDaysDeferring'],
+                                          'filters': [('ConsecutiveDaysDeferring', '>', 5), ('CumulativeDeferment', '>=', 1000)],
+                                          'well_key': ('CorpID', 'Corp_ID')}}
+#Filter operators, on SQL expressions and pandas columns alike
+PUSHDOWN_OPERATORS={'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '==': operator.eq}
+#Engines for pushed down pulls, created once per server
+SOURCE_ENGINES={}
+
+def source_keys(name, keys):
+    """
+    The well keys a pull of this source is narrowed to, out of keys (a dictionary of 'API' and 'Corp_ID' to key 
+    lists), or None if the source has no well key or no keys were given.
+    """
+    pushdown=SOURCE_PUSHDOWN.get(name, {})
+    if not PUSHDOWN_ENABLED or keys is None or 'well_key' not in pushdown:
+        return None
+    return keys[pushdown['well_key'][1]]
+
+def pull_variant(name, keys=None, filtered=True):
+    """
+    A suffix that tells apart pulls of a source narrowed to different wells (or left unfiltered), for snapshot paths.
+    Empty for the plain pull.
+    """
+    source_key_list=source_keys(name, keys)
+    if source_key_list is None and filtered:
+        return ''
+    digest=hashlib.sha1(json.dumps([sorted(map(str, source_key_list or [])), filtered]).encode()).hexdigest()
+    return '.'+digest[:12]
+
+def pushdown_statement(name, query_text, keys=None, filtered=True):
+    """
+    The source's query as a subquery, with its declared columns, filters and well keys (see SOURCE_PUSHDOWN) applied.
+    Filters on columns the schema declares as numbers compare them as floats, since some come back as text.
+    """
+    pushdown=SOURCE_PUSHDOWN[name]
+    schema=SOURCE_SCHEMAS.get(name, {})
+    source=sqlalchemy.text(query_text).columns(*[sqlalchemy.column(c) for c in pushdown['columns']]).subquery('source')
+    conditions=[]
+    for column, op, value in pushdown.get('filters', []) if filtered else []:
+        expression=source.c[column]
+        if schema.get(column) in ['integer', 'float32', 'float64']:
+            expression=sqlalchemy.cast(expression, sqlalchemy.Float)
+        conditions.append(PUSHDOWN_OPERATORS[op](expression, value))
+    source_key_list=source_keys(name, keys)
+    if source_key_list is not None and len(source_key_list)<=PUSHDOWN_MAX_KEYS:
+        conditions.append(source.c[pushdown['well_key'][0]].in_(list(source_key_list)))
+    return sqlalchemy.select(*source.c).where(*conditions)
+
+def pushdown_filter(df, name):
+    """
+    Whether each row of a frame passes the source's filters (see SOURCE_PUSHDOWN), as a boolean array. A row missing
+    a filtered column's value doesn't.
+    """
+    keep=np.ones(len(df), dtype=bool)
+    for column, op, value in SOURCE_PUSHDOWN[name].get('filters', []):
+        keep&=PUSHDOWN_OPERATORS[op](df[column], value).to_numpy(dtype=bool, na_value=False)
+    return keep
+
+def apply_pushdown(df, name, keys=None, filtered=True):
+    """
+    Apply a source's declared columns, filters and well keys to a pulled frame (see SOURCE_PUSHDOWN). A frame they
+    were already pushed down into comes out unchanged.
+    """
+    pushdown=SOURCE_PUSHDOWN.get(name)
+    if not PUSHDOWN_ENABLED or pushdown is None:
+        return df
+    keep=np.ones(len(df), dtype=bool)
+    if filtered and pushdown.get('local_filters', True):
+        keep&=pushdown_filter(df, name)
+    source_key_list=source_keys(name, keys)
+    if source_key_list is not None:
+        #A hash lookup, which is much quicker than isin() on long key lists
+        keep&=pd.Index(source_key_list).unique().get_indexer(df[pushdown['well_key'][0]])>=0
+    return df.loc[keep, [c for c in pushdown['columns'] if c in df.columns]].reset_index(drop=True)
+
+def source_engine(server):
+    """
+    The engine pushed down pulls against a server go through, or None if sql_helpers can't provide one.
+    """
+    if server in ['Arrow', 'CurrentState'] or not hasattr(sql_helpers, 'get_future_state_engine'):
+        return None
+    if server not in SOURCE_ENGINES:
+        SOURCE_ENGINES[server]=sql_helpers.get_future_state_engine(server)
+    return SOURCE_ENGINES[server]
+
+def pushdown_engine(name):
+    """
+    The engine a source's pull is pushed down through (see SOURCE_PUSHDOWN), or None if it will be pulled whole.
+    """
+    query, server=SQL_SOURCES[name]
+    if not PUSHDOWN_ENABLED or name not in SOURCE_PUSHDOWN or not os.path.exists(os.path.join(SQL_QUERY_DIR, query)):
+        return None
+    return source_engine(server)
+
+@contextlib.contextmanager
+def query_timeout(connection, seconds):
+    """
+    Give a connection's queries a timeout in seconds, where the driver supports one (pyodbc's Connection.timeout). 
+    The pooled connection gets its previous timeout back afterwards.
+    """
+    dbapi_connection=connection.connection.dbapi_connection
+    if seconds is None or not hasattr(dbapi_connection, 'timeout'):
+        yield connection
+        return
+    previous=dbapi_connection.timeout
+    #0 means no timeout to pyodbc, so a pull that's already out of time gets the shortest one instead
+    dbapi_connection.timeout=max(1, int(math.ceil(seconds)))
+    try:
+        yield connection
+    finally:
+        dbapi_connection.timeout=previous
+
+def query_sql_source(name, keys=None, filtered=True, timeout=None):
+    """
+    Pull a single SQL source by name, routing it to the sql_helpers function for its target server. The source's 
+    pushdown (see SOURCE_PUSHDOWN) goes to the database where it can, with a query timeout of timeout seconds, and 
+    the second return value says whether it did. A query that can't be run as a subquery (a CTE, an ORDER BY or a 
+    trailing comment on SQL Server, say) is logged and pulled whole instead.
+    """
+    engine=pushdown_engine(name)
+    if engine is not None:
+        with open(os.path.join(SQL_QUERY_DIR, SQL_SOURCES[name][0])) as f:
+            query_text=f.read().strip().rstrip(';')
+        start=time.monotonic()
+        try:
+            with engine.connect() as connection, query_timeout(connection, timeout):
+                return pd.read_sql(pushdown_statement(name, query_text, keys, filtered), connection), True
+        except (sqlalchemy.exc.DBAPIError, pd.errors.DatabaseError):
+            #pandas wraps the driver's error in a DatabaseError. A query the database stopped at its timeout isn't run again
+            if timeout is not None and time.monotonic()-start>=timeout:
+                raise
+            LOGGER.warning('The database rejected the pushed down pull of %s, pulling it whole', name, exc_info=True)
+    return query_all_sql_source(name), False
+
+def query_all_sql_source(name):
+    """
+    Pull a source's whole result set through the sql_helpers function for its target server.
+    """
+    query, server=SQL_SOURCES[name]
+    if server=='Arrow':
+        return sql_helpers.pull_data_from_sql_query_arrow_future_state(query)
+    if server=='CurrentState':
+        return sql_helpers.pull_data_from_sql_query_current_state(query)
+    return sql_helpers.pull_data_from_sql_query_future_state(query, server)
+
+def pull_sql_source(name, mode=None, keys=None, filtered=True, timeout=None):
+    """
+    Pull a single SQL source by name through the snapshot cache (see SNAPSHOT_MODE), with its declared schema applied
+    (see SOURCE_SCHEMAS), narrowed by its pushdown (see SOURCE_PUSHDOWN) to the wells in keys and, unless filtered is
+    False, to the rows that pass its filters. A database query that can take a timeout is given timeout seconds. The 
+    pull's telemetry has the frame's memory before (raw_bytes) and after (bytes) the schema and pushdown. The frame's 
+    attrs['pulled_at'] is when its data was pulled from the database (for a snapshot, when the snapshot was written),
+    and attrs['pushed_down'] whether the database applied its pushdown (snapshots keep it).
+    """
+    mode=mode or SNAPSHOT_MODE
+    variant=pull_variant(name, keys, filtered)
+    path=snapshot_path(name, variant=variant)
+    with telemetry_stage('pull:'+name) as record:
+        #Replay never goes to the database. A missing snapshot fails the source like a failed pull would.
+        if mode=='replay' or (mode=='cache' and snapshot_is_fresh(name, variant=variant)):
+            record['origin']='snapshot'
+            pulled_at=os.path.getmtime(path)
+            df=pd.read_parquet(path)
+            record['raw_bytes']=frame_bytes(df)
+            df=apply_pushdown(apply_schema(df, SOURCE_SCHEMAS.get(name, {})), name, keys, filtered)
+        else:
+            record['origin']='database'
+            pulled_at=time.time()
+            df, record['pushed_down']=query_sql_source(name, keys, filtered, timeout)
+            record['raw_bytes']=frame_bytes(df)
+            #Snapshots are stored with the schema and pushdown applied, so they're smaller and load with them
+            df=apply_pushdown(apply_schema(df, SOURCE_SCHEMAS.get(name, {})), name, keys, filtered)
+            df.attrs['pushed_down']=record['pushed_down']
+            if mode=='cache' and name in SNAPSHOT_TTLS:
+                #Caching is best effort, a frame that can't be written as parquet is still returned
+                try:
+                    write_snapshot(df, path)
+                    if variant:
+                        prune_variant_snapshots(name)
+                except Exception:
+                    pass
+        record['rows_out']=len(df)
+        record['bytes']=frame_bytes(df)
+    df.attrs['pulled_at']=pulled_at
+    return df
+
+#Publish settings. 'replace' drops and rewrites the table, and is the default. 'delta' diffs each run against the key
+#hashes of the last publish (see PUBLISH_HASH_SUFFIX) and only writes what changed, in one transaction. Unchanged rows 
+#keep the CalcDate of the run that last wrote them, so in delta mode CalcDate is when a row last changed, not when it 
+#was last calculated. 'swap' bulk loads the whole frame into a staging table and swaps it with the live table in one 
+#transaction, so readers never see a half written or empty table. Delta and swap are opt-in, and need 
+#sql_helpers.get_future_state_engine(), without it we fall back to replace and log a warning.
+PUBLISH_MODE=os.environ.get('SOHA_PUBLISH_MODE', 'replace')
+PUBLISH_MODES=['delta', 'swap', 'replace']
+PUBLISH_DATABASE='ArrowtestDB'
+#Rows per executemany batch when bulk loading a staging table
+PUBLISH_BATCH_ROWS=int(os.environ.get('SOHA_PUBLISH_BATCH_ROWS', 50000))
+#The publish engine, created once so every push in the process shares its connection pool
+PUBLISH_ENGINE=None
+#Columns left out of the diff. CalcDate changes on every run, so a row whose other columns are unchanged isn't rewritten.
+PUBLISH_IGNORE_COLUMNS=['Calc_Date', 'CalcDate']
+
+def canonical_values(df, like):
+    """
+    Convert columns to a comparable form, so values read back from SQL hash the same as freshly calculated ones. 
+    Numbers are compared as rounded floats, dates parsed, and everything else compared as text (nulls as empty strings).
+    """
+    canonical=pd.DataFrame(index=df.index)
+    for column in df.columns:
+        if pd.api.types.is_numeric_dtype(like[column]) and not pd.api.types.is_bool_dtype(like[column]):
+            #As float64, so nullable integers hash the same as the floats they're read back as
+            canonical[column]=pd.to_numeric(df[column], errors='coerce').astype('float64').round(6)
+        elif pd.api.types.is_datetime64_any_dtype(like[column]):
+            canonical[column]=pd.to_datetime(df[column], errors='coerce')
+        else:
+            canonical[column]=df[column].astype(object).where(df[column].notna(), '').astype(str)
+    return canonical
+
+#The delta keeps a combined hash and row count per key of the last publish in <table>_hashes, next to the table, so
+#a run only reads those back instead of the whole table. Swap publishes drop it, so the next delta rebuilds it.
+PUBLISH_HASH_SUFFIX='_hashes'
+
+def key_text(df, key_columns):
+    """
+    The key columns as text (nulls as empty strings), so keys read back from SQL match freshly calculated ones.
+    """
+    return df[key_columns].astype(object).where(df[key_columns].notna(), '').astype(str)
+
+def key_hashes(df, key_columns, like=None, ignore_columns=PUBLISH_IGNORE_COLUMNS):
+    """
+    Hash every row of a priority frame on its compared columns (converted like the frame like, see canonical_values()),
+    and combine the row hashes per key, order independent so row order doesn't matter. A key can hold several rows 
+    (e.g. one per RTU meter), so keys are compared by their full set of rows. Returns each key's values, with its 
+    combined hash (RowHash) and row count (Rows).
+    """
+    like=df if like is None else like
+    compare_columns=[c for c in like.columns if c not in ignore_columns and c not in key_columns]
+    keys=key_text(df, key_columns)
+    row_hashes=pd.util.hash_pandas_object(canonical_values(df[compare_columns], like), index=False)
+    #Groups come out in the order their keys first appear, the same order as the first row of each key
+    combined=row_hashes.groupby([keys[c] for c in key_columns], sort=False).agg(['sum', 'size'])
+    hashes=df.loc[~keys.duplicated().to_numpy(), key_columns].reset_index(drop=True)
+    #Stored as signed 64 bit integers, which every database has
+    hashes['RowHash']=combined['sum'].to_numpy().astype('uint64').view('int64')
+    hashes['Rows']=combined['size'].to_numpy().astype('int64')
+    return hashes
+
+def diff_key_hashes(new_hashes, old_hashes, key_columns):
+    """
+    Compare the key hashes of a new priority frame against the last published ones. Returns a mask of the new keys
+    to insert (new or changed), and the old keys to delete (resolved or changed).
+    """
+    new_index=pd.MultiIndex.from_frame(key_text(new_hashes, key_columns))
+    old_hashes=old_hashes[~key_text(old_hashes, key_columns).duplicated().to_numpy()]
+    old_index=pd.MultiIndex.from_frame(key_text(old_hashes, key_columns))
+    positions=old_index.get_indexer(new_index)
+    found=positions>=0
+    unchanged=np.zeros(len(new_hashes), dtype=bool)
+    unchanged[found]=((new_hashes['RowHash'].to_numpy()[found]==old_hashes['RowHash'].to_numpy()[positions[found]]) &
+                      (new_hashes['Rows'].to_numpy()[found]==old_hashes['Rows'].to_numpy()[positions[found]]))
+    kept=np.zeros(len(old_hashes), dtype=bool)
+    kept[positions[unchanged]]=True
+    return ~unchanged, old_hashes.loc[~kept, key_columns]
+
+def delete_keys(connection, table, schema, key_columns, keys):
+    """
+    Delete every row of the given keys from a table, as part of the connection's current transaction. The keys are 
+    loaded into a table of their own (<table>_deleted_keys) and deleted with one statement, since a delete per key
+    scans the whole table for each of them.
+    """
+    keys_table=table+'_deleted_keys'
+    connection.execute(sqlalchemy.text('DROP TABLE IF EXISTS '+qualified_table_name(connection, keys_table, schema)))
+    keys.to_sql(keys_table, connection, schema=schema, index=False, chunksize=PUBLISH_BATCH_ROWS)
+    #Indexed, so each row of the table is checked with a lookup rather than a scan of the keys
+    deleted=sqlalchemy.Table(keys_table, sqlalchemy.MetaData(), *[sqlalchemy.Column(c) for c in key_columns], schema=schema)
+    sqlalchemy.Index(keys_table+'_index', *deleted.c).create(connection)
+    target=sqlalchemy.table(table, *[sqlalchemy.column(c) for c in key_columns], schema=schema)
+    connection.execute(sqlalchemy.delete(target).where(sqlalchemy.exists().where(*[deleted.c[c]==target.c[c] for c in key_columns])))
+    connection.execute(sqlalchemy.text('DROP TABLE '+qualified_table_name(connection, keys_table, schema)))
+
+def drop_key_hashes(connection, table, schema):
+    """
+    Drop a table's delta key hashes, after it was written some other way, so the next delta rebuilds them.
+    """
+    connection.execute(sqlalchemy.text('DROP TABLE IF EXISTS '+qualified_table_name(connection, table+PUBLISH_HASH_SUFFIX, schema)))
+
+def published_key_hashes(connection, table, schema, key_columns):
+    """
+    The key hashes stored by the last delta publish, or None if they're missing, have other columns, or don't 
+    account for every row in the table (it was written some other way since).
+    """
+    inspector=sqlalchemy.inspect(connection)
+    hash_table=table+PUBLISH_HASH_SUFFIX
+    columns=key_columns+['RowHash', 'Rows']
+    if not inspector.has_table(hash_table, schema=schema):
+        return None
+    if [c['name'] for c in inspector.get_columns(hash_table, schema=schema)]!=columns:
+        return None
+    hashes=pd.read_sql(sqlalchemy.select(sqlalchemy.table(hash_table, *[sqlalchemy.column(c) for c in columns], schema=schema)), connection)
+    table_rows=connection.execute(sqlalchemy.select(sqlalchemy.func.count()).select_from(sqlalchemy.table(table, schema=schema))).scalar()
+    return hashes if int(hashes['Rows'].sum())==table_rows else None
+
+def publish_priority_delta(df, table, schema, key_columns, engine):
+    """
+    Apply the difference between df and the last published priorities in a single transaction: delete resolved and
+    changed keys, then insert new and changed rows, in the table and its key hashes (see PUBLISH_HASH_SUFFIX). Only
+    the key hashes are read back, unless they have to be rebuilt from the table. If the table doesn't exist yet it's 
+    created, and if its columns differ from df a ValueError is raised rather than recreating it. Returns the number 
+    of rows inserted and keys deleted.
+    """
+    hash_table=table+PUBLISH_HASH_SUFFIX
+    new_hashes=key_hashes(df, key_columns)
+    with engine.begin() as connection:
+        inspector=sqlalchemy.inspect(connection)
+        if not inspector.has_table(table, schema=schema):
+            df.to_sql(table, connection, schema=schema, index=False)
+            new_hashes.to_sql(hash_table, connection, schema=schema, if_exists='replace', index=False)
+            return len(df), 0
+        check_published_columns([c['name'] for c in inspector.get_columns(table, schema=schema)], table, df)
+        #Read the last published hashes inside the transaction, so the diff matches what we overwrite
+        old_hashes=published_key_hashes(connection, table, schema, key_columns)
+        rebuild=old_hashes is None
+        if rebuild:
+            target=sqlalchemy.table(table, *[sqlalchemy.column(c) for c in df.columns], schema=schema)
+            old_hashes=key_hashes(pd.read_sql(sqlalchemy.select(target), connection), key_columns, like=df)
+        insert_keys, delete_df=diff_key_hashes(new_hashes, old_hashes, key_columns)
+        insert_index=pd.MultiIndex.from_frame(key_text(new_hashes[insert_keys], key_columns))
+        insert_df=df[pd.MultiIndex.from_frame(key_text(df, key_columns)).isin(insert_index)]
+        if len(delete_df)>0:
+            delete_keys(connection, table, schema, key_columns, delete_df)
+        if len(insert_df)>0:
+            insert_df.to_sql(table, connection, schema=schema, if_exists='append', index=False)
+        if rebuild:
+            new_hashes.to_sql(hash_table, connection, schema=schema, if_exists='replace', index=False)
+        else:
+            if len(delete_df)>0:
+                delete_keys(connection, hash_table, schema, key_columns, delete_df)
+            if insert_keys.any():
+                new_hashes[insert_keys].to_sql(hash_table, connection, schema=schema, if_exists='append', index=False)
+        return len(insert_df), len(delete_df)
+
+def check_published_columns(columns, table, df):
+    """
+    Raise a ValueError if the columns of the published table differ from the priorities being published.
+    """
+    if list(columns)!=list(df.columns):
+        raise ValueError('Columns of %s (%s) differ from the priorities being published (%s)' % 
+                         (table, ', '.join(columns), ', '.join(df.columns)))
+
+def publish_engine():
+    """
+    The engine for the publish database, shared by every push so they reuse its pooled connections.
+    """
+    global PUBLISH_ENGINE
+    if PUBLISH_ENGINE is None:
+        PUBLISH_ENGINE=sql_helpers.get_future_state_engine(PUBLISH_DATABASE)
+    return PUBLISH_ENGINE
+
+def qualified_table_name(connection, table, schema):
+    """
+    The quoted schema.table name for raw SQL on this connection's dialect.
+    """
+    preparer=connection.dialect.identifier_preparer
+    return (preparer.quote_schema(schema)+'.' if schema else '')+preparer.quote(table)
+
+def rename_table(connection, table, new_table, schema):
+    """
+    Rename a table within its schema, as part of the connection's current transaction.
+    """
+    if connection.dialect.name=='mssql':
+        connection.execute(sqlalchemy.text('EXEC sp_rename :old_name, :new_name'), 
+                           {'old_name': (schema+'.' if schema else '')+table, 'new_name': new_table})
+    else:
+        connection.execute(sqlalchemy.text('ALTER TABLE %s RENAME TO %s' % (qualified_table_name(connection, table, schema), 
+                                                                              connection.dialect.identifier_preparer.quote(new_table))))
+
+def switch_table(connection, table, target_table, schema):
+    """
+    Move every row of a table into an empty table with the same definition (SQL Server's ALTER TABLE ... SWITCH, a 
+    metadata only operation), as part of the connection's current transaction.
+    """
+    connection.execute(sqlalchemy.text('ALTER TABLE %s SWITCH TO %s' % (qualified_table_name(connection, table, schema), 
+                                                                        qualified_table_name(connection, target_table, schema))))
+
+def staging_definition(live, name, indexes):
+    """
+    A copy of the reflected live table's definition (column types, nullability, defaults and constraints) under 
+    another name. Constraint names are cleared, since they have to be unique within the schema, and the live table's 
+    indexes are only copied if indexes is True.
+    """
+    staging=live.to_metadata(sqlalchemy.MetaData(), name=name)
+    for constraint in staging.constraints:
+        constraint.name=None
+    if not indexes:
+        staging.indexes.clear()
+    return staging
+
+def publish_priority_swap(df, table, schema, engine, batch_rows=None):
+    """
+    Bulk load df into a staging table (<table>_staging) in batches of batch_rows, then swap it with the live table
+    in a single transaction and drop the old rows. Loading happens before the swap transaction starts, so the live 
+    table is only locked for the swap. The staging table is created from the live table's definition, so the live 
+    table keeps its column types, constraints and indexes (and on SQL Server, where the rows are switched into the 
+    live table rather than renamed over it, its grants). If its columns differ from df a ValueError is raised. 
+    Returns the number of rows loaded.
+    """
+    staging_table=table+'_staging'
+    retired_table=table+'_retired'
+    with engine.begin() as connection:
+        #Clear out anything left behind by a failed publish
+        for leftover in [staging_table, retired_table]:
+            connection.execute(sqlalchemy.text('DROP TABLE IF EXISTS '+qualified_table_name(connection, leftover, schema)))
+        live=None
+        switch=connection.dialect.name=='mssql'
+        if sqlalchemy.inspect(connection).has_table(table, schema=schema):
+            live=sqlalchemy.Table(table, sqlalchemy.MetaData(), schema=schema, autoload_with=connection)
+            check_published_columns([c.name for c in live.columns], table, df)
+            #A switch needs the same indexes on both sides. Elsewhere staging is loaded without them, and they're 
+            #recreated on it after the swap.
+            staging_definition(live, staging_table, indexes=switch).create(connection)
+            if switch:
+                staging_definition(live, retired_table, indexes=True).create(connection)
+        #pandas inserts each chunk with a single executemany
+        df.to_sql(staging_table, connection, schema=schema, if_exists='append', index=False, chunksize=batch_rows or PUBLISH_BATCH_ROWS)
+    with engine.begin() as connection:
+        if live is None:
+            rename_table(connection, staging_table, table, schema)
+        elif switch:
+            switch_table(connection, table, retired_table, schema)
+            switch_table(connection, staging_table, table, schema)
+            for leftover in [staging_table, retired_table]:
+                connection.execute(sqlalchemy.text('DROP TABLE '+qualified_table_name(connection, leftover, schema)))
+        else:
+            rename_table(connection, table, retired_table, schema)
+            rename_table(connection, staging_table, table, schema)
+            #Dropping the retired table frees its index names for the new live table
+            connection.execute(sqlalchemy.text('DROP TABLE '+qualified_table_name(connection, retired_table, schema)))
+            for index in live.indexes:
+                index.create(connection)
+        drop_key_hashes(connection, table, schema)
+    return len(df)
+
+def push_priorities(df, table, schema, key_columns):
+    """
+    Write a priority frame to its SQL table (see PUBLISH_MODE). In replay mode the frame is written under the 
+    snapshot directory instead (replay_output/<schema>.<table>.parquet), so a replayed run never touches the database.
+    An unknown PUBLISH_MODE raises a ValueError.
+    """
+    if PUBLISH_MODE not in PUBLISH_MODES:
+        raise ValueError('Unknown publish mode %r, expected one of: %s' % (PUBLISH_MODE, ', '.join(PUBLISH_MODES)))
+    with telemetry_stage('push:'+schema+'.'+table, rows_in=len(df)) as record:
+        record['bytes']=frame_bytes(df)
+        mode=PUBLISH_MODE
+        if SNAPSHOT_MODE!='replay' and mode!='replace' and not hasattr(sql_helpers, 'get_future_state_engine'):
+            LOGGER.warning('Publish mode %s needs sql_helpers.get_future_state_engine(), replacing %s.%s instead', 
+                           mode, schema, table)
+            record['requested_mode']=mode
+            mode='replace'
+        if SNAPSHOT_MODE=='replay':
+            record['mode']='replay'
+            write_snapshot(df, os.path.join(SNAPSHOT_DIR, 'replay_output', schema+'.'+table+'.parquet'))
+            record['rows_out']=len(df)
+        elif mode=='delta':
+            record['mode']='delta'
+            record['rows_out'], record['deleted_keys']=publish_priority_delta(df, table, schema, key_columns, publish_engine())
+        elif mode=='swap':
+            record['mode']='swap'
+            record['rows_out']=publish_priority_swap(df, table, schema, publish_engine())
+        else:
+            record['mode']='replace'
+            sql_helpers.sql_push_future_state_arrow_test(df, table=table, schema=schema, if_exists='replace', database=PUBLISH_DATABASE)
+            record['rows_out']=len(df)
+            #A later delta publish has to rebuild its key hashes from the replaced table
+            if hasattr(sql_helpers, 'get_future_state_engine'):
+                with publish_engine().begin() as connection:
+                    drop_key_hashes(connection, table, schema)
+
+def fetch_sql_sources(names, max_workers=FETCH_MAX_WORKERS, max_per_server=FETCH_MAX_PER_SERVER, 
+                      default_deadline=FETCH_DEFAULT_DEADLINE, deadlines=FETCH_DEADLINES, keys=None, mode=None, 
+                      filtered=True, keys_by_source=None):
+    """
+    Start all of the given SQL pulls at once on a bounded thread pool, allowing at most max_per_server pulls
+    against any one server at a time. Sources with a well key are narrowed to the wells in keys, or in their own 
+    entry of keys_by_source, and to the rows that pass their filters unless filtered is False (see SOURCE_PUSHDOWN). 
+    mode overrides SNAPSHOT_MODE for these pulls. Returns a dictionary of source name to dataframe, or to the 
+    exception raised by the pull (TimeoutError if the source missed its deadline). A pull that misses its deadline 
+    is only stopped where it could be given a query timeout, see FETCH_DEADLINES.
+    """
+    #One semaphore per target server caps the load we put on each of them
+    server_locks={SQL_SOURCES[name][1]: threading.BoundedSemaphore(max_per_server) for name in names}
+    
+    def pull_with_server_cap(name):
+        with server_locks[SQL_SOURCES[name][1]]:
+            #Time spent waiting for a server slot comes out of the source's deadline
+            remaining=max(0, start+deadlines.get(name, default_deadline)-time.monotonic())
+            return pull_sql_source(name, mode=mode, keys=(keys_by_source or {}).get(name, keys), filtered=filtered, 
+                                   timeout=remaining)
+    
+    start=time.monotonic()
+    executor=ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='soha_fetch')
+    futures={name: executor.submit(pull_with_server_cap, name) for name in names}
+    results={}
+    for name, future in futures.items():
+        #Wait only for whatever is left of this source's deadline
+        remaining=max(0, start+deadlines.get(name, default_deadline)-time.monotonic())
+        try:
+            results[name]=future.result(timeout=remaining)
+        except Exception as e:
+            results[name]=e
+    #Don't wait on pulls that missed their deadline. Queued pulls are cancelled, running ones finish in the background.
+    executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+def fetched_source(sources, name):
+    """
+    Return a source from the prefetched sources, re-raising its pull failure if it failed. 
+    Falls back to pulling the source directly when it wasn't prefetched.
+    """
+    if sources is None or name not in sources:
+        return pull_sql_source(name)
+    if isinstance(sources[name], Exception):
+        raise sources[name]
+    return sources[name]
+
+#Well attributes that the priority generators attach to their rows (everything format_priorities needs from the 
+#well, plus API for the API10 joins)
+WELL_COLUMNS=['WellName', 'Corp_ID', 'Facility_ID', 'Area', 'Route', 'Latitude', 'Longitude', 'API', 'chokeStatusCreatedBy', 
+              'chokeStatusDate', 'chokeStatusType', 'chokeStatusAction', 'chokeStatusComments', 'Gas_Production', 'CleanAvgGas']
+
+class WellIndex:
+    """
+    The merged well metadata, indexed once on API10 and Corp_ID. Priority generators attach well attributes to 
+    their rows through these indexes (a positional take) instead of each re-merging the whole frame.
+    """
+    
+    def __init__(self, frame):
+        self.frame=frame.reset_index(drop=True)
+        self.indexes={'API': pd.Index(self.frame['API']), 'Corp_ID': pd.Index(self.frame['Corp_ID'])}
+    
+    def __len__(self):
+        return len(self.frame)
+    
+    def project(self, columns=None):
+        """
+        Return a copy of the well metadata, with only the given columns.
+        """
+        if columns is None:
+            return self.frame.copy()
+        return self.frame[list(columns)]
+    
+    def attach(self, df, left_on, key='API', columns=WELL_COLUMNS):
+        """
+        Inner join the given well columns onto df, matching df[left_on] against the API or Corp_ID index. 
+        Well columns that df already has are replaced by the well's values, so leave out any column df should keep.
+        Falls back to a merge if the key isn't unique in the well metadata.
+        """
+        with telemetry_stage('attach:'+key, rows_in=len(df)) as record:
+            attached=self.take_wells(df, left_on, key, columns)
+            record['rows_out']=len(attached)
+        return attached
+    
+    def take_wells(self, df, left_on, key, columns):
+        """
+        The join behind attach()
+        """
+        columns=[c for c in columns if c!=left_on]
+        index=self.indexes[key]
+        if not index.is_unique:
+            df=df.drop(columns=[c for c in columns if c in df.columns])
+            wells=self.project(list(dict.fromkeys([key]+columns)))
+            if key==left_on:
+                return pd.merge(df, wells, on=key, how='inner')
+            return pd.merge(df, wells, left_on=left_on, right_on=key, how='inner')
+        positions=index.get_indexer(df[left_on])
+        found=positions>=0
+        attached=df.loc[found, [c for c in df.columns if c not in columns]].reset_index(drop=True)
+        wells=self.frame[columns].take(positions[found]).reset_index(drop=True)
+        return pd.concat([attached, wells], axis=1)
+
+def pull_well_specific_data(sources=None):
     
     def pull_well_metadata():
         """
         Pull well metadata, including area, route, API, wellflac, and corpID. Source is various tables in EDH
         """
-        query=('well_metadata.sql')
         #Pull SQL data from future state server.
-        df=sql_helpers.pull_data_from_sql_query_future_state(query, 'EnterpriseDataHub')
+        df=fetched_source(sources, 'well_metadata')
         return df
     
     def pull_most_recent_well_codes():
         """
         Pull most recent coding for each well in Enbase. Source is Enbase.ChokeStatusAction in ODS
         """
-        query=('most_recent_well_coding.sql')
         #Pull SQL data from future state server.
-        df=sql_helpers.pull_data_from_sql_query_future_state(query, 'ODS')
+        df=fetched_source(sources, 'well_codes')
         return df
     
     def pull_yday_gas_production():
         """
         Pull yesterday's gas production in SoHa. Source table is bpx_field.daily_gas_snapshot in EDH (allocated daily gas volumes)
         """
-        query=('yday_production_soha.sql')
         #Pull SQL data from future state server.
-        df=sql_helpers.pull_data_from_sql_query_future_state(query, 'EnterpriseDataHub')
-        df['Production_Date'] = pd.to_datetime(df['production_date_utc'])
-        df['Gas_Production']=df['wellhead_extrapolated_24_hr_gas'].astype('float64')
+        df=fetched_source(sources, 'yday_gas_production')
+        #Already parsed and cast by the source's schema
+        df['Production_Date']=df['production_date_utc']
+        df['Gas_Production']=df['wellhead_extrapolated_24_hr_gas']
         return df
     
     def pull_clean_average():
         """
         Pull clean average from EDH. Source table is clean 365 table in EDH
         """
-        query=('clean_average.sql')
         #Pull SQL data from future state server.
-        df=sql_helpers.pull_data_from_sql_query_arrow_future_state(query)
+        df=fetched_source(sources, 'clean_average')
         return df 
     
-    try:
-        #Pull metadata and most recent chokestatusaction
-        well_metadata=pull_well_metadata()
-        #Make APINumber in well_metadata API10
-        well_metadata['API'] = well_metadata['API'].astype(str).str[0:10]
-        well_codes=pull_most_recent_well_codes()
-        #Merge well code with well metadata
+    #Pull metadata and most recent chokestatusaction
+    well_metadata=pull_well_metadata()
+    #Make APINumber in well_metadata API10
+    well_metadata['API'] = well_metadata['API'].astype(str).str[0:10]
+    well_codes=pull_most_recent_well_codes()
+    #Merge well code with well metadata
+    with telemetry_stage('merge:well_codes', rows_in=len(well_metadata)) as record:
         merged_df=pd.merge(well_metadata, well_codes[['apinumber', 'chokeStatusCreatedBy', 'chokeStatusDate', 'chokeStatusType', 
                                                       'chokeStatusAction', 'chokeStatusComments']], how='inner', left_on='API', right_on='apinumber')
-        #Pull yesterday's well production
-        yday_gas_production=pull_yday_gas_production()
-        #Pull clean average data
-        clean_average=pull_clean_average()
-        #Merge yesterday's production into the main dataframe 
-        merged_df=pd.merge(merged_df, yday_gas_production[['Corp_ID', 'Gas_Production']], how='inner', on='Corp_ID')
-        #erge clean average into the main dataframe
+        record['rows_out']=len(merged_df)
+    #Pull yesterday's well production
+    yday_gas_production=pull_yday_gas_production()
+    #Pull clean average data
+    clean_average=pull_clean_average()
+    #Merge yesterday's production into the main dataframe 
+    with telemetry_stage('merge:yday_gas_production', rows_in=len(merged_df)) as record:
+        merged_df=pd.merge(merged_df, yday_gas_production[['Corp_ID', 'Gas_Production', 'Production_Date']], how='inner', on='Corp_ID')
+        record['rows_out']=len(merged_df)
+    #erge clean average into the main dataframe
+    with telemetry_stage('merge:clean_average', rows_in=len(merged_df)) as record:
         merged_df=pd.merge(merged_df, clean_average[['Corp_ID', 'CleanAvgGas', 'CleanAvgLowerBoundGas']], how='inner', on='Corp_ID')
-        return merged_df
-    except:
-        return 'Metadata pull failure'
+        record['rows_out']=len(merged_df)
+    #Index the merged metadata once for all of the priority generators
+    return WellIndex(merged_df)
+
+#Rolling deferment state, kept locally in place of the cumulative_deferment query. One row per Corp_ID with the 
+#last production day applied, and the deferment and number of days of the well's current deferring streak.
+DEFERMENT_STATE_PATH=os.environ.get('SOHA_DEFERMENT_STATE', os.path.join('state', 'deferment_state.parquet'))
+DEFERMENT_STATE_COLUMNS=['Corp_ID', 'Production_Date', 'CumulativeDeferment', 'ConsecutiveDaysDeferring']
+#Well metadata columns a day of production is read from
+DEFERMENT_STATE_INPUTS=['Corp_ID', 'Production_Date', 'Gas_Production', 'CleanAvgGas', 'CleanAvgLowerBoundGas']
+
+def read_deferment_state(path=None):
+    """
+    Read the deferment state, or an empty state if there isn't one yet.
+    """
+    path=path or DEFERMENT_STATE_PATH
+    if not os.path.exists(path):
+        return pd.DataFrame({'Corp_ID': pd.Series(dtype=object), 'Production_Date': pd.Series(dtype='datetime64[ns]'),
+                             'CumulativeDeferment': pd.Series(dtype='float64'), 'ConsecutiveDaysDeferring': pd.Series(dtype='int64')})
+    return pd.read_parquet(path)[DEFERMENT_STATE_COLUMNS]
+
+def update_deferment_state(state, day):
+    """
+    Roll the state forward by one production day per well (day has the DEFERMENT_STATE_INPUTS columns). A well 
+    that's deferring (below its clean average lower bound) adds the day's deferment to its streak. A well that isn't,
+    or that missed a day, starts over. Days at or before a well's last applied day are skipped, so reruns and 
+    overlapping backfills don't count a day twice. Runs in O(wells).
+    """
+    day=day.assign(Production_Date=pd.to_datetime(day['Production_Date']).dt.normalize()).drop_duplicates('Corp_ID', keep='last')
+    previous=state.drop_duplicates('Corp_ID', keep='last').set_index('Corp_ID').reindex(day['Corp_ID'])
+    dates=day['Production_Date'].to_numpy()
+    last_dates=previous['Production_Date'].to_numpy()
+    #Only days after the last applied one, and only streaks that ran through yesterday, carry on
+    apply=np.isnat(last_dates) | (dates>last_dates)
+    continues=(dates-last_dates)==np.timedelta64(1, 'D')
+    deferring=(day['Gas_Production']<day['CleanAvgLowerBoundGas']).to_numpy()
+    deferment=(day['CleanAvgGas']-day['Gas_Production']).to_numpy(dtype='float64')
+    cumulative=np.where(deferring, np.where(continues, previous['CumulativeDeferment'].to_numpy(), 0)+deferment, 0)
+    days=np.where(deferring, np.where(continues, previous['ConsecutiveDaysDeferring'].to_numpy(), 0)+1, 0)
+    updated=pd.DataFrame({'Corp_ID': day['Corp_ID'].to_numpy()[apply], 'Production_Date': dates[apply],
+                          'CumulativeDeferment': cumulative[apply], 'ConsecutiveDaysDeferring': days[apply].astype('int64')})
+    kept=state[~state['Corp_ID'].isin(updated['Corp_ID'])]
+    return pd.concat([kept, updated], ignore_index=True)[DEFERMENT_STATE_COLUMNS]
+
+def backfill_deferment_state(history, state=None):
+    """
+    Build (or extend) the deferment state from history: several days of the DEFERMENT_STATE_INPUTS columns, 
+    applied a day at a time in date order.
+    """
+    state=read_deferment_state() if state is None else state
+    history=history.assign(Production_Date=pd.to_datetime(history['Production_Date']).dt.normalize())
+    for date, day in history.groupby('Production_Date', sort=True):
+        state=update_deferment_state(state, day)
+    return state
+
+def refresh_deferment_state(wells, path=None):
+    """
+    Apply the current run's production day (the DEFERMENT_STATE_INPUTS columns of the well metadata) to the stored
+    state, store it (except in replay mode) and return it as the cumulative_deferment source for these wells.
+    """
+    path=path or DEFERMENT_STATE_PATH
+    with telemetry_stage('deferment_state', rows_in=len(wells)) as record:
+        state=update_deferment_state(read_deferment_state(path), wells)
+        if SNAPSHOT_MODE!='replay':
+            write_snapshot(state, path)
+        state=state[state['Corp_ID'].isin(wells['Corp_ID'])]
+        record['rows_out']=len(state)
+    return state.rename(columns={'Corp_ID': 'CorpID'})[['CorpID', 'CumulativeDeferment', 'ConsecutiveDaysDeferring']]
+
+#Columns every priority generator returns
+PRIORITY_COLUMNS=['WellName','Corp_ID','Facility_ID', 'Area', 'Route','Latitude', 'Longitude', 'Priority', 'Priority_Level', 
+                  'Description', 'Assigned_To', 'chokeStatusCreatedBy', 'chokeStatusDate', 'chokeStatusType','chokeStatusAction', 
+                  'chokeStatusComments', 'Gas_Production', 'CleanAvgGas']
 
 def format_priorities(df):
     """
     Format the work management priorities for insertion into the SQL table.
     """
-    df=df[['WellName','Corp_ID','Facility_ID', 'Area', 'Route','Latitude', 'Longitude', 'Priority', 'Priority_Level', 
-           'Description', 'Assigned_To', 'chokeStatusCreatedBy', 'chokeStatusDate', 'chokeStatusType','chokeStatusAction', 
-           'chokeStatusComments', 'Gas_Production', 'CleanAvgGas']].drop_duplicates()
+    #Carry the description template and its fields along, so descriptions can be rendered right before the push
+    df=df.reindex(columns=PRIORITY_COLUMNS+['Description_Template']+[c for c in DESCRIPTION_FIELDS if c not in PRIORITY_COLUMNS]).drop_duplicates()
     return df
 
-def gas_deferment_priorities(Assigned_To, well_metadata):
+#Priority rule tables. Each band is (column, lower bound, upper bound, priority level, band description), where a
+#bound of None is open-ended. 'closed' says which side of every band is inclusive ('left': lower<=x<upper, 
+#'right': lower<x<=upper). Bands on the same column must not overlap; when a table covers several columns, the first
+#column with a matching band wins. A row's description template is its band description followed by the 'details'
+#template, and rows that match no band get no Priority_Level and 'unbanded_description' in place of a band description
+#(None for no description at all).
+PRIORITY_RULES={'Deferment': {'closed': 'left',
+                              'bands': [('DefermentQuantile', None, .25, 2, 'Top 25% deferring wells: '),
+                                        ('DefermentQuantile', .25, .50, 3, 'Top 25%-50% wells deferring: '),
+                                        ('DefermentQuantile', .50, .75, 4, 'Top 50%-75% wells deferring: '),
+                                        ('DefermentQuantile', .75, None, 5, 'Bottom 25% wells deferring: ')],
+                              'details': 'Yesterday well produced {Gas_Production} MCFE, and deferred {Deferment} MCFE.',
+                              'unbanded_description': None},
+                'Flood Alert': {'closed': 'left',
+                                'bands': [('HoursUntilFlood', None, 24, 1, 'Well is already flooding or is predicted to flood within the next 24 hours. '),
+                                          ('HoursUntilFlood', 24, 48, 2, 'Well is predicted to flood between 1 to 2 days. '),
+                                          ('HoursUntilFlood', 48, 72, 3, 'Well is predicted to flood between 2 and 3 days. '),
+                                          ('HoursUntilFlood', 72, 96, 4, 'Well is predicted to flood between 3 and 4 days. '),
+                                          ('HoursUntilFlood', 96, None, 5, 'Well is predicted to flood between 4 and 5 days. ')],
+                                'details': 'Affected flood height of the site is {AffectedFloodHeight} ft. Next predicted flood date is {EarliestPredictedFloodDate}.',
+                                'unbanded_description': None},
+                'Cumulative Deferment': {'closed': 'left',
+                                         'bands': [('CumulativeDeferment', 1000, 2000, 5, ''),
+                                                   ('CumulativeDeferment', 2000, 3000, 4, ''),
+                                                   ('CumulativeDeferment', 3000, 4000, 3, ''),
+                                                   ('CumulativeDeferment', 4000, 5000, 2, '')],
+                                         'details': 'Well has a cumulative deferment of {CumulativeDeferment} MCFE, and has been deferring for {ConsecutiveDaysDeferring} days.',
+                                         'unbanded_description': ''},
+                'Site Inspection': {'closed': 'left',
+                                    'bands': [('DaysSinceLastInspection', 60, 75, 5, ''),
+                                              ('DaysSinceLastInspection', 75, 90, 4, ''),
+                                              ('DaysSinceLastInspection', 90, None, 3, '')],
+                                    'details': 'Site Inspection Due: Last recorded site inspection was {DaysSinceLastInspection} days ago.',
+                                    'unbanded_description': ''},
+                'Automation-RTU Issue': {'closed': 'right',
+                                         'bands': [('PercentSuccessfulComms', None, 50, 3, 'RTU Comms Issue Detected: '),
+                                                   ('PercentSuccessfulComms', 50, 60, 4, 'RTU Comms Issue Detected: '),
+                                                   ('PercentSuccessfulComms', 60, 75, 5, 'RTU Comms Issue Detected: '),
+                                                   ('BatteryVoltage', None, 11, 3, 'RTU Comms Issue Detected: ')],
+                                         'details': 'Percent successful comms in the past hour is {PercentSuccessfulComms}%, and current battery voltage is {BatteryVoltage}.',
+                                         'unbanded_description': 'RTU Comms Issue Detected: '}}
+
+def find_bands(values, bands, closed):
+    """
+    Find which band each value falls in with a single binary search over the band edges, so the cost doesn't grow 
+    with the number of bands. bands is a list of (band number, lower, upper) on one column. Returns -1 for values
+    outside every band (including nulls).
+    """
+    edges=np.array(sorted({bound for band in bands for bound in band[1:] if bound is not None}), dtype='float64')
+    #Map each gap between edges to the band covering it
+    band_for_gap=np.full(len(edges)+1, -1)
+    gap_lower=np.concatenate([[-np.inf], edges])
+    gap_upper=np.concatenate([edges, [np.inf]])
+    for number, lower, upper in bands:
+        lower=-np.inf if lower is None else lower
+        upper=np.inf if upper is None else upper
+        band_for_gap[(gap_lower>=lower) & (gap_upper<=upper)]=number
+    gaps=np.searchsorted(edges, values, side='right' if closed=='left' else 'left')
+    found=band_for_gap[gaps]
+    found[np.isnan(values)]=-1
+    return found
+
+def description_templates(rules):
+    """
+    The description template for each band of a rule table, plus a trailing one for unbanded rows.
+    """
+    band_descriptions=[b[4] for b in rules['bands']]+[rules['unbanded_description']]
+    return [None if description is None else description+rules['details'] for description in band_descriptions]
+
+#Every description template, indexed by the Description_Template ID that priorities carry through the pipeline
+DESCRIPTION_TEMPLATES=list(dict.fromkeys(template for rules in PRIORITY_RULES.values() 
+                                         for template in description_templates(rules) if template is not None))
+#Every column a template refers to
+DESCRIPTION_FIELDS=list(dict.fromkeys(field for template in DESCRIPTION_TEMPLATES 
+                                      for _, field, _, _ in string.Formatter().parse(template) if field is not None))
+#Fixed precision for each field when descriptions are rendered. Numbers use printf style, dates strftime.
+DESCRIPTION_FORMATS={'Gas_Production': '%.1f',
+                     'Deferment': '%.1f',
+                     'AffectedFloodHeight': '%.2f',
+                     'EarliestPredictedFloodDate': '%Y-%m-%d %H:%M',
+                     'CumulativeDeferment': '%.1f',
+                     'ConsecutiveDaysDeferring': '%.0f',
+                     'DaysSinceLastInspection': '%.0f',
+                     'PercentSuccessfulComms': '%.1f',
+                     'BatteryVoltage': '%.2f'}
+DESCRIPTION_DATE_FIELDS=['EarliestPredictedFloodDate']
+
+def format_description_field(values, field):
+    """
+    Format one field's values as fixed precision text, nulls as 'nan'.
+    """
+    if field in DESCRIPTION_DATE_FIELDS:
+        dates=pd.to_datetime(pd.Series(values), errors='coerce')
+        return dates.dt.strftime(DESCRIPTION_FORMATS[field]).fillna('nan').values.astype(str)
+    numbers=pd.to_numeric(pd.Series(values), errors='coerce').values.astype('float64')
+    return np.char.mod(DESCRIPTION_FORMATS.get(field, '%s'), numbers)
+
+def render_descriptions(df):
+    """
+    Render every templated description in one pass, template by template, and drop the template and field columns.
+    Rows without a template (e.g. work management entries) keep the Description they came with.
+    """
+    df['Description']=render_description_values(df['Description'].astype(object).values, df['Description_Template'].values,
+                                                lambda field: df[field].values)
+    return df.drop(columns=['Description_Template']+[c for c in DESCRIPTION_FIELDS if c not in PRIORITY_COLUMNS])
+
+def render_description_values(descriptions, template_ids, field_values):
+    """
+    The rendering behind render_descriptions(), on plain arrays: descriptions and template IDs per row, and a 
+    function that returns a field's values for every row.
+    """
+    descriptions=descriptions.copy()
+    for template_id in pd.unique(template_ids[pd.notna(template_ids)]):
+        rows=template_ids==template_id
+        rendered=np.full(rows.sum(), '')
+        for literal, field, _, _ in string.Formatter().parse(DESCRIPTION_TEMPLATES[int(template_id)]):
+            rendered=np.char.add(rendered, literal)
+            if field is not None:
+                rendered=np.char.add(rendered, format_description_field(field_values(field)[rows], field))
+        descriptions[rows]=rendered.astype(object)
+    return descriptions
+
+def apply_priority_rules(df, priority_type):
+    """
+    Set the Priority, Priority_Level and Description_Template columns for a priority type from its table in 
+    PRIORITY_RULES. The Description itself is rendered later, by render_descriptions().
+    """
+    with telemetry_stage('rules:'+priority_type, rows_in=len(df)) as record:
+        band, levels, template_ids=find_priority_bands(priority_type, len(df), lambda column: df[column].astype('float64').values)
+        df['Priority']=priority_type
+        df['Priority_Level']=levels[band]
+        df['Description']=None
+        df['Description_Template']=template_ids[band]
+        #Rows that landed in a band
+        record['rows_out']=int((band>=0).sum())
+    return df
+
+def find_priority_bands(priority_type, rows, column_values):
+    """
+    Find each row's band in a priority type's rule table, given a function that returns a column as float64 values.
+    Returns the band per row (-1 for none), and the priority level and template ID per band, each with a trailing 
+    entry for unbanded rows, so both can be indexed by the band.
+    """
+    rules=PRIORITY_RULES[priority_type]
+    bands=rules['bands']
+    #Find each row's band once per column, then let the first column with a match win
+    band=np.full(rows, -1)
+    for column in dict.fromkeys(b[0] for b in bands):
+        column_band=find_bands(column_values(column), [(i, b[1], b[2]) for i, b in enumerate(bands) if b[0]==column], rules['closed'])
+        band=np.where(band>=0, band, column_band)
+    levels=np.array([b[3] for b in bands]+[np.nan], dtype='float64')
+    template_ids=np.array([np.nan if t is None else DESCRIPTION_TEMPLATES.index(t) for t in description_templates(rules)])
+    return band, levels, template_ids
+
+#How deferment is ranked into quantiles: 'global' ranks every deferring well in the fleet against each other, 'area' 
+#and 'route' rank wells only against the other deferring wells in their Area or Route
+DEFERMENT_RANKING=os.environ.get('SOHA_DEFERMENT_RANKING', 'global')
+DEFERMENT_RANKING_COLUMNS={'area': 'Area', 'route': 'Route'}
+
+def deferment_ranking_codes(df, ranking):
+    """
+    Each row's ranking group, as a code into the list of groups: one group (None) for global ranking, or one per Area
+    or Route with None first, for rows where it's missing. Returns the codes and the groups.
+    """
+    if ranking=='global':
+        return np.zeros(len(df), dtype='intp'), [None]
+    if ranking not in DEFERMENT_RANKING_COLUMNS:
+        raise ValueError('Unknown deferment ranking: '+str(ranking))
+    codes, values=pd.factorize(df[DEFERMENT_RANKING_COLUMNS[ranking]])
+    return codes+1, [None]+list(values)
+
+def deferment_quantile_edges():
+    """
+    The quantile edges of the Deferment bands, in order, and the side the bands are closed on.
+    """
+    rules=PRIORITY_RULES['Deferment']
+    return sorted({bound for column, lower, upper, level, description in rules['bands'] if column=='DefermentQuantile' 
+                   for bound in [lower, upper] if bound is not None}), rules['closed']
+
+def quantile_cuts(values, edges, closed, n=None):
+    """
+    For each quantile edge, the largest deferment whose quantile is on the upper side of it (quantile>=edge for bands
+    closed on the left, >edge on the right), or -inf if there's none. A well's quantile is its descending rank (ties 
+    share their average rank, like pandas' rank()) over the number of wells n, so it falls as deferment rises, and a 
+    well is on the upper side of an edge exactly when its deferment is at or below the edge's cut. Wells without a 
+    deferment are left out of values but count towards n (len(values) by default), as they do for rank() over the 
+    frame. Only the few order statistics around each edge can go either way: they're found with np.partition and 
+    their quantiles worked out exactly, so this is O(n) per edge instead of a full sort.
+    """
+    n=len(values) if n is None else n
+    cuts=np.full(len(edges), -np.inf)
+    if len(values)==0:
+        return cuts
+    #Descending positions (1 based) whose tie group could straddle each edge. An empty window means every well 
+    #ranks above the edge.
+    windows=[range(max(int(np.floor(edge*n))-1, 1), min(int(np.ceil(edge*n))+1, len(values))+1) for edge in edges]
+    positions=sorted({position-1 for window in windows for position in window})
+    descending=np.partition(-values, positions) if positions else -values
+    for i, (edge, window) in enumerate(zip(edges, windows)):
+        if len(window)==0:
+            continue
+        candidates=np.unique(-descending[[position-1 for position in window]])
+        above=np.array([np.count_nonzero(values>candidate) for candidate in candidates])
+        ties=np.array([np.count_nonzero(values==candidate) for candidate in candidates])
+        quantiles=1-(n-(above+(ties+1)/2))/n
+        upper_side=candidates[quantiles>=edge if closed=='left' else quantiles>edge]
+        #Everything below the window is well clear of the edge
+        below=np.max(values, where=values<candidates[0], initial=-np.inf)
+        cuts[i]=max(upper_side.max(initial=-np.inf), below)
+    return cuts
+
+def grouped_quantile_cuts(values, codes, groups, edges, closed):
+    """
+    quantile_cuts() of every ranking group at once, given each well's group code (see deferment_ranking_codes()). 
+    The wells are sorted by group and descending deferment, each group's size and offset come from np.bincount
+    and np.cumsum, and each well's quantile from the tie run it's in, so there's no loop over the groups. Returns the
+    cuts as an array of a row per group.
+    """
+    cuts=np.full((groups, len(edges)), -np.inf)
+    #Wells without a deferment count towards their group's size, like they do for rank()
+    sizes=np.bincount(codes, minlength=groups)
+    valid=~np.isnan(values)
+    values, codes=values[valid], codes[valid]
+    #Sort by descending deferment, then stably by group, which numpy does as a radix sort on 16 bit codes
+    order=np.argsort(-values)
+    group_codes=codes[order]
+    order=order[np.argsort(group_codes.astype('uint16') if groups<=2**16 else group_codes, kind='stable')]
+    values, codes=values[order], codes[order]
+    if len(values)==0:
+        return cuts
+    counts=np.bincount(codes, minlength=groups)
+    offsets=np.cumsum(counts)-counts
+    #Runs of tied deferment within a group. A well's rank is the wells above its run, plus the run's average.
+    run_starts=np.flatnonzero(np.concatenate([[True], (values[1:]!=values[:-1]) | (codes[1:]!=codes[:-1])]))
+    runs=np.repeat(np.arange(len(run_starts)), np.diff(np.append(run_starts, len(values))))
+    above=run_starts[runs]-offsets[codes]
+    ties=np.diff(np.append(run_starts, len(values)))[runs]
+    n=sizes[codes]
+    quantiles=1-(n-(above+(ties+1)/2))/n
+    present=np.flatnonzero(counts)
+    for i, edge in enumerate(edges):
+        upper_side=np.where(quantiles>=edge if closed=='left' else quantiles>edge, values, -np.inf)
+        cuts[present, i]=np.maximum.reduceat(upper_side, offsets[present])
+    return cuts
+
+def deferment_quantile_cuts(df, ranking=None):
+    """
+    The quantile cuts (see quantile_cuts()) of each ranking group's deferment. A shard of the fleet is banded with
+    the whole fleet's cuts, so it gets the same bands as an unsharded run.
+    """
+    edges, closed=deferment_quantile_edges()
+    deferment=df['Deferment'].to_numpy(dtype='float64')
+    codes, groups=deferment_ranking_codes(df, ranking or DEFERMENT_RANKING)
+    if groups==[None]:
+        return {None: quantile_cuts(deferment[~np.isnan(deferment)], edges, closed, n=len(deferment))}
+    cuts=grouped_quantile_cuts(deferment, codes, len(groups), edges, closed)
+    present=np.bincount(codes, minlength=len(groups))>0
+    return {group: cuts[i] for i, group in enumerate(groups) if present[i]}
+
+def deferment_quantiles(df, cuts, ranking=None):
+    """
+    Each well's DefermentQuantile, as the edge of the quantile band it falls in (the lower edge for bands closed on
+    the left, the upper edge on the right). That's all the Deferment rules need, and it's found in one vectorized
+    pass against the group's cuts.
+    """
+    edges, closed=deferment_quantile_edges()
+    #The value standing in for each band, by the number of edges a well is on the upper side of
+    band_values=np.concatenate([[-np.inf], edges]) if closed=='left' else np.concatenate([edges, [np.inf]])
+    deferment=df['Deferment'].to_numpy(dtype='float64')
+    codes, groups=deferment_ranking_codes(df, ranking or DEFERMENT_RANKING)
+    no_cuts=np.full(len(edges), -np.inf)
+    group_cuts=np.array([cuts.get(group, no_cuts) for group in groups], dtype='float64').reshape(len(groups), len(edges))
+    #Count the cuts at or above each well's deferment
+    passed=(group_cuts[codes]>=deferment[:, None]).sum(axis=1)
+    return np.where(np.isnan(deferment), np.nan, band_values[passed])
+
+def gas_deferment_priorities(Assigned_To, well_metadata, cuts=None):
     
     def detect_if_well_is_deferring(df):
         """
@@ -93,54 +1375,36 @@ def gas_deferment_priorities(Assigned_To, well_metadata):
         Set priorities based on deferment amount (top 25% deferring wells are priority 1, 
         25-50% are priority 2, etc.)
         """
-        #Declare priority type as deferment
-        df['Priority']='Deferment'
-        #Get deferment quantiles to rank deferment by amount
-        df['DefermentRanking']=df['Deferment'].rank(ascending=0)
-        df=df.sort_values(by='Deferment')
-        df['DefermentQuantile']=1-(df.shape[0]-df['DefermentRanking'])/df.shape[0]
-        #Set up priority logic based on quantiles
-        df.loc[df['DefermentQuantile']<.25, 'Priority_Level'] = 2
-        df.loc[df['DefermentQuantile']>=.25, 'Priority_Level'] = 3
-        df.loc[df['DefermentQuantile']>=.50, 'Priority_Level'] = 4
-        df.loc[df['DefermentQuantile']>=.75, 'Priority_Level'] = 5
-        #Set up description logic based on quantiles
-        df.loc[df['DefermentQuantile']<.25, 'Description'] = 'Top 25% deferring wells: '
-        df.loc[df['DefermentQuantile']>=.25, 'Description'] = 'Top 25%-50% wells deferring: '
-        df.loc[df['DefermentQuantile']>=.5, 'Description'] = 'Top 50%-75% wells deferring: '
-        df.loc[df['DefermentQuantile']>=.75, 'Description'] = 'Bottom 25% wells deferring: '
-        #Add description details, including current production, and amount deferment
-        df['Description']=df['Description']+'Yesterday well produced '+df.Gas_Production.values.astype(str)+' MCFE, and deferred '+df.Deferment.values.astype(str)+' MCFE.'
+        #Get deferment quantile bands to rank deferment by amount, against the whole fleet's cuts when this is a shard of it
+        df['DefermentQuantile']=deferment_quantiles(df, cuts if cuts is not None else deferment_quantile_cuts(df))
+        #Set priority level and description based on quantiles, including current production and amount deferment
+        df=apply_priority_rules(df, 'Deferment')
         return df
     
-    #Use try-except statement to build and format deferment priorities, if there are any
-    try:
-        #Detect if a well is deferring or not (is it below lowerboundgas?)
-        well_metadata=detect_if_well_is_deferring(well_metadata)
-        #Remove any wells that aren't deferring
-        well_metadata=well_metadata[well_metadata.Deferring==True]
-        #Calculate deferment
-        well_metadata=calculate_deferment(well_metadata)
-        #Prioritize based on amount of deferment
-        well_metadata=set_priority(well_metadata)
-        #Add a blank Assigned_To column
-        well_metadata['Assigned_To']=Assigned_To
-        #Reformat priorities for SQL table insertion
-        well_metadata=format_priorities(well_metadata)
-        return well_metadata
-    except:
-        return 'No Deferment Priorities'
-
-def work_management_priorities(well_metadata):
+    #Build and format deferment priorities. An empty frame means there are none.
+    #Detect if a well is deferring or not (is it below lowerboundgas?)
+    well_metadata=detect_if_well_is_deferring(well_metadata.project(WELL_COLUMNS+['CleanAvgLowerBoundGas']))
+    #Remove any wells that aren't deferring
+    well_metadata=well_metadata[well_metadata.Deferring==True]
+    #Calculate deferment
+    well_metadata=calculate_deferment(well_metadata)
+    #Prioritize based on amount of deferment
+    well_metadata=set_priority(well_metadata)
+    #Add a blank Assigned_To column
+    well_metadata['Assigned_To']=Assigned_To
+    #Reformat priorities for SQL table insertion
+    well_metadata=format_priorities(well_metadata)
+    return well_metadata
+
+def work_management_priorities(well_metadata, sources=None):
     
     def pull_open_work_management_entries():
         """
         Pull any work management entries that are currently in progress and are from the past week. 
         Source is Enbase.WorkManagement in ODS
         """
-        query=('work_management_entries.sql')
         #Pull SQL data from future state server.
-        df=sql_helpers.pull_data_from_sql_query_future_state(query, 'ODS')
+        df=fetched_source(sources, 'work_management')
         return df
     
     def fill_blank_priorities(df):
@@ -150,34 +1414,31 @@ def work_management_priorities(well_metadata):
         df.loc[pd.isna(df['workOrderPriorityLevel']),'workOrderPriorityLevel']=5
         return df
     
-    #Use a try-except statement to build and return work management priorities, if there are any
-    try:
-        #Pull work management priorities
-        work_management=pull_open_work_management_entries()
-        #Merge work management entries with well metadata
-        work_management_merged=pd.merge(work_management, well_metadata.drop(columns=['Route']), left_on='APINumber', right_on='API', how='inner')
-        #Fill any blank priorities with a default of 5.
-        work_management_merged=fill_blank_priorities(work_management_merged)
-        #Declare priority type as Work Management
-        work_management_merged['Priority']='Enbase Work Management'
-        #Rename the Priority_Level, Description, Assigned_To, and WellName columns
-        work_management_merged.rename(columns={'workOrderDescription': 'Description', 'workOrderPriorityLevel': 'Priority_Level',
-                       'workOrderRequester': 'Assigned_To'}, inplace=True)
-        #Reformat for SQL insertion
-        work_management_final=format_priorities(work_management_merged)
-        #Return finalized dataframe
-        return work_management_final
-    except:
-        return 'No Work Management Priorities'
-
-def flood_priorities(Assigned_To, well_metadata):
+    #Build and return work management priorities. An empty frame means there are none.
+    #Pull work management priorities
+    work_management=pull_open_work_management_entries()
+    #Merge work management entries with well metadata
+    #Keep the Route from the work management entry
+    work_management_merged=well_metadata.attach(work_management, 'APINumber', 'API', [c for c in WELL_COLUMNS if c!='Route'])
+    #Fill any blank priorities with a default of 5.
+    work_management_merged=fill_blank_priorities(work_management_merged)
+    #Declare priority type as Work Management
+    work_management_merged['Priority']='Enbase Work Management'
+    #Rename the Priority_Level, Description, Assigned_To, and WellName columns
+    work_management_merged.rename(columns={'workOrderDescription': 'Description', 'workOrderPriorityLevel': 'Priority_Level',
+                   'workOrderRequester': 'Assigned_To'}, inplace=True)
+    #Reformat for SQL insertion
+    work_management_final=format_priorities(work_management_merged)
+    #Return finalized dataframe
+    return work_management_final
+
+def flood_priorities(Assigned_To, well_metadata, sources=None):
     
     def pull_flood_data():
         """
         Pull flood predictions from SQL
         """
-        query=('Flood_Priorities_Prediction.sql')
-        df=sql_helpers.pull_data_from_sql_query_arrow_future_state(query)
+        df=fetched_source(sources, 'flood_data')
         return df  
     
     def detect_if_well_is_already_shut_in_due_to_weather(merged_df):
@@ -191,305 +1452,1223 @@ def flood_priorities(Assigned_To, well_metadata):
         """
         Sets the priority of shutting the well in, based on how soon it's going to flood.
         """
-        #Declare priority type
-        df['Priority']='Flood Alert'
-        #Conditionally set Priority column based on when well is predicted to flood
-        df.loc[df['HoursUntilFlood']<24, 'Priority_Level'] = 1
-        df.loc[df['HoursUntilFlood']>=24, 'Priority_Level'] = 2
-        df.loc[df['HoursUntilFlood']>=48, 'Priority_Level'] = 3
-        df.loc[df['HoursUntilFlood']>=72, 'Priority_Level'] = 4
-        df.loc[df['HoursUntilFlood']>=96, 'Priority_Level'] = 5
-        #Conditionally set Description based on when well is predicted to flood
-        df.loc[df['HoursUntilFlood']<24, 'Description'] = 'Well is already flooding or is predicted to flood within the next 24 hours. '
-        df.loc[df['HoursUntilFlood']>=24, 'Description'] = 'Well is predicted to flood between 1 to 2 days. '
-        df.loc[df['HoursUntilFlood']>=48, 'Description'] = 'Well is predicted to flood between 2 and 3 days. '
-        df.loc[df['HoursUntilFlood']>=72, 'Description'] = 'Well is predicted to flood between 3 and 4 days. '
-        df.loc[df['HoursUntilFlood']>=96, 'Description'] = 'Well is predicted to flood between 4 and 5 days. '
-        #Add description details
-        df['Description']=df['Description']+'Affected flood height of the site is '+df.AffectedFloodHeight.values.astype(str)+' ft. Next predicted flood date is '+ df.EarliestPredictedFloodDate.values.astype(str)+'.'
+        #Set priority level and description based on when well is predicted to flood
+        df=apply_priority_rules(df, 'Flood Alert')
         #Return datframe with added Priority and Description columns
         return df
 
-    #Use a try-except statement to build and return flood priorities, if there are any
-    try:
-        #Pull the flood data and store to pandas df
-        flood_data=pull_flood_data()
-        flood_data['API']=flood_data.API.str[:10]
-        #Merge flood data with well metadata
-        merged_df=pd.merge(flood_data.drop(columns=['WellName']), well_metadata, on='API', how='inner')
-        #Determine if the wells already shut in due to flooding
-        merged_df=detect_if_well_is_already_shut_in_due_to_weather(merged_df)
-        #Remove cases where the well is already shut in due to weather (it's already been actioned)
-        merged_df=merged_df[merged_df.Already_Down_For_Weather==False]
-        #Set priorities based on when the well is supposed to flood
-        merged_df=set_priority(merged_df)
-        #Create Assigned_To Column and assign to James Walker
-        merged_df['Assigned_To']=Assigned_To
-        #Reformat the priorities
-        merged_df=format_priorities(merged_df)
-        return merged_df
-    except:
-        return 'No Flood Priorities'
+    #Build and return flood priorities. An empty frame means there are none.
+    #Pull the flood data and store to pandas df
+    flood_data=pull_flood_data()
+    flood_data['API']=flood_data.API.str[:10]
+    #Merge flood data with well metadata
+    merged_df=well_metadata.attach(flood_data, 'API', 'API')
+    #Determine if the wells already shut in due to flooding
+    merged_df=detect_if_well_is_already_shut_in_due_to_weather(merged_df)
+    #Remove cases where the well is already shut in due to weather (it's already been actioned)
+    merged_df=merged_df[merged_df.Already_Down_For_Weather==False]
+    #Set priorities based on when the well is supposed to flood
+    merged_df=set_priority(merged_df)
+    #Create Assigned_To Column and assign to James Walker
+    merged_df['Assigned_To']=Assigned_To
+    #Reformat the priorities
+    merged_df=format_priorities(merged_df)
+    return merged_df
 
-def cumulative_deferment_priorities(well_metadata):
+def cumulative_deferment_priorities(well_metadata, sources=None):
     
     def pull_cumulative_deferment_for_each_well():
         """
-        This function pulls the cumulative deferment for all of the SoHa wells from current state architecture.
+        This function pulls the cumulative deferment for all of the SoHa wells. A run serves it from the local 
+        deferment state (see refresh_deferment_state()), and it's only queried from current state architecture otherwise.
         """
-        query=('cumulative_deferment.sql')
-        df=sql_helpers.pull_data_from_sql_query_current_state(query)
+        df=fetched_source(sources, 'cumulative_deferment')
         return df
     
     def set_priority(df):
         """
         Sets the priority for cumulative deferment wells, based on logic.
         """
-        #Declare priority type
-        df['Priority']='Cumulative Deferment'
-        #Set priorities based on total amount of cumulative deferment
-        df.loc[(df['CumulativeDeferment']>=1000) & (df['CumulativeDeferment']<2000), 'Priority_Level'] = 5
-        df.loc[(df['CumulativeDeferment']>=2000) & (df['CumulativeDeferment']<3000), 'Priority_Level'] = 4
-        df.loc[(df['CumulativeDeferment']>=3000) & (df['CumulativeDeferment']<4000), 'Priority_Level'] = 3
-        df.loc[(df['CumulativeDeferment']>=4000) & (df['CumulativeDeferment']<5000), 'Priority_Level'] = 2
-        #Add description
-        df['Description']='Well has a cumulative deferment of '+df.CumulativeDeferment.astype(str)+' MCFE, and has been deferring for '+df.ConsecutiveDaysDeferring.values.astype(str)+' days.'
+        #Set priority level and description based on total amount of cumulative deferment
+        df=apply_priority_rules(df, 'Cumulative Deferment')
         #Return datframe with added Priority and Description columns
         return df
 
-    #Run a try-except statement to pull cumulative deferment priorities, if there are any
-    try:
-        #Pull cumulative deferment data.
-        cumulative_deferment_data=pull_cumulative_deferment_for_each_well()    
-        #Merge the two data frames.
-        cumulative_deferral_merged=pd.merge(well_metadata, cumulative_deferment_data, how='inner', left_on='Corp_ID', right_on='CorpID')
-        #Subset the data frame to include well that have been deferring for five or more days, and more than 1000 MCFE
-        cumulative_deferral_merged=cumulative_deferral_merged[(cumulative_deferral_merged['ConsecutiveDaysDeferring']>5) & (cumulative_deferral_merged['CumulativeDeferment']>=1000)]
-        #Set priorities based on conditions
-        cumulative_deferral_merged=set_priority(cumulative_deferral_merged)
-        cumulative_deferral_merged['Assigned_To']=None
-        #Reformat to fit the current priorities structure
-        cumulative_deferral_reformatted=format_priorities(cumulative_deferral_merged)
-        #Return the formatted dataset, ready for insertion
-        return cumulative_deferral_reformatted
-    except: 
-        return 'No Cumulative Deferment Priorities'
-
-def site_inspection_priorities(well_metadata):
+    #Build and return cumulative deferment priorities. An empty frame means there are none.
+    #Pull cumulative deferment data.
+    cumulative_deferment_data=pull_cumulative_deferment_for_each_well()    
+    #Merge the two data frames.
+    cumulative_deferral_merged=well_metadata.attach(cumulative_deferment_data, 'CorpID', 'Corp_ID')
+    #Subset the data frame to include well that have been deferring for five or more days, and more than 1000 MCFE
+    cumulative_deferral_merged=cumulative_deferral_merged[(cumulative_deferral_merged['ConsecutiveDaysDeferring']>5) & (cumulative_deferral_merged['CumulativeDeferment']>=1000)]
+    #Set priorities based on conditions
+    cumulative_deferral_merged=set_priority(cumulative_deferral_merged)
+    cumulative_deferral_merged['Assigned_To']=None
+    #Reformat to fit the current priorities structure
+    cumulative_deferral_reformatted=format_priorities(cumulative_deferral_merged)
+    #Return the formatted dataset, ready for insertion
+    return cumulative_deferral_reformatted
+
+def site_inspection_priorities(well_metadata, sources=None):
     
     def pull_site_inspections():
         """
         This function pulls the last date of site inspection for each well from Enbase.
         """
-        query=('site_inspections.sql')
         #Pull SQL data from future state server.
-        df=sql_helpers.pull_data_from_sql_query_future_state(query, 'ODS')
+        df=fetched_source(sources, 'site_inspections')
         return df
     
     def set_priority(df):
         """
         Sets site inspection priority, based on when the well was last visited.
         """
-        #Declare priority type
-        df['Priority']='Site Inspection'
-        #Set priorities based on last site visit
-        df.loc[(df['DaysSinceLastInspection']>=60) & (df['DaysSinceLastInspection']<75), 'Priority_Level'] = 5
-        df.loc[(df['DaysSinceLastInspection']>=75) & (df['DaysSinceLastInspection']<90), 'Priority_Level'] = 4
-        df.loc[df['DaysSinceLastInspection']>=90, 'Priority_Level'] = 3
-        #Add description details
-        df['Description']='Site Inspection Due: Last recorded site inspection was '+df.DaysSinceLastInspection.astype(str)+' days ago.'
+        #Set priority level and description based on last site visit
+        df=apply_priority_rules(df, 'Site Inspection')
         #Return datframe with added Priority and Description columns
         return df
     
-    #Run a try-except statement to pull site inspection priorities, if there are any
+    #Build and return site inspection priorities. An empty frame means there are none.
+    #Pull site inspection data.
+    site_inspection_data=pull_site_inspections()   
+    #Merge the two data frames.
+    site_inspection_merged=well_metadata.attach(site_inspection_data, 'APINumber', 'API')
+    #Remove any wells that have been inspected in the past 60 days.
+    site_inspection_merged=site_inspection_merged[site_inspection_merged['DaysSinceLastInspection']>60]
+    #Subset the data frame to include well that have been deferring for five or more days, and more than 1000 MCFE
+    #Set priorities based on conditions
+    site_inspection_merged=set_priority(site_inspection_merged)
+    site_inspection_merged['Assigned_To']=None
+    #Reformat to fit the current priorities structure
+    site_inspection_reformatted=format_priorities(site_inspection_merged)
+    #Return the formatted dataset, ready for insertion
+    return site_inspection_reformatted
+    
+def complete_rtu_readings(battery_voltages, percent_successful_comms):
+    """
+    An RTU source whose filters went to the database (attrs['pushed_down']) only returns the meters whose own reading
+    is bad. A meter flagged by the other source still needs its reading for the description, so the filtered source 
+    is pulled again unfiltered for just those meters' wells. A source pulled whole already has every reading, and 
+    isn't pulled again. The pulls go through fetch_sql_sources(), as a wave of their own whose deadlines count from 
+    its start, and a failed pull fails the RTU priorities. Returns both frames, each with a row for every flagged 
+    meter that has a reading, marked with attrs['readings_completed'] so they aren't completed twice.
+    """
+    frames={'battery_voltages': battery_voltages, 'percent_successful_comms': percent_successful_comms}
+    filtered=[name for name, df in frames.items() if df.attrs.get('pushed_down') and not df.attrs.get('readings_completed')]
+    meters={name: pd.MultiIndex.from_frame(df[['Corp_ID', 'Meter']]) for name, df in frames.items()}
+    #The flagged meters each filtered source has no reading for
+    others={'battery_voltages': 'percent_successful_comms', 'percent_successful_comms': 'battery_voltages'}
+    missing={name: meters[others[name]].difference(meters[name]) for name in filtered}
+    missing={name: flagged for name, flagged in missing.items() if len(flagged)>0}
+    completed=dict(frames)
+    if missing:
+        with telemetry_stage('fetch:rtu_readings', rows_in=len(missing)) as record:
+            readings=fetch_sql_sources(list(missing), filtered=False, 
+                                       keys_by_source={name: {'Corp_ID': list(flagged.get_level_values(0).unique())} 
+                                                       for name, flagged in missing.items()})
+            record_fetch(record, readings)
+        for name, df in readings.items():
+            if isinstance(df, Exception):
+                raise df
+            df=df[pd.MultiIndex.from_frame(df[['Corp_ID', 'Meter']]).isin(missing[name])]
+            completed[name]=pd.concat([frames[name], df], ignore_index=True)
+    for name, df in completed.items():
+        completed[name]=df.copy(deep=False)
+        completed[name].attrs['readings_completed']=True
+    return completed['battery_voltages'], completed['percent_successful_comms']
+
+def rtu_issue_rows(df):
+    """
+    The rows of the joined RTU readings where either reading passes its source's filters (see SOURCE_PUSHDOWN), as
+    a boolean array.
+    """
+    return pushdown_filter(df, 'battery_voltages') | pushdown_filter(df, 'percent_successful_comms')
+
+def complete_rtu_sources(sources):
+    """
+    complete_rtu_readings() on a run's fetched sources, in place, so the RTU priorities don't have to go back to the
+    database. A failed pull or re-pull fails both RTU sources.
+    """
     try:
-        #Pull site inspection data.
-        site_inspection_data=pull_site_inspections()   
-        #Merge the two data frames.
-        site_inspection_merged=pd.merge(site_inspection_data, well_metadata, left_on='APINumber', right_on='API', how='inner')
-        #Remove any wells that have been inspected in the past 60 days.
-        site_inspection_merged=site_inspection_merged[site_inspection_merged['DaysSinceLastInspection']>60]
-        #Subset the data frame to include well that have been deferring for five or more days, and more than 1000 MCFE
-        #Set priorities based on conditions
-        site_inspection_merged=set_priority(site_inspection_merged)
-        site_inspection_merged['Assigned_To']=None
-        #Reformat to fit the current priorities structure
-        site_inspection_reformatted=format_priorities(site_inspection_merged)
-        #Return the formatted dataset, ready for insertion
-        return site_inspection_reformatted
-    except: 
-        return 'No Site Inspection Priorities'
-    
-def RTU_comms_priorities(well_metadata):
+        frames=complete_rtu_readings(fetched_source(sources, 'battery_voltages'), 
+                                     fetched_source(sources, 'percent_successful_comms'))
+    except Exception as e:
+        frames=(e, e)
+    sources['battery_voltages'], sources['percent_successful_comms']=frames
+
+def RTU_comms_priorities(well_metadata, sources=None):
     
     def pull_most_recent_battery_voltage():
         """
         This function pulls the most recent battery voltages recorded for each RTU
         """
-        query=('rtu_battery_voltages.sql')
         #Pull SQL data from future state server.
-        df=sql_helpers.pull_data_from_sql_query_future_state(query, 'EnterpriseDataHub')
+        df=fetched_source(sources, 'battery_voltages')
         return df
 
     def pull_most_recent_hourly_percent_successful_comms():
         """
         This function pulls the most recent percentage successful comms (last hour) for each RTU
         """
-        query=('percent_successful_comms.sql')
         #Pull SQL data from future state server.
-        df=sql_helpers.pull_data_from_sql_query_future_state(query, 'EnterpriseDataHub')
+        df=fetched_source(sources, 'percent_successful_comms')
         return df
 
     def set_priority(df):
         """
         Sets automation priority, based on most recent percent successful comms and current battery voltage.
         """
-        #Declare priority type
-        df['Priority']='Automation-RTU Issue'
-        #Set priorities based on last site visit
-        df.loc[(df['PercentSuccessfulComms'].astype('float')<=50) | (df['BatteryVoltage'].astype('float')<=11), 'Priority_Level'] = 3
-        df.loc[(df['PercentSuccessfulComms'].astype('float')>50) & (df['PercentSuccessfulComms'].astype('float')<=60), 'Priority_Level'] = 4
-        df.loc[(df['PercentSuccessfulComms'].astype('float')>60) & (df['PercentSuccessfulComms'].astype('float')<=75), 'Priority_Level'] = 5
-        #Conditionally set Description based on last site visit
-        df.loc[:, 'Description'] = 'RTU Comms Issue Detected: '
-        #Add description details
-        df['Description']=df['Description']+'Percent successful comms in the past hour is '+df.PercentSuccessfulComms.values.astype(str)+'%, and current battery voltage is '+df.BatteryVoltage.values.astype(str)+'.'
+        #Set priority level and description based on comms and battery voltage
+        df=apply_priority_rules(df, 'Automation-RTU Issue')
         #Return datframe with added Priority and Description columns
         return df
-    #Run a try-except statement to pull automation priorities, if there are any
-    try:
-        #Pull the most recent battery voltages for the RTU
-        battery_voltages=pull_most_recent_battery_voltage()
-        #Pull the most recent hourly successful comms percentage
-        hourly_percent_successful_comms=pull_most_recent_hourly_percent_successful_comms()
-        #Merge all of the data sets together to create a master data set to build automation priorities off of
-        comms_anomaly_df=pd.merge(battery_voltages[['Corp_ID', 'Meter', 'LastBatteryVoltageReading', 'BatteryVoltage']], 
-                                  hourly_percent_successful_comms[['Corp_ID', 'Meter', 'LastPercentSuccessfulCommsReading', 
-                                                               'PercentSuccessfulComms']], on=['Corp_ID', 'Meter'], how='outer')
-        #Add metadata to the comms_anomaly_df dataframe
-        comms_anomaly_df=pd.merge(comms_anomaly_df, well_metadata, on=['Corp_ID'], how='inner')
-        #Run the dataframe through the set_priorities(), determining if there are any RTU's with poor performance
-        comms_anomaly_df=set_priority(comms_anomaly_df)
-        #Remove any rows without priorities associated with them (filter out null Priority_Level columns)
-        comms_anomaly_df=comms_anomaly_df[comms_anomaly_df['Priority_Level'].notnull()]
-        #Created Assigned_To column
-        comms_anomaly_df['Assigned_To']=None
-        #Format to fit the main priorities dataframe
-        comms_anomaly_df=format_priorities(comms_anomaly_df)
-        #return the list of automation priorities
-        return comms_anomaly_df
-    except: 
-        return 'No Automation Priorities'
+    #Build and return automation priorities. An empty frame means there are none.
+    #Pull the most recent battery voltages for the RTU
+    battery_voltages=pull_most_recent_battery_voltage()
+    #Pull the most recent hourly successful comms percentage
+    hourly_percent_successful_comms=pull_most_recent_hourly_percent_successful_comms()
+    #Fill in the other reading of meters that only one source flagged
+    battery_voltages, hourly_percent_successful_comms=complete_rtu_readings(battery_voltages, hourly_percent_successful_comms)
+    #Merge all of the data sets together to create a master data set to build automation priorities off of
+    comms_anomaly_df=pd.merge(battery_voltages[['Corp_ID', 'Meter', 'LastBatteryVoltageReading', 'BatteryVoltage']], 
+                              hourly_percent_successful_comms[['Corp_ID', 'Meter', 'LastPercentSuccessfulCommsReading', 
+                                                           'PercentSuccessfulComms']], on=['Corp_ID', 'Meter'], how='outer')
+    #Sources pulled whole come unfiltered, so keep the meters with either reading bad
+    comms_anomaly_df=comms_anomaly_df[rtu_issue_rows(comms_anomaly_df)]
+    #Add metadata to the comms_anomaly_df dataframe
+    comms_anomaly_df=well_metadata.attach(comms_anomaly_df, 'Corp_ID', 'Corp_ID')
+    #Run the dataframe through the set_priorities(), determining if there are any RTU's with poor performance
+    comms_anomaly_df=set_priority(comms_anomaly_df)
+    #Remove any rows without priorities associated with them (filter out null Priority_Level columns)
+    comms_anomaly_df=comms_anomaly_df[comms_anomaly_df['Priority_Level'].notnull()]
+    #Created Assigned_To column
+    comms_anomaly_df['Assigned_To']=None
+    #Format to fit the main priorities dataframe
+    comms_anomaly_df=format_priorities(comms_anomaly_df)
+    #return the list of automation priorities
+    return comms_anomaly_df
+
+#Grouper rules in order of precedence, first match wins. Priority type rules match the Priority exactly and take
+#precedence over the well's coding. Coding rules match anywhere in chokeStatusAction.
+GROUPER_PRIORITY_RULES=[('Site Inspection', 'Operations'),
+                        ('Flood Alert', 'Site Manager'),
+                        ('Automation', 'Automation')]
+GROUPER_ACTION_RULES=[(re.compile('Construction'), 'Construction'),
+                      (re.compile('Optimization'), 'Operations'),
+                      (re.compile('Work Complete'), 'Operations'),
+                      (re.compile('Midstream'), 'Operations'),
+                      (re.compile('Natural Decline'), 'Operations'),
+                      (re.compile('Maintenance'), 'Operations'),
+                      (re.compile('No Action'), 'Operations'),
+                      (re.compile('Operations'), 'Operations'),
+                      (re.compile('Engineering'), 'Engineering')]
+
+def group_for_action(action):
+    """
+    Find the group for a single chokeStatusAction value
+    """
+    for pattern, group in GROUPER_ACTION_RULES:
+        if pattern.search(action):
+            return group
+    return None
+
+#Every group a priority can be classified into
+GROUPER_GROUPS=list(dict.fromkeys(group for _, group in GROUPER_PRIORITY_RULES+GROUPER_ACTION_RULES))
 
 def classify_priority_types_to_groups(priority_df):
     """
     This function assigns priorities to different groups--FSS's, engineers, site managers, automation, optimizers--
-    based on well coding and other logic.
-    """
-    #Set wells coded to engineering to the engineering bucket
-    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Engineering")), 'Grouper'] = 'Engineering'
-    #Set wells coded to operations in operations bucket
-    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Operations")), 'Grouper'] = 'Operations'
-    #Set wells coded to 'No Action' in the Operations bucket
-    priority_df.loc[(priority_df.chokeStatusAction.str.contains("No Action")), 'Grouper'] = 'Operations'
-    #Set wells coded to maintenance in the operations bucket
-    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Maintenance")), 'Grouper'] = 'Operations'
-    #Set wells coded to Natural Decline into the operations bucket
-    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Natural Decline")), 'Grouper'] = 'Operations'
-    #Set wells coded to midstream in the operations bucket
-    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Midstream")), 'Grouper'] = 'Operations'
-    #Set wells coded as work complete to operations
-    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Work Complete")), 'Grouper'] = 'Operations'
-    #Set wells coded as Waiting on Optimization to operations
-    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Optimization")), 'Grouper'] = 'Operations'
-    #Set wells coded as Waiting on Construction to Construction
-    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Construction")), 'Grouper'] = 'Construction'
-    #Set automation priorities to automation
-    priority_df.loc[(priority_df.Priority=='Automation'), 'Grouper'] = 'Automation'
-    #Set flood priorities to site manager
-    priority_df.loc[priority_df.Priority=='Flood Alert', 'Grouper'] = 'Site Manager'
-    #Set site inspection priorities to Operations
-    priority_df.loc[priority_df.Priority=='Site Inspection', 'Grouper'] = 'Operations'
+    based on well coding and other logic. The rules are resolved once per distinct Priority and chokeStatusAction, 
+    and broadcast back to the rows as category codes.
+    """
+    #Resolve each distinct value once to a code into GROUPER_GROUPS (-1 for none). Null actions and priorities are 
+    #coded -1, which picks the trailing -1.
+    group_codes={group: code for code, group in enumerate(GROUPER_GROUPS)}
+    action_codes, actions=pd.factorize(priority_df.chokeStatusAction)
+    action_groups=np.array([group_codes.get(group_for_action(str(action)), -1) for action in actions]+[-1], dtype='int8')
+    priority_codes, priorities=pd.factorize(priority_df.Priority)
+    priority_rules=dict(GROUPER_PRIORITY_RULES)
+    priority_groups=np.array([group_codes.get(priority_rules.get(priority), -1) for priority in priorities]+[-1], dtype='int8')
+    #Priority type rules win over the well's coding
+    grouper=priority_groups[priority_codes]
+    grouper=np.where(grouper>=0, grouper, action_groups[action_codes])
+    priority_df['Grouper']=pd.Categorical.from_codes(grouper, categories=GROUPER_GROUPS)
     return priority_df
     
-def main():
+def format_priorities_test_table(priority_df):
+    """
+    Finalize the classified priorities for the SoHa.Priorities_Test table: drop T&A candidates, render the 
+    descriptions, stamp the calculation date and rename the columns for SQL insertion.
     """
-    Find priorities and write them to a SQL table
-    """
-    #Declare the site manager so he can be assigned specific 'site manager' priorities
-    site_manager='name'
-    #Pull the well metadata that will used as a basis for priorities
-    well_metadata=pull_well_specific_data()
-    #Get flood priorities
-    flood_priorities_df=flood_priorities(site_manager, well_metadata)
-    #Get work management priorities
-    work_management_priorities_df=work_management_priorities(well_metadata)
-    #Get deferment priorities
-    deferment_priorities_df=gas_deferment_priorities(None, well_metadata)
-    #Get the cumulative deferment priorities
-    #cumulative_deferment_priorities_df=cumulative_deferment_priorities()
-    #Get all the site inspection priorities
-    site_inspection_priorities_df=site_inspection_priorities(well_metadata)
-    #Get all the automation priorities
-    automation_priorities_df=RTU_comms_priorities(well_metadata)
-    #Create a master dataframe to append priorities to
-    priority_df=pd.DataFrame()
-    #Add deferment priorities if there are any 
-    if str(type(deferment_priorities_df))=="<class 'pandas.core.frame.DataFrame'>":
-        priority_df=priority_df.append(deferment_priorities_df)
-    #Add work management priorities if there any
-    if str(type(work_management_priorities_df))=="<class 'pandas.core.frame.DataFrame'>":
-        priority_df=priority_df.append(work_management_priorities_df)
-    #Add flood priorities if there are any
-    if str(type(flood_priorities_df))=="<class 'pandas.core.frame.DataFrame'>":
-        priority_df=priority_df.append(flood_priorities_df)
-    """
-    #Add cumulative deferment priorities if there are any
-    if str(type(cumulative_deferment_priorities_df))=="<class 'pandas.core.frame.DataFrame'>":
-        priority_df=priority_df.append(cumulative_deferment_priorities_df)
-    """
-    #Add site inspection priorities if there are any 
-    if str(type(site_inspection_priorities_df))=="<class 'pandas.core.frame.DataFrame'>":
-        priority_df=priority_df.append(site_inspection_priorities_df)
-    #Add automation priorities if there any
-    if str(type(automation_priorities_df))=="<class 'pandas.core.frame.DataFrame'>":
-        priority_df=priority_df.append(automation_priorities_df)
-    #Write the priorities to a table
-    priority_df=classify_priority_types_to_groups(priority_df)
     #Remove any T&A candidates
     priority_df=priority_df[priority_df.chokeStatusAction!='TA - P&A Candidate']
+    #Render the descriptions, now that only the priorities that will be published are left
+    priority_df=render_descriptions(priority_df)
     #add calculation date column
     priority_df['Calc_Date']=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     #Rename columns for SQL insertion
-    priority_df.rename(columns={'WellName': 'Well_Name', 'chokeStatusDate': 'Choke_Status_Date',
-                       'chokeStatusType': 'Choke_Status_Type', 'chokeStatusAction': 'Choke_Status_Action', 
-                       'chokeStatusCreatedBy': 'Choke_Status_Created_By',
-                       'chokeStatusComments': 'Choke_Status_Comments', 'Gas_Production':'Yesterday_Gas_Production',
-                       'CleanAvgGas':'Clean_Average_Gas'}, inplace=True)
-    #Insert into ArrowAppTest table, under SoHa.Priorities_Test
-    sql_helpers.sql_push_future_state_arrow_test(priority_df, table='Priorities_Test', schema='SoHa', if_exists='replace', database='ArrowtestDB')
-    #Insert formatted priorities into the VRP_Details.SoHa_Priorities table
-    #Reformat priorities for insertion into the approved Arrow table
-    priority_df.rename(columns={'Well_Name':'SiteName',
-                          'Facility_ID':'FacilityKey', 
-                          'Corp_ID':'LocationID',
-                          'Priority_Level':'PriorityLevel',
-                          'Description':'Reason',
-                          'Priority':'PriorityType',
-                          'Facility_ID':'FacilityKey',
-                          'Calc_Date': 'CalcDate',
-                          'Assigned_To': 'Person_assigned'}, inplace=True)
+    priority_df=priority_df.rename(columns={'WellName': 'Well_Name', 'chokeStatusDate': 'Choke_Status_Date',
+                                            'chokeStatusType': 'Choke_Status_Type', 'chokeStatusAction': 'Choke_Status_Action', 
+                                            'chokeStatusCreatedBy': 'Choke_Status_Created_By',
+                                            'chokeStatusComments': 'Choke_Status_Comments', 'Gas_Production':'Yesterday_Gas_Production',
+                                            'CleanAvgGas':'Clean_Average_Gas'})
+    return priority_df
+
+#Job sequencing settings. Each Route's (or each Grouper's, see SOHA_JOB_SEQUENCE_BY) open priorities are put in a 
+#travel order that favours urgent jobs. Job_Rank is a job's place in its group's order, and JobTime the minutes to 
+#drive to it from the job before and work it. Jobs without coordinates aren't ranked.
+JOB_SEQUENCE_BY=os.environ.get('SOHA_JOB_SEQUENCE_BY', 'Route')
+#Weight of each priority level: travelling twice as far is worth it for a job with twice the weight
+JOB_PRIORITY_WEIGHTS={1: 5, 2: 4, 3: 3, 4: 2, 5: 1}
+#Minutes on site for each priority type, and for types without an entry
+JOB_SERVICE_MINUTES={'Flood Alert': 30,
+                     'Deferment': 45,
+                     'Cumulative Deferment': 60,
+                     'Site Inspection': 30,
+                     'Automation-RTU Issue': 45,
+                     'Enbase Work Management': 90}
+JOB_DEFAULT_SERVICE_MINUTES=45
+#Average driving speed, and how much longer the drive is than the great circle distance between sites
+JOB_TRAVEL_SPEED_KMH=50
+JOB_ROAD_FACTOR=1.3
+EARTH_RADIUS_KM=6371.0
+#Groups with at most this many jobs left are sequenced by brute force, larger ones through a KD tree (needs scipy)
+JOB_BRUTE_FORCE_LIMIT=1000
+
+def unit_vectors(latitude, longitude):
+    """
+    Points on the unit sphere. The straight line (chord) distance between two of them converts exactly to their
+    haversine distance (see chord_to_km()), so a KD tree over them finds the nearest sites on the globe.
+    """
+    latitude, longitude=np.radians(latitude), np.radians(longitude)
+    return np.column_stack([np.cos(latitude)*np.cos(longitude), np.cos(latitude)*np.sin(longitude), np.sin(latitude)])
+
+def chord_to_km(chord):
+    """
+    Great circle distance in km for a chord distance between unit vectors.
+    """
+    return 2*EARTH_RADIUS_KM*np.arcsin(np.minimum(chord/2, 1))
+
+def km_to_chord(km):
+    """
+    Chord distance between unit vectors for a great circle distance in km.
+    """
+    return 2*np.sin(np.minimum(km/(2*EARTH_RADIUS_KM), np.pi/2))
+
+def sequence_group(points, weights):
+    """
+    Order one group's jobs (unit_vectors() and priority weights) for travel. Starting from the most urgent job, the
+    next job is always the one with the least distance per unit of weight from the current one. Only jobs within 
+    reach of beating the nearest one are compared: a KD tree over the jobs that are left finds them, and is rebuilt 
+    once half of its jobs are done. Ties go to the earlier job. Returns the order (positions into points) and the km
+    travelled to reach each job in it (0 for the first).
+    """
+    jobs=len(points)
+    max_weight=weights.max()
+    done=np.zeros(jobs, dtype=bool)
+    current=int(np.argmax(weights))
+    done[current]=True
+    order, legs=[current], [0.0]
+    tree, tree_positions, tree_done=None, None, 0
+    for left in range(jobs-1, 0, -1):
+        if cKDTree is None or left<=JOB_BRUTE_FORCE_LIMIT:
+            candidates=np.flatnonzero(~done)
+        else:
+            if tree is None or 2*tree_done>=len(tree_positions):
+                tree_positions, tree_done=np.flatnonzero(~done), 0
+                tree=cKDTree(points[tree_positions])
+            #The nearest job that's left bounds how far away a heavier job can be and still win
+            k=min(8, len(tree_positions))
+            while True:
+                distances, found=tree.query(points[current], k)
+                distances, found=np.atleast_1d(distances), np.atleast_1d(found)
+                open_jobs=~done[tree_positions[found]]
+                if open_jobs.any() or k==len(tree_positions):
+                    break
+                k=min(2*k, len(tree_positions))
+            nearest=np.argmax(open_jobs)
+            reach=chord_to_km(distances[nearest])*max_weight/weights[tree_positions[found[nearest]]]
+            candidates=np.sort(tree_positions[tree.query_ball_point(points[current], km_to_chord(reach)*(1+1e-9))])
+            candidates=candidates[~done[candidates]]
+            tree_done+=1
+        km=chord_to_km(np.linalg.norm(points[candidates]-points[current], axis=1))
+        best=np.argmin(km/weights[candidates])
+        current=int(candidates[best])
+        done[current]=True
+        order.append(current)
+        legs.append(km[best])
+    return np.array(order), np.array(legs)
+
+def sequence_jobs(latitude, longitude, groups, levels, priority_types):
+    """
+    Sequence every group's jobs with sequence_group(), on plain arrays so both execution modes can use it. Returns 
+    each job's Job_Rank (1 for the first job in its group), whether it was ranked, and its JobTime in minutes (NaN 
+    where it wasn't ranked).
+    """
+    latitude=np.asarray(latitude, dtype='float64')
+    longitude=np.asarray(longitude, dtype='float64')
+    #Jobs without a priority level weigh the least, and null groups are sequenced as a group of their own
+    weights=pd.Series(np.asarray(levels, dtype='float64')).map(JOB_PRIORITY_WEIGHTS).fillna(min(JOB_PRIORITY_WEIGHTS.values())).to_numpy()
+    service=pd.Series(np.asarray(priority_types, dtype=object)).map(JOB_SERVICE_MINUTES).fillna(JOB_DEFAULT_SERVICE_MINUTES).to_numpy()
+    codes, _=pd.factorize(np.asarray(groups, dtype=object))
+    ranked=~(np.isnan(latitude) | np.isnan(longitude))
+    points=unit_vectors(latitude, longitude)
+    ranks=np.zeros(len(latitude), dtype='int64')
+    minutes=np.full(len(latitude), np.nan)
+    positions=np.flatnonzero(ranked)
+    positions=positions[np.argsort(codes[positions], kind='stable')]
+    for group in np.split(positions, np.flatnonzero(np.diff(codes[positions]))+1):
+        if len(group)==0:
+            continue
+        order, legs=sequence_group(points[group], weights[group])
+        ranks[group[order]]=np.arange(1, len(group)+1)
+        minutes[group[order]]=legs*JOB_ROAD_FACTOR/JOB_TRAVEL_SPEED_KMH*60+service[group[order]]
+    return ranks, ranked, minutes.round(1)
+
+def format_vrp_priorities(priority_df):
+    """
+    Reformat the Priorities_Test frame for insertion into the approved Arrow table, VRP_Details.SoHa_Priorities
+    """
+    priority_df=priority_df.rename(columns={'Well_Name':'SiteName',
+                                            'Facility_ID':'FacilityKey', 
+                                            'Corp_ID':'LocationID',
+                                            'Priority_Level':'PriorityLevel',
+                                            'Description':'Reason',
+                                            'Priority':'PriorityType',
+                                            'Calc_Date': 'CalcDate',
+                                            'Assigned_To': 'Person_assigned'})
     #Add in any missing columns for final insertion
     priority_df['Supporting_info']=None
-    priority_df['Job_Rank']=None
-    priority_df['JobTime']=None
+    #Put each Route's (or Grouper's) jobs in travel order
+    with telemetry_stage('sequence:'+JOB_SEQUENCE_BY, rows_in=len(priority_df)) as record:
+        ranks, ranked, minutes=sequence_jobs(priority_df['Latitude'], priority_df['Longitude'], priority_df[JOB_SEQUENCE_BY], 
+                                             priority_df['PriorityLevel'], priority_df['PriorityType'])
+        priority_df['Job_Rank']=pd.arrays.IntegerArray(ranks, ~ranked)
+        priority_df['JobTime']=minutes
+        record['rows_out']=int(ranked.sum())
     priority_df['DefermentGas']=priority_df['Clean_Average_Gas']-priority_df['Yesterday_Gas_Production']
     #Subset the dataframe for final insertion
     priority_df=priority_df[['FacilityKey', 'SiteName', 'LocationID', 'Latitude', 'Longitude', 'PriorityLevel','Grouper','JobTime',
                              'Reason','Supporting_info','PriorityType','DefermentGas','Person_assigned','Job_Rank','CalcDate']]
-    sql_helpers.sql_push_future_state_arrow_test(priority_df, table='SoHa_Priorities', schema='VRP_Details', if_exists='replace', database='ArrowtestDB')
+    return priority_df
+
+#Execution mode. 'pandas' runs the pipeline on DataFrames. 'arrow' keeps the data as pyarrow Tables from fetch to
+#push (joins, filters, rule evaluation and projections in Arrow compute), and only converts to pandas for the push.
+EXECUTION_MODE=os.environ.get('SOHA_EXECUTION_MODE', 'pandas')
+
+def arrow_table(df):
+    """
+    A pulled source as a pyarrow Table. Tables pass straight through, frames are converted once.
+    """
+    if isinstance(df, pa.Table):
+        return df
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+def arrow_constant(value, rows, type=None):
+    """
+    A column repeating one value (or null) for every row.
+    """
+    type=type or pa.string()
+    if value is None:
+        return pa.nulls(rows, type)
+    return pa.array(np.full(rows, value, dtype=object), type)
+
+def arrow_set_columns(table, columns):
+    """
+    Add or replace columns on a table, from a dictionary of column name to array.
+    """
+    for name, values in columns.items():
+        index=table.schema.get_field_index(name)
+        table=table.set_column(index, name, values) if index>=0 else table.append_column(name, values)
+    return table
+
+def arrow_float64(table, column):
+    """
+    A column as float64 numpy values for the rule engine. Text is parsed, and nulls become NaN.
+    """
+    return pc.cast(table[column], pa.float64()).to_numpy(zero_copy_only=False)
+
+def arrow_api10(column):
+    """
+    API numbers as text, cut down to API10
+    """
+    return pc.utf8_slice_codeunits(pc.cast(column, pa.string()), 0, 10)
+
+def arrow_join(left, right, left_on, right_on=None, join_type='inner'):
+    """
+    Join two tables, casting the right keys to the left keys' types first (e.g. string against large_string).
+    """
+    left_on=[left_on] if isinstance(left_on, str) else left_on
+    right_on=left_on if right_on is None else [right_on] if isinstance(right_on, str) else right_on
+    right=arrow_set_columns(right, {r: pc.cast(right[r], left[l].type) for l, r in zip(left_on, right_on)})
+    return left.join(right, keys=left_on, right_keys=right_on, join_type=join_type)
+
+class ArrowWellIndex:
+    """
+    WellIndex for the arrow execution mode. The merged well metadata is a pyarrow Table, and attach() finds each
+    row's well through an index_in lookup on API10 or Corp_ID and takes its columns by position.
+    """
+    
+    def __init__(self, table):
+        self.table=table.combine_chunks()
+        self.unique={key: pc.count_distinct(self.table[key], mode='all').as_py()==len(self.table) for key in ['API', 'Corp_ID']}
+    
+    def __len__(self):
+        return len(self.table)
+    
+    def project(self, columns):
+        """
+        The well metadata, with only the given columns (no copy).
+        """
+        return self.table.select(list(columns))
+    
+    def attach(self, table, left_on, key='API', columns=WELL_COLUMNS):
+        """
+        Inner join the given well columns onto table, like WellIndex.attach(). Falls back to a hash join if the key 
+        isn't unique in the well metadata.
+        """
+        with telemetry_stage('attach:'+key, rows_in=len(table)) as record:
+            columns=[c for c in columns if c!=left_on]
+            kept=table.select([c for c in table.column_names if c not in columns])
+            kept=arrow_set_columns(kept, {left_on: pc.cast(kept[left_on], self.table[key].type)})
+            if self.unique[key]:
+                positions=pc.index_in(kept[left_on], value_set=self.table[key])
+                found=pc.is_valid(positions)
+                kept=kept.filter(found)
+                wells=self.table.select(columns).take(positions.filter(found))
+                attached=pa.Table.from_arrays(kept.columns+wells.columns, names=kept.column_names+wells.column_names)
+            else:
+                attached=arrow_join(kept, self.project(dict.fromkeys([key]+columns)), left_on, key)
+            record['rows_out']=len(attached)
+        return attached
+
+def arrow_pull_well_specific_data(sources=None):
+    """
+    pull_well_specific_data() for the arrow execution mode. Returns an ArrowWellIndex.
+    """
+    #Pull metadata and make APINumber API10
+    well_metadata=arrow_table(fetched_source(sources, 'well_metadata'))
+    well_metadata=arrow_set_columns(well_metadata, {'API': arrow_api10(well_metadata['API'])})
+    well_codes=arrow_table(fetched_source(sources, 'well_codes')).select(['apinumber', 'chokeStatusCreatedBy', 'chokeStatusDate', 
+                                                                          'chokeStatusType', 'chokeStatusAction', 'chokeStatusComments'])
+    #Merge well code with well metadata
+    with telemetry_stage('merge:well_codes', rows_in=len(well_metadata)) as record:
+        merged=arrow_join(well_metadata, well_codes, 'API', 'apinumber')
+        record['rows_out']=len(merged)
+    #Merge yesterday's production and the clean average into the main table
+    yday_gas_production=arrow_table(fetched_source(sources, 'yday_gas_production'))
+    yday_gas_production=pa.table({'Corp_ID': yday_gas_production['Corp_ID'],
+                                  'Gas_Production': pc.cast(yday_gas_production['wellhead_extrapolated_24_hr_gas'], pa.float64()),
+                                  'Production_Date': yday_gas_production['production_date_utc']})
+    with telemetry_stage('merge:yday_gas_production', rows_in=len(merged)) as record:
+        merged=arrow_join(merged, yday_gas_production, 'Corp_ID')
+        record['rows_out']=len(merged)
+    clean_average=arrow_table(fetched_source(sources, 'clean_average')).select(['Corp_ID', 'CleanAvgGas', 'CleanAvgLowerBoundGas'])
+    with telemetry_stage('merge:clean_average', rows_in=len(merged)) as record:
+        merged=arrow_join(merged, clean_average, 'Corp_ID')
+        record['rows_out']=len(merged)
+    return ArrowWellIndex(merged)
+
+def arrow_apply_priority_rules(table, priority_type):
+    """
+    apply_priority_rules() for the arrow execution mode.
+    """
+    with telemetry_stage('rules:'+priority_type, rows_in=len(table)) as record:
+        band, levels, template_ids=find_priority_bands(priority_type, len(table), lambda column: arrow_float64(table, column))
+        table=arrow_set_columns(table, {'Priority': arrow_constant(priority_type, len(table)),
+                                        'Priority_Level': pa.array(levels[band], from_pandas=True),
+                                        'Description': arrow_constant(None, len(table)),
+                                        'Description_Template': pa.array(template_ids[band], from_pandas=True)})
+        record['rows_out']=int((band>=0).sum())
+    return table
+
+def arrow_format_priorities(table):
+    """
+    format_priorities() for the arrow execution mode. Missing template fields are added as null columns, and 
+    duplicates are dropped once all of the priority types are combined (see arrow_combine_priorities()).
+    """
+    columns=PRIORITY_COLUMNS+['Description_Template']+[c for c in DESCRIPTION_FIELDS if c not in PRIORITY_COLUMNS]
+    #Columns that can come from a generator or be filled in, cast so every priority type lines up
+    types={'Priority_Level': pa.float64(), 'Description': pa.string(), 'Assigned_To': pa.string(), 'Description_Template': pa.float64()}
+    table=arrow_set_columns(table, {c: pa.nulls(len(table), types.get(c, pa.null())) for c in columns if c not in table.column_names})
+    table=arrow_set_columns(table, {c: pc.cast(table[c], t) for c, t in types.items()})
+    #Categorical sources arrive as dictionaries, which can't be combined across priority types with differing values
+    table=arrow_set_columns(table, {c: pc.cast(table[c], table[c].type.value_type) for c in columns
+                                    if pa.types.is_dictionary(table[c].type)})
+    return table.select(columns)
+
+def arrow_combine_priorities(tables):
+    """
+    Combine the priority types into one table, without duplicate rows.
+    """
+    combined=pa.concat_tables([t for t in tables if t is not None], promote_options='default')
+    return combined.group_by(combined.column_names, use_threads=False).aggregate([]).select(combined.column_names)
+
+def arrow_gas_deferment_priorities(Assigned_To, well_index):
+    """
+    gas_deferment_priorities() for the arrow execution mode.
+    """
+    table=well_index.project(WELL_COLUMNS+['CleanAvgLowerBoundGas'])
+    #Remove any wells that aren't deferring (below lowerboundgas), and calculate deferment
+    table=table.filter(pc.less(table['Gas_Production'], table['CleanAvgLowerBoundGas']))
+    table=arrow_set_columns(table, {'Deferment': pc.subtract(table['CleanAvgGas'], table['Gas_Production'])})
+    #Rank deferment into quantile bands (see DEFERMENT_RANKING), from just the columns the ranking needs
+    ranking=pd.DataFrame({'Deferment': arrow_float64(table, 'Deferment'), 'Area': table['Area'].to_numpy(zero_copy_only=False),
+                          'Route': table['Route'].to_numpy(zero_copy_only=False)})
+    table=arrow_set_columns(table, {'DefermentQuantile': pa.array(deferment_quantiles(ranking, deferment_quantile_cuts(ranking)))})
+    table=arrow_apply_priority_rules(table, 'Deferment')
+    table=arrow_set_columns(table, {'Assigned_To': arrow_constant(Assigned_To, len(table))})
+    return arrow_format_priorities(table)
+
+def arrow_work_management_priorities(well_index, sources=None):
+    """
+    work_management_priorities() for the arrow execution mode.
+    """
+    work_management=arrow_table(fetched_source(sources, 'work_management'))
+    #Keep the Route from the work management entry
+    table=well_index.attach(work_management, 'APINumber', 'API', [c for c in WELL_COLUMNS if c!='Route'])
+    #Fill any blank priorities with a default of 5, and declare the priority type
+    table=arrow_set_columns(table, {'workOrderPriorityLevel': pc.fill_null(pc.cast(table['workOrderPriorityLevel'], pa.float64()), 5.0),
+                                    'Priority': arrow_constant('Enbase Work Management', len(table))})
+    renames={'workOrderDescription': 'Description', 'workOrderPriorityLevel': 'Priority_Level', 'workOrderRequester': 'Assigned_To'}
+    table=table.rename_columns([renames.get(c, c) for c in table.column_names])
+    return arrow_format_priorities(table)
+
+def arrow_flood_priorities(Assigned_To, well_index, sources=None):
+    """
+    flood_priorities() for the arrow execution mode.
+    """
+    flood_data=arrow_table(fetched_source(sources, 'flood_data'))
+    flood_data=arrow_set_columns(flood_data, {'API': arrow_api10(flood_data['API'])})
+    table=well_index.attach(flood_data, 'API', 'API')
+    #Remove cases where the well is already shut in due to weather (it's already been actioned)
+    table=table.filter(pc.fill_null(pc.not_equal(table['chokeStatusType'], 'Down - Weather'), True))
+    table=arrow_apply_priority_rules(table, 'Flood Alert')
+    table=arrow_set_columns(table, {'Assigned_To': arrow_constant(Assigned_To, len(table))})
+    return arrow_format_priorities(table)
+
+def arrow_cumulative_deferment_priorities(well_index, sources=None):
+    """
+    cumulative_deferment_priorities() for the arrow execution mode.
+    """
+    cumulative_deferment_data=arrow_table(fetched_source(sources, 'cumulative_deferment'))
+    table=well_index.attach(cumulative_deferment_data, 'CorpID', 'Corp_ID')
+    #Keep wells that have been deferring for more than five days, and 1000 MCFE or more
+    table=table.filter(pc.and_(pc.greater(table['ConsecutiveDaysDeferring'], 5), pc.greater_equal(table['CumulativeDeferment'], 1000)))
+    table=arrow_apply_priority_rules(table, 'Cumulative Deferment')
+    table=arrow_set_columns(table, {'Assigned_To': arrow_constant(None, len(table))})
+    return arrow_format_priorities(table)
+
+def arrow_site_inspection_priorities(well_index, sources=None):
+    """
+    site_inspection_priorities() for the arrow execution mode.
+    """
+    site_inspection_data=arrow_table(fetched_source(sources, 'site_inspections'))
+    table=well_index.attach(site_inspection_data, 'APINumber', 'API')
+    #Remove any wells that have been inspected in the past 60 days.
+    table=table.filter(pc.greater(table['DaysSinceLastInspection'], 60))
+    table=arrow_apply_priority_rules(table, 'Site Inspection')
+    table=arrow_set_columns(table, {'Assigned_To': arrow_constant(None, len(table))})
+    return arrow_format_priorities(table)
+
+def arrow_RTU_comms_priorities(well_index, sources=None):
+    """
+    RTU_comms_priorities() for the arrow execution mode.
+    """
+    battery_voltages, hourly_percent_successful_comms=complete_rtu_readings(fetched_source(sources, 'battery_voltages'),
+                                                                            fetched_source(sources, 'percent_successful_comms'))
+    battery_voltages=arrow_table(battery_voltages).select(['Corp_ID', 'Meter', 'LastBatteryVoltageReading', 'BatteryVoltage'])
+    hourly_percent_successful_comms=arrow_table(hourly_percent_successful_comms).select(['Corp_ID', 'Meter', 
+                                                                 'LastPercentSuccessfulCommsReading', 'PercentSuccessfulComms'])
+    table=arrow_join(battery_voltages, hourly_percent_successful_comms, ['Corp_ID', 'Meter'], join_type='full outer')
+    #Sources pulled whole come unfiltered, so keep the meters with either reading bad
+    table=table.filter(pa.array(rtu_issue_rows(table.select(['BatteryVoltage', 'PercentSuccessfulComms']).to_pandas())))
+    table=well_index.attach(table, 'Corp_ID', 'Corp_ID')
+    table=arrow_apply_priority_rules(table, 'Automation-RTU Issue')
+    #Remove any rows without priorities associated with them
+    table=table.filter(pc.is_valid(table['Priority_Level']))
+    table=arrow_set_columns(table, {'Assigned_To': arrow_constant(None, len(table))})
+    return arrow_format_priorities(table)
+
+def arrow_classify_priority_types_to_groups(table):
+    """
+    classify_priority_types_to_groups() for the arrow execution mode, resolving each dictionary value once.
+    """
+    actions=pc.dictionary_encode(table['chokeStatusAction'].combine_chunks())
+    action_groups=pa.array([None if a is None else group_for_action(str(a)) for a in actions.dictionary.to_pylist()], pa.string())
+    priorities=pc.dictionary_encode(table['Priority'].combine_chunks())
+    priority_rules=dict(GROUPER_PRIORITY_RULES)
+    priority_groups=pa.array([priority_rules.get(p) for p in priorities.dictionary.to_pylist()], pa.string())
+    #Priority type rules win over the well's coding
+    grouper=pc.coalesce(priority_groups.take(priorities.indices), action_groups.take(actions.indices))
+    return arrow_set_columns(table, {'Grouper': grouper})
+
+def arrow_format_priorities_test_table(table):
+    """
+    format_priorities_test_table() for the arrow execution mode.
+    """
+    #Remove any T&A candidates
+    table=table.filter(pc.fill_null(pc.not_equal(table['chokeStatusAction'], 'TA - P&A Candidate'), True))
+    #Render the descriptions from the template and field columns only
+    descriptions=render_description_values(table['Description'].to_numpy(zero_copy_only=False).astype(object), 
+                                           pc.cast(table['Description_Template'], pa.float64()).to_numpy(zero_copy_only=False),
+                                           lambda field: table[field].to_numpy(zero_copy_only=False))
+    table=arrow_set_columns(table, {'Description': pa.array(descriptions, pa.string()),
+                                    'Calc_Date': arrow_constant(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), len(table))})
+    table=table.drop_columns(['Description_Template']+[c for c in DESCRIPTION_FIELDS if c not in PRIORITY_COLUMNS])
+    renames={'WellName': 'Well_Name', 'chokeStatusDate': 'Choke_Status_Date', 'chokeStatusType': 'Choke_Status_Type', 
+             'chokeStatusAction': 'Choke_Status_Action', 'chokeStatusCreatedBy': 'Choke_Status_Created_By',
+             'chokeStatusComments': 'Choke_Status_Comments', 'Gas_Production':'Yesterday_Gas_Production', 'CleanAvgGas':'Clean_Average_Gas'}
+    return table.rename_columns([renames.get(c, c) for c in table.column_names])
+
+def arrow_format_vrp_priorities(table):
+    """
+    format_vrp_priorities() for the arrow execution mode.
+    """
+    renames={'Well_Name':'SiteName', 'Facility_ID':'FacilityKey', 'Corp_ID':'LocationID', 'Priority_Level':'PriorityLevel',
+             'Description':'Reason', 'Priority':'PriorityType', 'Calc_Date': 'CalcDate', 'Assigned_To': 'Person_assigned'}
+    table=table.rename_columns([renames.get(c, c) for c in table.column_names])
+    with telemetry_stage('sequence:'+JOB_SEQUENCE_BY, rows_in=len(table)) as record:
+        ranks, ranked, minutes=sequence_jobs(*[table[c].to_numpy(zero_copy_only=False) for c in 
+                                               ['Latitude', 'Longitude', JOB_SEQUENCE_BY, 'PriorityLevel', 'PriorityType']])
+        record['rows_out']=int(ranked.sum())
+    table=arrow_set_columns(table, {'Supporting_info': pa.nulls(len(table)),
+                                    'Job_Rank': pa.array(ranks, mask=~ranked),
+                                    'JobTime': pa.array(minutes, from_pandas=True),
+                                    'DefermentGas': pc.subtract(table['Clean_Average_Gas'], table['Yesterday_Gas_Production'])})
+    return table.select(['FacilityKey', 'SiteName', 'LocationID', 'Latitude', 'Longitude', 'PriorityLevel','Grouper','JobTime',
+                         'Reason','Supporting_info','PriorityType','DefermentGas','Person_assigned','Job_Rank','CalcDate'])
+
+def run_arrow_priorities():
+    """
+    run_priorities() for the arrow execution mode. Tables are only converted to pandas for the pushes.
+    """
+    if pa is None:
+        raise ImportError('The arrow execution mode needs pyarrow')
+    names=enabled_priority_sources()
+    sources, well_index=fetch_run_sources(arrow_pull_well_specific_data, priority_run_sources(names))
+    sources.update(local_priority_sources(well_index, names))
+    tables=run_priority_sources(well_index, sources, names, mode='arrow')
+    with telemetry_stage('combine') as record:
+        table=arrow_combine_priorities(tables.values())
+        record['rows_out']=len(table)
+    with telemetry_stage('classify', rows_in=len(table)) as record:
+        table=arrow_classify_priority_types_to_groups(table)
+        record['rows_out']=len(table)
+    with telemetry_stage('format:SoHa.Priorities_Test', rows_in=len(table)) as record:
+        table=arrow_format_priorities_test_table(table)
+        record['rows_out']=len(table)
+    push_priorities(table.to_pandas(), table='Priorities_Test', schema='SoHa', key_columns=['Corp_ID', 'Priority'])
+    with telemetry_stage('format:VRP_Details.SoHa_Priorities', rows_in=len(table)) as record:
+        table=arrow_format_vrp_priorities(table)
+        record['rows_out']=len(table)
+    push_priorities(table.to_pandas(), table='SoHa_Priorities', schema='VRP_Details', key_columns=['LocationID', 'PriorityType'])
+
+def run_priority_generator(name, generator, *args, rows_in=None, output=None):
+    """
+    Run a priority generator as its own telemetry stage, recording the priority type it outputs if given. A failed
+    generator is logged and recorded with its error class, and only drops its own priority type, so None is 
+    returned in place of its frame.
+    """
+    try:
+        with telemetry_stage('priorities:'+name, rows_in=rows_in) as record:
+            if output is not None:
+                record['priority_type']=output
+            df=generator(*args)
+            record['rows_out']=len(df)
+        return df
+    except Exception:
+        LOGGER.exception('Priority source %s failed, dropping its priorities', name)
+        return None
+
+#Priority sources, in the order their priorities are combined. Each declares the sources it reads besides the well 
+#index ('inputs'), the priority type it outputs, and its generator for each execution mode, called with the well 
+#index and the fetched sources. 'cumulative_deferment' is derived from the well index (see local_priority_sources())
+#rather than pulled, and sharded runs add the fleet's 'deferment_cuts' to every shard's sources.
+PRIORITY_SOURCES={'gas_deferment_priorities': {'inputs': [], 'output': 'Deferment',
+                      'pandas': lambda wells, sources: gas_deferment_priorities(None, wells, sources.get('deferment_cuts')),
+                      'arrow': lambda wells, sources: arrow_gas_deferment_priorities(None, wells)},
+                  'work_management_priorities': {'inputs': ['work_management'], 'output': 'Enbase Work Management',
+                      'pandas': work_management_priorities,
+                      'arrow': arrow_work_management_priorities},
+                  'flood_priorities': {'inputs': ['flood_data'], 'output': 'Flood Alert',
+                      'pandas': lambda wells, sources: flood_priorities(SITE_MANAGER, wells, sources),
+                      'arrow': lambda wells, sources: arrow_flood_priorities(SITE_MANAGER, wells, sources)},
+                  'cumulative_deferment_priorities': {'inputs': ['cumulative_deferment'], 'output': 'Cumulative Deferment',
+                      'pandas': cumulative_deferment_priorities,
+                      'arrow': arrow_cumulative_deferment_priorities},
+                  'site_inspection_priorities': {'inputs': ['site_inspections'], 'output': 'Site Inspection',
+                      'pandas': site_inspection_priorities,
+                      'arrow': arrow_site_inspection_priorities},
+                  'RTU_comms_priorities': {'inputs': ['battery_voltages', 'percent_successful_comms'], 'output': 'Automation-RTU Issue',
+                      'pandas': RTU_comms_priorities,
+                      'arrow': arrow_RTU_comms_priorities}}
+#SOHA_PRIORITY_SOURCES is a comma separated list of the priority sources to run (all of them by default), and 
+#SOHA_PRIORITY_WORKERS how many of them run at once on a thread pool.
+ENABLED_PRIORITY_SOURCES=[name for name in os.environ.get('SOHA_PRIORITY_SOURCES', ','.join(PRIORITY_SOURCES)).split(',') if name]
+PRIORITY_SOURCE_WORKERS=int(os.environ.get('SOHA_PRIORITY_WORKERS', 1))
+
+def enabled_priority_sources(names=None):
+    """
+    The priority sources to run (ENABLED_PRIORITY_SOURCES by default), in the order they're combined. An unknown 
+    name raises a ValueError, so a typo in the configuration can't silently drop a priority type.
+    """
+    names=ENABLED_PRIORITY_SOURCES if names is None else names
+    unknown=[name for name in names if name not in PRIORITY_SOURCES]
+    if unknown:
+        raise ValueError('Unknown priority sources: '+', '.join(unknown))
+    return [name for name in PRIORITY_SOURCES if name in names]
+
+def priority_run_sources(names):
+    """
+    The sources to fetch for a run of the named priority sources: the well index's, and the inputs of each.
+    """
+    inputs={source for name in names for source in PRIORITY_SOURCES[name]['inputs']}
+    return [name for name in PRIORITY_RUN_SOURCES if name in WELL_INDEX_SOURCES or name in inputs]
+
+def local_priority_sources(well_metadata, names):
+    """
+    Sources derived from the well index rather than pulled, for the named priority sources that read them. The local
+    deferment state is rolled forward with today's production, in place of the cumulative deferment query.
+    """
+    if not any('cumulative_deferment' in PRIORITY_SOURCES[name]['inputs'] for name in names):
+        return {}
+    wells=well_metadata.project(DEFERMENT_STATE_INPUTS)
+    if pa is not None and isinstance(wells, pa.Table):
+        wells=wells.to_pandas()
+    return {'cumulative_deferment': refresh_deferment_state(wells)}
+
+def run_priority_sources(well_metadata, sources, names=None, mode='pandas', max_workers=None):
+    """
+    Run the named priority sources (the enabled ones by default) over the well index, each as its own telemetry 
+    stage with its runtime and rows, on up to PRIORITY_SOURCE_WORKERS threads. Returns each source's frame, or table 
+    in the arrow mode, in combine order, with None where it failed.
+    """
+    names=enabled_priority_sources(names)
+    run=lambda name: run_priority_generator(name, PRIORITY_SOURCES[name][mode], well_metadata, sources, 
+                                            rows_in=len(well_metadata), output=PRIORITY_SOURCES[name]['output'])
+    workers=min(max_workers or PRIORITY_SOURCE_WORKERS, max(len(names), 1))
+    if workers<=1:
+        return {name: run(name) for name in names}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(names, executor.map(run, names)))
+
+def combine_priorities(frames):
+    """
+    Combine the priority sources' frames with a single concat, skipping the ones that failed.
+    """
+    frames=[df for df in frames if df is not None]
+    if not frames:
+        return format_priorities(pd.DataFrame())
+    return pd.concat(frames, ignore_index=True)
+
+def write_run_report(telemetry):
+    """
+    Write the run report as JSON, and in the Prometheus text format if PROMETHEUS_PATH is set.
+    """
+    telemetry.write_report(RUN_REPORT_PATH)
+    if PROMETHEUS_PATH:
+        with open(PROMETHEUS_PATH, 'w') as f:
+            f.write(telemetry.prometheus_text())
+
+def record_fetch(record, sources):
+    """
+    Fill in a fetch stage's telemetry: the sources that came back, and the error class of each that didn't.
+    """
+    record['rows_out']=sum(not isinstance(df, Exception) for df in sources.values())
+    record['failed_sources']={name: type(e).__name__ for name, e in sources.items() if isinstance(e, Exception)}
+
+def well_keys(well_metadata):
+    """
+    The API10s and Corp_IDs of the wells in a well index, for narrowing pulls to them.
+    """
+    wells=well_metadata.project(['API', 'Corp_ID'])
+    if pa is not None and isinstance(wells, pa.Table):
+        wells=wells.to_pandas()
+    return {key: wells[key].dropna().unique().tolist() for key in ['API', 'Corp_ID']}
+
+def fetch_run_sources(pull_wells, source_names=None):
+    """
+    Fetch a run's sources (PRIORITY_RUN_SOURCES by default), and build its well index from them with pull_wells. 
+    Sources with a well key (see SOURCE_PUSHDOWN) that are pushed down to the database are fetched in a second wave 
+    once the well index is built, so they only return rows for its wells. Their deadlines count from the start of 
+    that wave. Sources that will be pulled whole are narrowed by the joins anyway, so they go in the first wave. 
+    Returns the sources and the well index.
+    """
+    source_names=PRIORITY_RUN_SOURCES if source_names is None else source_names
+    keyed=[name for name in source_names if 'well_key' in SOURCE_PUSHDOWN.get(name, {}) and pushdown_engine(name) is not None]
+    #Start every independent SQL pull at once, so the run waits on the slowest source instead of the sum of all of them
+    with telemetry_stage('fetch', rows_in=len(source_names)-len(keyed)) as record:
+        sources=fetch_sql_sources([name for name in source_names if name not in keyed])
+        record_fetch(record, sources)
+    #Pull the well metadata that will used as a basis for priorities. Every priority type needs it, so a failure here fails the run.
+    with telemetry_stage('well_metadata') as record:
+        well_metadata=pull_wells(sources)
+        record['rows_out']=len(well_metadata)
+    if keyed:
+        with telemetry_stage('fetch:keyed', rows_in=len(keyed)) as record:
+            keyed_sources=fetch_sql_sources(keyed, keys=well_keys(well_metadata))
+            record_fetch(record, keyed_sources)
+        sources.update(keyed_sources)
+    return sources, well_metadata
+
+def run_priorities():
+    """
+    Find priorities and write them to a SQL table, recording each stage on the current run's telemetry.
+    """
+    names=enabled_priority_sources()
+    sources, well_metadata=fetch_run_sources(pull_well_specific_data, priority_run_sources(names))
+    sources.update(local_priority_sources(well_metadata, names))
+    #Run every enabled priority source, and combine whatever came back in one go
+    priorities=run_priority_sources(well_metadata, sources, names)
+    with telemetry_stage('combine') as record:
+        priority_df=combine_priorities(priorities.values())
+        record['rows_out']=len(priority_df)
+    #Classify, format and push the priorities
+    publish_priorities(priority_df)
+
+#Declared column types of the combined priorities (see SOURCE_SCHEMAS). Combining generators whose categoricals have
+#different categories falls back to text, so these are applied again once they're combined.
+PRIORITY_SCHEMA={'Area': 'category', 'Route': 'category', 'Priority': 'category', 'Assigned_To': 'category',
+                 'chokeStatusCreatedBy': 'category', 'chokeStatusType': 'category', 'chokeStatusAction': 'category'}
+
+def publish_priorities(priority_df):
+    """
+    Classify the combined priorities into groups, format them and push them to both priority tables.
+    """
+    priority_df=apply_schema(priority_df, PRIORITY_SCHEMA)
+    #Write the priorities to a table
+    with telemetry_stage('classify', rows_in=len(priority_df)) as record:
+        priority_df=classify_priority_types_to_groups(priority_df)
+        record['rows_out']=len(priority_df)
+    #Drop T&A candidates, render descriptions and rename the columns for SQL insertion
+    with telemetry_stage('format:SoHa.Priorities_Test', rows_in=len(priority_df)) as record:
+        priority_df=format_priorities_test_table(priority_df)
+        record['rows_out']=len(priority_df)
+    #Insert into ArrowAppTest table, under SoHa.Priorities_Test
+    push_priorities(priority_df, table='Priorities_Test', schema='SoHa', key_columns=['Corp_ID', 'Priority'])
+    #Insert formatted priorities into the VRP_Details.SoHa_Priorities table
+    with telemetry_stage('format:VRP_Details.SoHa_Priorities', rows_in=len(priority_df)) as record:
+        priority_df=format_vrp_priorities(priority_df)
+        record['rows_out']=len(priority_df)
+    push_priorities(priority_df, table='SoHa_Priorities', schema='VRP_Details', key_columns=['LocationID', 'PriorityType'])
+
+#Sharded execution. When SOHA_SHARD_COLUMN is set ('Area' or 'Route'), the well metadata is partitioned on it and the 
+#priority generators run per shard on a process pool, each shard getting only its own wells' rows of every source. 
+#The shard outputs are merged before classification and the push. SOHA_SHARD_WORKERS caps the number of processes.
+SHARD_COLUMN=os.environ.get('SOHA_SHARD_COLUMN')
+SHARD_WORKERS=int(os.environ.get('SOHA_SHARD_WORKERS', os.cpu_count() or 1))
+#The column of each generator source that matches a well, and the well key it matches
+SHARD_SOURCE_KEYS={'flood_data': ('API', 'API'),
+                   'work_management': ('APINumber', 'API'),
+                   'site_inspections': ('APINumber', 'API'),
+                   'battery_voltages': ('Corp_ID', 'Corp_ID'),
+                   'percent_successful_comms': ('Corp_ID', 'Corp_ID'),
+                   'cumulative_deferment': ('CorpID', 'Corp_ID')}
+
+def shard_priority_inputs(well_metadata, sources, column):
+    """
+    Partition the well metadata on column, and each generator source down to the rows matching a shard's wells.
+    Returns a list of (shard value, well frame, sources). Failed sources are passed on to every shard as they are.
+    """
+    frame=well_metadata.project()
+    shards=[]
+    for value, wells in frame.groupby(column, dropna=False, sort=True, observed=True):
+        keys={'API': set(wells['API']), 'Corp_ID': set(wells['Corp_ID'])}
+        shard_sources={}
+        for name, (left_on, key) in SHARD_SOURCE_KEYS.items():
+            if name not in sources or isinstance(sources[name], Exception):
+                if name in sources:
+                    shard_sources[name]=sources[name]
+                continue
+            df=sources[name]
+            values=df[left_on].astype(str).str[:10] if key=='API' else df[left_on]
+            shard_sources[name]=df[values.isin(keys[key]).to_numpy()]
+        shards.append((None if pd.isna(value) else value, wells, shard_sources))
+    return shards
+
+def dispose_inherited_engines():
+    """
+    Shard worker initializer. A forked worker inherits the parent's engines with their pooled connections, so it 
+    drops them without closing them (the sockets are still the parent's), and any connection it needs is its own.
+    """
+    for engine in list(SOURCE_ENGINES.values())+[engine for engine in [PUBLISH_ENGINE] if engine is not None]:
+        engine.dispose(close=False)
+
+def run_priority_shard(wells, sources, cuts, names):
+    """
+    Run the named priority sources over one shard, in a worker process. Returns the priorities of each source 
+    (None where it failed) and the shard's telemetry stages.
+    """
+    global CURRENT_TELEMETRY
+    telemetry=RunTelemetry()
+    CURRENT_TELEMETRY=telemetry
+    try:
+        priorities=run_priority_sources(WellIndex(wells), {**sources, 'deferment_cuts': cuts}, names)
+    finally:
+        CURRENT_TELEMETRY=None
+    return priorities, telemetry.report()['stages']
+
+def run_sharded_priorities(column=None, max_workers=None):
+    """
+    run_priorities(), with the priority generators run per shard of the fleet across a process pool. Deferment is
+    banded with the whole fleet's quantile cuts (or each Area's or Route's, see DEFERMENT_RANKING), so the result 
+    doesn't depend on how the fleet is sharded.
+    """
+    column=column or SHARD_COLUMN
+    names=enabled_priority_sources()
+    sources, well_metadata=fetch_run_sources(pull_well_specific_data, priority_run_sources(names))
+    sources.update(local_priority_sources(well_metadata, names))
+    #Complete the RTU readings here, so the shard workers don't go to the database
+    if 'RTU_comms_priorities' in names:
+        complete_rtu_sources(sources)
+    #The fleet-wide deferment quantile cuts every shard bands its wells with
+    frame=well_metadata.project(['Area', 'Route', 'Gas_Production', 'CleanAvgGas', 'CleanAvgLowerBoundGas'])
+    deferring=frame[frame.Gas_Production<frame.CleanAvgLowerBoundGas]
+    cuts=deferment_quantile_cuts(deferring.assign(Deferment=deferring['CleanAvgGas']-deferring['Gas_Production']))
+    with telemetry_stage('shard:'+column, rows_in=len(well_metadata)) as record:
+        shards=shard_priority_inputs(well_metadata, sources, column)
+        record['rows_out']=len(shards)
+    priorities={name: [] for name in names}
+    with ProcessPoolExecutor(max_workers=min(max_workers or SHARD_WORKERS, max(len(shards), 1)), 
+                             initializer=dispose_inherited_engines) as executor:
+        futures=[(value, executor.submit(run_priority_shard, wells, shard_sources, cuts, names)) 
+                 for value, wells, shard_sources in shards]
+        for value, future in futures:
+            shard_priorities, stages=future.result()
+            for stage in stages:
+                stage['stage']='shard[%s]:%s' % (value, stage['stage'])
+            if CURRENT_TELEMETRY is not None:
+                with CURRENT_TELEMETRY.lock:
+                    CURRENT_TELEMETRY.stages+=stages
+            for name, df in shard_priorities.items():
+                if df is not None:
+                    priorities[name].append(df)
+    #Merge the shards' priorities, in the same order as an unsharded run
+    with telemetry_stage('merge:shards') as record:
+        priority_df=combine_priorities(df for name in names for df in priorities[name])
+        record['rows_out']=len(priority_df)
+    publish_priorities(priority_df)
+
+#Service mode settings (python soha_priorities.py --serve). Each source is refreshed on its own interval, and the 
+#priority types built from a source are dropped once it's older than its staleness limit. Values are in seconds, 
+#and can be overridden from a JSON config file (--config) with the keys refresh_intervals, staleness_limits and
+#poll_interval. The config's priority_sources key lists the priority sources to run, in place of SOHA_PRIORITY_SOURCES.
+SERVICE_REFRESH_INTERVALS={'well_metadata': 24*3600,
+                           'well_codes': 15*60,
+                           'yday_gas_production': 24*3600,
+                           'clean_average': 24*3600,
+                           'flood_data': 3600,
+                           'work_management': 15*60,
+                           'site_inspections': 3600,
+                           'battery_voltages': 5*60,
+                           'percent_successful_comms': 5*60}
+SERVICE_STALENESS_LIMITS={name: 3*interval for name, interval in SERVICE_REFRESH_INTERVALS.items()}
+SERVICE_POLL_INTERVAL=30
+
+class PriorityService:
+    """
+    Keeps the sources, the well index and the current priorities warm in memory between runs. Every cycle it 
+    refreshes the sources that are due, rebuilds only what depends on a source whose data actually changed, and 
+    publishes when the priorities changed.
+    """
+    
+    def __init__(self, refresh_intervals=SERVICE_REFRESH_INTERVALS, staleness_limits=SERVICE_STALENESS_LIMITS, 
+                 poll_interval=SERVICE_POLL_INTERVAL, priority_sources=None):
+        self.names=enabled_priority_sources(priority_sources)
+        #Only the sources the enabled priority sources need are refreshed
+        needed=priority_run_sources(self.names)
+        self.refresh_intervals={name: interval for name, interval in refresh_intervals.items() if name in needed}
+        self.staleness_limits=dict(staleness_limits)
+        self.poll_interval=poll_interval
+        #Latest frame, fetch time, and a version that only moves when the data changes, per source
+        self.sources={}
+        self.fetched_at={}
+        self.versions={}
+        self.hashes={}
+        self.well_index=None
+        self.well_index_versions=None
+        #Sources derived from the well index, rebuilt along with it
+        self.local_sources={}
+        #Latest frame per priority source, and the input versions it was built from
+        self.priorities={}
+        self.priority_versions={}
+        #Versions of the priority sources in the last successful publish
+        self.published_versions={}
+    
+    def due_sources(self, now):
+        """
+        Sources that have never been fetched, or whose refresh interval has passed.
+        """
+        return [name for name, interval in self.refresh_intervals.items() 
+                if name not in self.fetched_at or now-self.fetched_at[name]>=interval]
+    
+    def refresh_sources(self, now):
+        """
+        Fetch every due source concurrently, always from the database (the snapshot cache's TTLs would serve the 
+        service data older than its refresh intervals). A source's version only moves if its data changed. A failed 
+        refresh keeps the previous frame, which then ages towards its staleness limit.
+        """
+        due=self.due_sources(now)
+        if not due:
+            return []
+        changed=[]
+        for name, df in fetch_sql_sources(due, mode='live').items():
+            if isinstance(df, Exception):
+                continue
+            #Staleness counts from when the data was pulled, not from the start of the cycle
+            self.fetched_at[name]=df.attrs.get('pulled_at', now)
+            data_hash=int(pd.util.hash_pandas_object(df, index=False).sum())
+            if self.hashes.get(name)!=data_hash:
+                self.sources[name]=df
+                self.hashes[name]=data_hash
+                self.versions[name]=self.versions.get(name, 0)+1
+                changed.append(name)
+        return changed
+    
+    def fresh_sources(self, now):
+        """
+        Shallow copies of the sources that are within their staleness limit. Generators add columns to the 
+        frames they're given, so the warm frames themselves are never handed out.
+        """
+        return {name: df.copy(deep=False) for name, df in self.sources.items() 
+                if now-self.fetched_at[name]<=self.staleness_limits.get(name, float('inf'))}
+    
+    def recompute(self, now):
+        """
+        Rebuild the well index if its sources changed, and rerun each priority source whose inputs changed. A
+        priority source with a stale or missing input has its priorities dropped. Returns True if any priorities changed.
+        """
+        sources=self.fresh_sources(now)
+        if any(name not in sources for name in WELL_INDEX_SOURCES):
+            changed=bool(self.priorities)
+            self.well_index, self.well_index_versions, self.priorities, self.priority_versions=None, None, {}, {}
+            return changed
+        well_index_versions=tuple(self.versions[name] for name in WELL_INDEX_SOURCES)
+        if well_index_versions!=self.well_index_versions:
+            with telemetry_stage('well_metadata') as record:
+                self.well_index=pull_well_specific_data(sources)
+                record['rows_out']=len(self.well_index)
+            self.local_sources=local_priority_sources(self.well_index, self.names)
+            self.well_index_versions=well_index_versions
+        #Local sources only move with the well index, which every version below already includes
+        sources.update({name: df.copy(deep=False) for name, df in self.local_sources.items()})
+        changed=False
+        for name in self.names:
+            inputs=PRIORITY_SOURCES[name]['inputs']
+            if any(source not in sources for source in inputs):
+                changed=changed or name in self.priorities
+                self.priorities.pop(name, None)
+                self.priority_versions.pop(name, None)
+                continue
+            versions=(well_index_versions,)+tuple(self.versions.get(source) for source in inputs)
+            if self.priority_versions.get(name)==versions:
+                continue
+            df=run_priority_generator(name, PRIORITY_SOURCES[name]['pandas'], self.well_index, sources, 
+                                      rows_in=len(self.well_index), output=PRIORITY_SOURCES[name]['output'])
+            self.priority_versions[name]=versions
+            if df is None:
+                changed=changed or name in self.priorities
+                self.priorities.pop(name, None)
+            else:
+                self.priorities[name]=df
+                changed=True
+        return changed
+    
+    def run_cycle(self, now=None):
+        """
+        One refresh, recompute and publish cycle, recorded as its own run report. Publishes whenever the priorities 
+        differ from the last successful publish, so a failed publish is retried on the next cycle, and priorities that
+        all drop out are published as an empty table. Returns True if it published.
+        """
+        global CURRENT_TELEMETRY
+        now=time.time() if now is None else now
+        telemetry=RunTelemetry()
+        CURRENT_TELEMETRY=telemetry
+        try:
+            with telemetry_stage('fetch', rows_in=len(self.due_sources(now))) as record:
+                record['changed_sources']=self.refresh_sources(now)
+                record['rows_out']=len(record['changed_sources'])
+            self.recompute(now)
+            versions={name: self.priority_versions[name] for name in self.priorities}
+            if versions==self.published_versions:
+                return False
+            publish_priorities(combine_priorities(self.priorities[name] for name in self.names if name in self.priorities))
+            self.published_versions=versions
+            return True
+        finally:
+            CURRENT_TELEMETRY=None
+            write_run_report(telemetry)
+    
+    def seconds_until_due(self, now):
+        """
+        Time until the next source is due, capped at the poll interval.
+        """
+        waits=[self.fetched_at[name]+interval-now for name, interval in self.refresh_intervals.items() if name in self.fetched_at]
+        return max(0, min(waits+[self.poll_interval]))
+    
+    def run_forever(self, max_cycles=None):
+        """
+        Run cycles until interrupted (or for max_cycles). A failed cycle is logged and recorded in its run report, 
+        and the service carries on with its warm state.
+        """
+        cycles=0
+        while max_cycles is None or cycles<max_cycles:
+            try:
+                self.run_cycle()
+            except Exception:
+                LOGGER.exception('Priority service cycle failed, retrying with the warm state')
+            cycles+=1
+            if max_cycles is None or cycles<max_cycles:
+                time.sleep(self.seconds_until_due(time.time()))
+
+def load_service_config(path):
+    """
+    Build a PriorityService from a JSON config file, overriding the default refresh intervals, staleness limits, 
+    poll interval and priority sources with whatever the file sets.
+    """
+    with open(path) as f:
+        config=json.load(f)
+    return PriorityService(refresh_intervals={**SERVICE_REFRESH_INTERVALS, **config.get('refresh_intervals', {})},
+                           staleness_limits={**SERVICE_STALENESS_LIMITS, **config.get('staleness_limits', {})},
+                           poll_interval=config.get('poll_interval', SERVICE_POLL_INTERVAL),
+                           priority_sources=config.get('priority_sources'))
+
+def main():
+    """
+    Find priorities and write them to a SQL table, then write the run report (see RUN_REPORT_PATH), whether the 
+    run succeeded or not.
+    """
+    global CURRENT_TELEMETRY
+    telemetry=RunTelemetry()
+    CURRENT_TELEMETRY=telemetry
+    try:
+        if EXECUTION_MODE=='arrow':
+            run_arrow_priorities()
+        elif SHARD_COLUMN:
+            run_sharded_priorities()
+        else:
+            run_priorities()
+    finally:
+        CURRENT_TELEMETRY=None
+        write_run_report(telemetry)
 
-#Execute the main script and run the priorities
-main()
+#Execute the main script and run the priorities, once or as a long running service
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Find SoHa priorities and write them to SQL.')
+    parser.add_argument('--serve', action='store_true', help='keep running, refreshing each source on its own interval')
+    parser.add_argument('--config', help='JSON file with refresh_intervals, staleness_limits and poll_interval for --serve')
+    parser.add_argument('--backfill-deferment', metavar='HISTORY', help='parquet or csv of daily production (Corp_ID, '
+                        'Production_Date, Gas_Production, CleanAvgGas, CleanAvgLowerBoundGas) to build the deferment state from')
+    args=parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if args.backfill_deferment:
+        history=pd.read_csv(args.backfill_deferment) if args.backfill_deferment.endswith('.csv') else pd.read_parquet(args.backfill_deferment)
+        write_snapshot(backfill_deferment_state(history), DEFERMENT_STATE_PATH)
+    elif args.serve:
+        service=load_service_config(args.config) if args.config else PriorityService()
+        service.run_forever()
+    else:
+        main()
     
     
@@ -0,0 +1,85 @@
+"""
+Shared fixtures. Every test runs against the in-process sql_helpers stand-in (benchmarks/stand_in), with snapshots,
+the deferment state and the run report written under its own temporary directory.
+"""
+import os
+import sys
+import pandas as pd
+import pytest
+
+TEST_DIR=os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIR=os.path.dirname(TEST_DIR)
+sys.path.insert(0, os.path.join(REPOSITORY_DIR, 'benchmarks', 'stand_in'))
+sys.path.insert(0, os.path.join(REPOSITORY_DIR, 'benchmarks'))
+sys.path.insert(0, REPOSITORY_DIR)
+import sql_helpers
+import soha_priorities
+from synthetic_fleet import build_fleet
+
+@pytest.fixture(autouse=True)
+def isolated_run(tmp_path, monkeypatch):
+    """
+    Point every path the module writes to at a temporary directory, and reset the module's run state.
+    """
+    monkeypatch.setattr(soha_priorities, 'SNAPSHOT_DIR', str(tmp_path/'snapshots'))
+    monkeypatch.setattr(soha_priorities, 'SNAPSHOT_MODE', 'live')
+    monkeypatch.setattr(soha_priorities, 'DEFERMENT_STATE_PATH', str(tmp_path/'state'/'deferment_state.parquet'))
+    monkeypatch.setattr(soha_priorities, 'RUN_REPORT_PATH', str(tmp_path/'run_report.json'))
+    monkeypatch.setattr(soha_priorities, 'PROMETHEUS_PATH', None)
+    monkeypatch.setattr(soha_priorities, 'PROFILE_STAGES', [])
+    monkeypatch.setattr(soha_priorities, 'SQL_QUERY_DIR', str(tmp_path/'sql'))
+    monkeypatch.setattr(soha_priorities, 'CURRENT_TELEMETRY', None)
+    monkeypatch.setattr(soha_priorities, 'PUBLISH_ENGINE', None)
+    #The stand-in has no publish engine, so pushes through it replace whatever SOHA_PUBLISH_MODE says
+    monkeypatch.setattr(soha_priorities, 'PUBLISH_MODE', 'replace')
+    monkeypatch.setattr(soha_priorities, 'SOURCE_ENGINES', {})
+    monkeypatch.setattr(sql_helpers, 'LATENCY', {})
+    sql_helpers.load_fleet({})
+    yield tmp_path
+
+@pytest.fixture
+def fleet():
+    """
+    A small synthetic fleet loaded into the stand-in. Returns the query file to frame dictionary it serves.
+    """
+    frames=build_fleet(3000, seed=0)
+    sql_helpers.load_fleet(frames)
+    return frames
+
+@pytest.fixture
+def deferment_state(fleet):
+    """
+    Five deferring days of the fleet, backfilled up to its production day and stored where runs read the state, so 
+    a run continues streaks long and deep enough for cumulative deferment priorities. Returns the state.
+    """
+    clean_average=fleet['clean_average.sql']
+    production_date=pd.Timestamp(fleet['yday_production_soha.sql']['production_date_utc'].iloc[0])
+    history=pd.concat([clean_average.assign(Production_Date=production_date-pd.Timedelta(days=days),
+                                            Gas_Production=clean_average['CleanAvgGas']*.5) for days in range(5, 0, -1)],
+                      ignore_index=True)
+    state=soha_priorities.backfill_deferment_state(history, soha_priorities.read_deferment_state())
+    soha_priorities.write_snapshot(state, soha_priorities.DEFERMENT_STATE_PATH)
+    return state
+
+@pytest.fixture
+def published():
+    """
+    Run a pipeline (run_priorities(), run_arrow_priorities(), ...) and return the frame it published to
+    SoHa_Priorities, without CalcDate and in a fixed order, so runs can be compared.
+    """
+    def published(run):
+        sql_helpers.PUSHES.clear()
+        run()
+        df,=[df for schema, table, df in sql_helpers.PUSHES if table=='SoHa_Priorities']
+        df=df.drop(columns=['CalcDate']).astype(str)
+        return df.sort_values(list(df.columns)).reset_index(drop=True)
+    return published
+
+@pytest.fixture
+def telemetry(monkeypatch):
+    """
+    Telemetry for the test's run, so stages are recorded.
+    """
+    telemetry=soha_priorities.RunTelemetry(profile_stages=[])
+    monkeypatch.setattr(soha_priorities, 'CURRENT_TELEMETRY', telemetry)
+    return telemetry
@@ -0,0 +1,39 @@
+"""
+The arrow execution mode (run_arrow_priorities(), ArrowWellIndex) against the pandas one.
+"""
+import pandas as pd
+import pytest
+import soha_priorities
+
+pa=pytest.importorskip('pyarrow')
+
+def test_arrow_run_publishes_what_the_pandas_run_does(fleet, deferment_state, published, monkeypatch):
+    pandas=published(soha_priorities.run_priorities)
+    #Each run updates the deferment state, so start the arrow run from the same one
+    monkeypatch.setattr(soha_priorities, 'DEFERMENT_STATE_PATH', soha_priorities.DEFERMENT_STATE_PATH+'.arrow')
+    soha_priorities.write_snapshot(deferment_state, soha_priorities.DEFERMENT_STATE_PATH)
+    arrow=published(soha_priorities.run_arrow_priorities)
+    assert 'Cumulative Deferment' in set(pandas['PriorityType'])
+    pd.testing.assert_frame_equal(arrow, pandas)
+
+def wells():
+    return pd.DataFrame({'API': ['4200000001', '4200000002', '4200000003'],
+                         'Corp_ID': ['SOHA0000001', 'SOHA0000002', 'SOHA0000003'],
+                         'WellName': ['A 1', 'B 2', 'C 3'],
+                         'Area': ['North', 'North', 'South']})
+
+@pytest.mark.parametrize('key', ['API', 'Corp_ID'])
+@pytest.mark.parametrize('duplicated', [False, True])
+def test_arrow_index_attaches_what_the_pandas_index_does(key, duplicated):
+    metadata=wells()
+    if duplicated:
+        metadata=pd.concat([metadata, metadata.iloc[[0]].assign(WellName='A 1 ST')], ignore_index=True)
+    df=pd.DataFrame({'Corp_ID': ['SOHA0000003', 'SOHA0000001', 'SOHA0000009', 'SOHA0000003'],
+                     'API': ['4200000003', '4200000001', '4200000009', '4200000003'],
+                     'Priority_Level': [1., 2., 3., 4.]})
+    columns=['WellName', 'Area']
+    expected=soha_priorities.WellIndex(metadata).attach(df, key, key=key, columns=columns)
+    actual=soha_priorities.ArrowWellIndex(pa.Table.from_pandas(metadata)).attach(pa.Table.from_pandas(df), key, key=key,
+                                                                               columns=columns)
+    sort=lambda records: sorted(records, key=lambda record: tuple(map(str, record.values())))
+    assert sort(actual.to_pandas().to_dict('records'))==sort(expected.to_dict('records'))
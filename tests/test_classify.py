@@ -0,0 +1,52 @@
+"""
+Grouper classification (classify_priority_types_to_groups()) against the chained .loc assignments it replaced.
+"""
+import itertools
+import numpy as np
+import pandas as pd
+import soha_priorities
+
+def baseline_classify(priority_df):
+    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Engineering")), 'Grouper'] = 'Engineering'
+    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Operations")), 'Grouper'] = 'Operations'
+    priority_df.loc[(priority_df.chokeStatusAction.str.contains("No Action")), 'Grouper'] = 'Operations'
+    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Maintenance")), 'Grouper'] = 'Operations'
+    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Natural Decline")), 'Grouper'] = 'Operations'
+    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Midstream")), 'Grouper'] = 'Operations'
+    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Work Complete")), 'Grouper'] = 'Operations'
+    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Optimization")), 'Grouper'] = 'Operations'
+    priority_df.loc[(priority_df.chokeStatusAction.str.contains("Construction")), 'Grouper'] = 'Construction'
+    priority_df.loc[(priority_df.Priority=='Automation'), 'Grouper'] = 'Automation'
+    priority_df.loc[priority_df.Priority=='Flood Alert', 'Grouper'] = 'Site Manager'
+    priority_df.loc[priority_df.Priority=='Site Inspection', 'Grouper'] = 'Operations'
+    return priority_df
+
+ACTIONS=['Engineering - Review', 'Operations - Ready', 'No Action', 'Maintenance - Pump', 'Natural Decline',
+         'Midstream - Curtailed', 'Work Complete', 'Waiting on Optimization', 'Waiting on Construction',
+         'Engineering - Waiting on Construction', 'Operations - Optimization', 'TA - P&A Candidate', 'Uncoded']
+PRIORITIES=['Deferment', 'Flood Alert', 'Site Inspection', 'Automation', 'Automation-RTU Issue', 'Cumulative Deferment']
+
+def groups(series):
+    return [None if pd.isna(group) else group for group in series]
+
+def test_groups_match_the_chained_assignments():
+    df=pd.DataFrame(list(itertools.product(ACTIONS, PRIORITIES)), columns=['chokeStatusAction', 'Priority'])
+    expected=baseline_classify(df.copy())
+    actual=soha_priorities.classify_priority_types_to_groups(df.copy())
+    assert groups(actual['Grouper'])==groups(expected['Grouper'])
+
+def test_grouper_is_categorical_over_every_group():
+    df=pd.DataFrame({'chokeStatusAction': ['Uncoded', 'No Action'], 'Priority': ['Deferment', 'Deferment']})
+    grouper=soha_priorities.classify_priority_types_to_groups(df)['Grouper']
+    assert isinstance(grouper.dtype, pd.CategoricalDtype)
+    assert list(grouper.cat.categories)==soha_priorities.GROUPER_GROUPS
+    assert groups(grouper)==[None, 'Operations']
+
+def test_null_codings_fall_back_to_the_priority_rules():
+    df=pd.DataFrame({'chokeStatusAction': [None, np.nan], 'Priority': ['Flood Alert', 'Deferment']})
+    assert groups(soha_priorities.classify_priority_types_to_groups(df)['Grouper'])==['Site Manager', None]
+
+def test_later_rules_in_the_baseline_come_first_in_the_table():
+    assert soha_priorities.group_for_action('Engineering - Waiting on Construction')=='Construction'
+    assert soha_priorities.group_for_action('Operations - Optimization')=='Operations'
+    assert soha_priorities.group_for_action('Uncoded') is None
@@ -0,0 +1,65 @@
+"""
+Deferment quantile bands from partitioned cuts (deferment_quantile_cuts(), deferment_quantiles()) against the rank()
+based quantiles they replaced.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import soha_priorities
+
+def baseline_levels(df):
+    df['DefermentRanking']=df['Deferment'].rank(ascending=0)
+    df['DefermentQuantile']=1-(df.shape[0]-df['DefermentRanking'])/df.shape[0]
+    df.loc[df['DefermentQuantile']<.25, 'Priority_Level'] = 2
+    df.loc[df['DefermentQuantile']>=.25, 'Priority_Level'] = 3
+    df.loc[df['DefermentQuantile']>=.50, 'Priority_Level'] = 4
+    df.loc[df['DefermentQuantile']>=.75, 'Priority_Level'] = 5
+    return df['Priority_Level'].to_numpy(dtype='float64')
+
+def levels(df, ranking='global'):
+    cuts=soha_priorities.deferment_quantile_cuts(df, ranking)
+    df=df.assign(DefermentQuantile=soha_priorities.deferment_quantiles(df, cuts, ranking))
+    return soha_priorities.apply_priority_rules(df, 'Deferment')['Priority_Level'].to_numpy(dtype='float64')
+
+def deferments(wells, rng, distinct):
+    #Few distinct values make long runs of ties straddling the edges
+    return rng.integers(0, distinct, wells).astype('float64') if distinct else rng.gamma(2, 300, wells)
+
+@pytest.mark.parametrize('wells', [1, 2, 3, 4, 5, 7, 8, 12, 100, 1001])
+@pytest.mark.parametrize('distinct', [None, 2, 5])
+def test_levels_match_the_rank_based_quantiles(wells, distinct):
+    df=pd.DataFrame({'Deferment': deferments(wells, np.random.default_rng(wells), distinct)})
+    np.testing.assert_array_equal(levels(df), baseline_levels(df.copy()))
+
+@pytest.mark.parametrize('ranking, column', [('area', 'Area'), ('route', 'Route')])
+def test_grouped_levels_match_ranking_within_each_group(ranking, column):
+    rng=np.random.default_rng(0)
+    df=pd.DataFrame({'Deferment': deferments(500, rng, 20), 'Area': rng.choice(['North', 'South', None], 500),
+                     'Route': rng.choice(['Route %d' % route for route in range(9)], 500)})
+    expected=np.full(len(df), np.nan)
+    for group, rows in df.groupby(column, dropna=False).indices.items():
+        expected[rows]=baseline_levels(df.iloc[rows].copy())
+    np.testing.assert_array_equal(levels(df, ranking), expected)
+
+@pytest.mark.parametrize('ranking, column', [('global', None), ('area', 'Area'), ('route', 'Route')])
+def test_wells_without_a_deferment_count_towards_their_group(ranking, column):
+    #rank() leaves them unranked, but they're in the shape[0] the ranks are divided by
+    rng=np.random.default_rng(2)
+    df=pd.DataFrame({'Deferment': np.where(rng.random(600)<.2, np.nan, deferments(600, rng, 30)),
+                     'Area': rng.choice(['North', 'South'], 600), 'Route': rng.choice(['Route 1', 'Route 2', 'Route 3'], 600)})
+    groups=[np.arange(len(df))] if column is None else list(df.groupby(column).indices.values())
+    expected=np.full(len(df), np.nan)
+    for rows in groups:
+        expected[rows]=baseline_levels(df.iloc[rows].copy())
+    np.testing.assert_array_equal(levels(df, ranking), expected)
+
+def test_a_shard_banded_with_the_fleets_cuts_matches_the_fleet():
+    df=pd.DataFrame({'Deferment': deferments(400, np.random.default_rng(1), None)})
+    cuts=soha_priorities.deferment_quantile_cuts(df, 'global')
+    shard=df.iloc[::3]
+    quantiles=soha_priorities.deferment_quantiles(shard, cuts, 'global')
+    np.testing.assert_array_equal(quantiles, soha_priorities.deferment_quantiles(df, cuts, 'global')[::3])
+
+def test_unknown_ranking_is_rejected():
+    with pytest.raises(ValueError, match='Unknown deferment ranking'):
+        soha_priorities.deferment_quantile_cuts(pd.DataFrame({'Deferment': [1.]}), 'facility')
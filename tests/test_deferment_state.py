@@ -0,0 +1,89 @@
+"""
+The rolling deferment state (update_deferment_state(), backfill_deferment_state(), refresh_deferment_state()) that
+replaced the cumulative_deferment query.
+"""
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import soha_priorities
+
+def day(date, gas, corp_ids=('SOHA0000001',), clean_average=100., lower_bound=80.):
+    return pd.DataFrame({'Corp_ID': list(corp_ids), 'Production_Date': pd.Timestamp(date), 'Gas_Production': gas,
+                         'CleanAvgGas': clean_average, 'CleanAvgLowerBoundGas': lower_bound})
+
+def streaks(history):
+    """
+    The streak of every well, recomputed from its whole history one day at a time.
+    """
+    rows=[]
+    for corp_id, days in history.sort_values('Production_Date').groupby('Corp_ID'):
+        last_date, cumulative, consecutive=None, 0., 0
+        for row in days.itertuples():
+            continues=last_date is not None and row.Production_Date-last_date==pd.Timedelta(days=1)
+            if row.Gas_Production<row.CleanAvgLowerBoundGas:
+                cumulative=(cumulative if continues else 0.)+row.CleanAvgGas-row.Gas_Production
+                consecutive=(consecutive if continues else 0)+1
+            else:
+                cumulative, consecutive=0., 0
+            last_date=row.Production_Date
+        rows.append((corp_id, last_date, cumulative, consecutive))
+    return pd.DataFrame(rows, columns=soha_priorities.DEFERMENT_STATE_COLUMNS)
+
+def sorted_state(state):
+    return state.sort_values('Corp_ID').reset_index(drop=True)
+
+def test_consecutive_deferring_days_build_a_streak():
+    state=soha_priorities.read_deferment_state()
+    for date, gas in [('2021-06-01', 50.), ('2021-06-02', 70.), ('2021-06-03', 60.)]:
+        state=soha_priorities.update_deferment_state(state, day(date, gas))
+    assert state[['CumulativeDeferment', 'ConsecutiveDaysDeferring']].values.tolist()==[[120., 3]]
+
+@pytest.mark.parametrize('days, expected', [([('2021-06-01', 50.), ('2021-06-02', 90.), ('2021-06-03', 60.)], [40., 1]),
+                                            ([('2021-06-01', 50.), ('2021-06-03', 60.)], [40., 1]),
+                                            ([('2021-06-01', 50.), ('2021-06-02', 90.)], [0., 0])])
+def test_a_day_off_or_a_gap_resets_the_streak(days, expected):
+    state=soha_priorities.read_deferment_state()
+    for date, gas in days:
+        state=soha_priorities.update_deferment_state(state, day(date, gas))
+    assert state[['CumulativeDeferment', 'ConsecutiveDaysDeferring']].values.tolist()==[expected]
+
+def test_applied_days_are_not_counted_twice():
+    state=soha_priorities.update_deferment_state(soha_priorities.read_deferment_state(), day('2021-06-02', 50.))
+    rerun=soha_priorities.update_deferment_state(state, day('2021-06-02 06:00', 50.))
+    earlier=soha_priorities.update_deferment_state(rerun, day('2021-06-01', 50.))
+    pd.testing.assert_frame_equal(sorted_state(earlier), sorted_state(state))
+
+def test_wells_missing_from_a_day_keep_their_state():
+    state=soha_priorities.update_deferment_state(soha_priorities.read_deferment_state(),
+                                                 day('2021-06-01', 50., corp_ids=['SOHA0000001', 'SOHA0000002']))
+    state=soha_priorities.update_deferment_state(state, day('2021-06-02', 50.))
+    assert sorted_state(state)['ConsecutiveDaysDeferring'].tolist()==[2, 1]
+
+def test_backfill_matches_the_day_by_day_streaks():
+    rng=np.random.default_rng(0)
+    dates=pd.date_range('2021-05-01', periods=30)
+    history=pd.DataFrame({'Corp_ID': np.repeat(['SOHA%07d' % well for well in range(50)], len(dates)),
+                          'Production_Date': np.tile(dates, 50),
+                          'Gas_Production': rng.uniform(0, 120, 50*len(dates)),
+                          'CleanAvgGas': 100., 'CleanAvgLowerBoundGas': 80.})
+    #Some wells don't report every day
+    history=history.sample(frac=.9, random_state=0)
+    state=soha_priorities.backfill_deferment_state(history, soha_priorities.read_deferment_state())
+    expected=streaks(history)
+    actual=sorted_state(state)
+    assert actual['Corp_ID'].tolist()==expected['Corp_ID'].tolist()
+    np.testing.assert_array_equal(actual['Production_Date'].to_numpy(), expected['Production_Date'].to_numpy())
+    np.testing.assert_allclose(actual['CumulativeDeferment'], expected['CumulativeDeferment'])
+    np.testing.assert_array_equal(actual['ConsecutiveDaysDeferring'], expected['ConsecutiveDaysDeferring'])
+
+def test_refresh_stores_the_state_and_serves_it_as_the_source():
+    soha_priorities.refresh_deferment_state(day('2021-06-01', 50., corp_ids=['SOHA0000001', 'SOHA0000002']))
+    source=soha_priorities.refresh_deferment_state(day('2021-06-02', 50.))
+    assert source.values.tolist()==[['SOHA0000001', 100., 2]]
+    assert len(soha_priorities.read_deferment_state())==2
+
+def test_replay_does_not_store_the_state(monkeypatch):
+    monkeypatch.setattr(soha_priorities, 'SNAPSHOT_MODE', 'replay')
+    soha_priorities.refresh_deferment_state(day('2021-06-01', 50.))
+    assert not os.path.exists(soha_priorities.DEFERMENT_STATE_PATH)
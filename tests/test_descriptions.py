@@ -0,0 +1,46 @@
+"""
+Description templates carried through the pipeline and rendered once (render_descriptions()). Frames go through
+format_priorities() first, as they do in the generators.
+"""
+import numpy as np
+import pandas as pd
+import soha_priorities
+
+def test_every_band_has_a_template_id():
+    for rules in soha_priorities.PRIORITY_RULES.values():
+        for template in soha_priorities.description_templates(rules):
+            assert template is None or template in soha_priorities.DESCRIPTION_TEMPLATES
+
+def test_descriptions_render_at_fixed_precision():
+    df=soha_priorities.apply_priority_rules(pd.DataFrame({'DefermentQuantile': [.1, .9]}), 'Deferment')
+    df['Gas_Production']=[1234.56, 0.04]
+    df['Deferment']=[100., np.nan]
+    df=soha_priorities.render_descriptions(soha_priorities.format_priorities(df))
+    assert df['Description'].tolist()==['Top 25% deferring wells: Yesterday well produced 1234.6 MCFE, and deferred 100.0 MCFE.',
+                                        'Bottom 25% wells deferring: Yesterday well produced 0.0 MCFE, and deferred nan MCFE.']
+
+def test_dates_render_with_strftime():
+    df=soha_priorities.apply_priority_rules(pd.DataFrame({'HoursUntilFlood': [30.]}), 'Flood Alert')
+    df['AffectedFloodHeight']=[2.5]
+    df['EarliestPredictedFloodDate']=[pd.Timestamp('2021-06-02 13:45:10')]
+    df=soha_priorities.render_descriptions(soha_priorities.format_priorities(df))
+    assert df['Description'].iloc[0]==('Well is predicted to flood between 1 to 2 days. Affected flood height of the site is 2.50 ft. '
+                                       'Next predicted flood date is 2021-06-02 13:45.')
+
+def test_rows_without_a_template_keep_their_description():
+    rtu=soha_priorities.apply_priority_rules(pd.DataFrame({'PercentSuccessfulComms': [40.], 'BatteryVoltage': [12.5]}),
+                                             'Automation-RTU Issue')
+    work=pd.DataFrame({'Priority': ['Work Management'], 'Description': ['Replace separator dump valve'],
+                       'Description_Template': [np.nan]})
+    df=soha_priorities.render_descriptions(pd.concat([soha_priorities.format_priorities(work), soha_priorities.format_priorities(rtu)],
+                                                      ignore_index=True))
+    assert df['Description'].tolist()==['Replace separator dump valve', 'RTU Comms Issue Detected: Percent successful comms in '
+                                        'the past hour is 40.0%, and current battery voltage is 12.50.']
+
+def test_template_and_field_columns_are_dropped():
+    df=soha_priorities.apply_priority_rules(pd.DataFrame({'DefermentQuantile': [.1]}), 'Deferment')
+    df['Gas_Production']=[10.]
+    df['Deferment']=[5.]
+    columns=soha_priorities.render_descriptions(soha_priorities.format_priorities(df)).columns
+    #Gas_Production is published, the rest were only there for the description
+    assert list(columns)==soha_priorities.PRIORITY_COLUMNS
@@ -0,0 +1,79 @@
+"""
+Concurrent SQL pulls with per-source deadlines (fetch_sql_sources()).
+"""
+import threading
+import time
+import types
+import pandas as pd
+import pytest
+import sql_helpers
+import soha_priorities
+
+def test_every_source_comes_back_as_a_frame(fleet):
+    sources=soha_priorities.fetch_sql_sources(soha_priorities.PRIORITY_RUN_SOURCES)
+    assert list(sources)==soha_priorities.PRIORITY_RUN_SOURCES
+    assert all(isinstance(df, pd.DataFrame) for df in sources.values())
+
+def test_pulls_overlap(fleet):
+    sql_helpers.LATENCY.update({query: .2 for query, server in soha_priorities.SQL_SOURCES.values()})
+    start=time.monotonic()
+    soha_priorities.fetch_sql_sources(soha_priorities.PRIORITY_RUN_SOURCES, max_workers=16, max_per_server=16)
+    #Nine 0.2s pulls one after another would take 1.8s
+    assert time.monotonic()-start<1
+
+def test_missed_deadline_only_fails_its_own_source(fleet):
+    sql_helpers.LATENCY['Flood_Priorities_Prediction.sql']=1
+    start=time.monotonic()
+    sources=soha_priorities.fetch_sql_sources(['flood_data', 'well_metadata'], deadlines={'flood_data': .1})
+    assert time.monotonic()-start<.8
+    assert isinstance(sources['flood_data'], TimeoutError)
+    assert isinstance(sources['well_metadata'], pd.DataFrame)
+
+def test_failed_pull_is_returned_as_its_exception(fleet, monkeypatch):
+    pull=sql_helpers._pull
+
+    def failing_pull(query):
+        if query=='site_inspections.sql':
+            raise ConnectionError('site inspections are down')
+        return pull(query)
+
+    monkeypatch.setattr(sql_helpers, '_pull', failing_pull)
+    sources=soha_priorities.fetch_sql_sources(['site_inspections', 'work_management'])
+    assert isinstance(sources['site_inspections'], ConnectionError)
+    assert isinstance(sources['work_management'], pd.DataFrame)
+
+def test_pulls_per_server_are_capped(fleet, monkeypatch):
+    pull=sql_helpers._pull
+    lock=threading.Lock()
+    running={'now': 0, 'most': 0}
+
+    def counting_pull(query):
+        with lock:
+            running['now']+=1
+            running['most']=max(running['most'], running['now'])
+        time.sleep(.05)
+        try:
+            return pull(query)
+        finally:
+            with lock:
+                running['now']-=1
+
+    monkeypatch.setattr(sql_helpers, '_pull', counting_pull)
+    #Every one of these is on EnterpriseDataHub
+    names=['well_metadata', 'yday_gas_production', 'battery_voltages', 'percent_successful_comms']
+    soha_priorities.fetch_sql_sources(names, max_workers=8, max_per_server=2)
+    assert running['most']==2
+
+@pytest.mark.parametrize('seconds, expected', [(2.5, 3), (0, 1)])
+def test_query_timeout_is_set_and_restored(seconds, expected):
+    dbapi_connection=types.SimpleNamespace(timeout=0)
+    connection=types.SimpleNamespace(connection=types.SimpleNamespace(dbapi_connection=dbapi_connection))
+    with soha_priorities.query_timeout(connection, seconds):
+        assert dbapi_connection.timeout==expected
+    assert dbapi_connection.timeout==0
+
+def test_query_timeout_is_skipped_where_the_driver_has_none():
+    dbapi_connection=types.SimpleNamespace()
+    connection=types.SimpleNamespace(connection=types.SimpleNamespace(dbapi_connection=dbapi_connection))
+    with soha_priorities.query_timeout(connection, 5):
+        assert not hasattr(dbapi_connection, 'timeout')
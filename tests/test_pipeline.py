@@ -0,0 +1,59 @@
+"""
+The whole run (main()) on a synthetic fleet served by the sql_helpers stand-in.
+"""
+import json
+import pandas as pd
+import pytest
+import sql_helpers
+import soha_priorities
+
+def pushed(schema, table):
+    frames=[df for pushed_schema, pushed_table, df in sql_helpers.PUSHES if (pushed_schema, pushed_table)==(schema, table)]
+    assert len(frames)==1
+    return frames[0]
+
+@pytest.fixture
+def run(fleet):
+    soha_priorities.main()
+    return fleet
+
+def test_both_priority_tables_are_pushed(run):
+    test_table=pushed('SoHa', 'Priorities_Test')
+    vrp=pushed('VRP_Details', 'SoHa_Priorities')
+    assert len(test_table)==len(vrp)>0
+    #Cumulative deferment needs a deferment history, and this run starts without one
+    expected={rules['output'] for rules in soha_priorities.PRIORITY_SOURCES.values()}-{'Cumulative Deferment'}
+    assert set(vrp['PriorityType'])==expected
+
+def test_priorities_are_for_known_wells_and_fully_rendered(run):
+    vrp=pushed('VRP_Details', 'SoHa_Priorities')
+    assert set(vrp['LocationID'])<=set(run['well_metadata.sql']['Corp_ID'])
+    assert set(vrp['PriorityLevel'].dropna())<={1, 2, 3, 4, 5}
+    assert not vrp['Reason'].dropna().str.contains('{', regex=False).any()
+    assert vrp['Grouper'].notna().any()
+
+def test_t_and_a_candidates_are_left_out(run):
+    assert (pushed('SoHa', 'Priorities_Test')['Choke_Status_Action']!='TA - P&A Candidate').all()
+
+def test_run_report_has_every_stage_and_no_failures(run):
+    with open(soha_priorities.RUN_REPORT_PATH) as f:
+        report=json.load(f)
+    assert report['failed_stages']==[]
+    stages={record['stage'] for record in report['stages']}
+    assert {'fetch', 'combine', 'classify', 'push:SoHa.Priorities_Test', 'push:VRP_Details.SoHa_Priorities'}<=stages
+    assert {'priorities:'+name for name in soha_priorities.PRIORITY_SOURCES}<=stages
+
+def test_run_report_is_written_when_the_run_fails(fleet, monkeypatch):
+    monkeypatch.setattr(soha_priorities, 'publish_priorities', lambda df: 1/0)
+    with pytest.raises(ZeroDivisionError):
+        soha_priorities.main()
+    with open(soha_priorities.RUN_REPORT_PATH) as f:
+        assert json.load(f)['stages']
+    assert soha_priorities.CURRENT_TELEMETRY is None
+
+def test_rerun_on_the_same_fleet_publishes_the_same_priorities(run):
+    first=pushed('VRP_Details', 'SoHa_Priorities').drop(columns=['CalcDate'])
+    sql_helpers.PUSHES.clear()
+    soha_priorities.main()
+    second=pushed('VRP_Details', 'SoHa_Priorities').drop(columns=['CalcDate'])
+    pd.testing.assert_frame_equal(first, second)
@@ -0,0 +1,159 @@
+"""
+Delta and swap publishing (publish_priority_delta(), publish_priority_swap()) against a local SQLite database, and
+the choice between the publish modes (push_priorities()).
+"""
+import logging
+import os
+import subprocess
+import sys
+import pandas as pd
+import pytest
+import sqlalchemy
+import sql_helpers
+import soha_priorities
+
+KEYS=['Corp_ID', 'Priority']
+
+@pytest.fixture
+def engine(tmp_path):
+    engine=sqlalchemy.create_engine('sqlite:///'+str(tmp_path/'publish.sqlite'))
+    yield engine
+    engine.dispose()
+
+def priorities(**changes):
+    """
+    A small priority frame, with two RTU meter rows on one key.
+    """
+    df=pd.DataFrame({'Corp_ID': ['SOHA0000001', 'SOHA0000002', 'SOHA0000003', 'SOHA0000003'],
+                     'Priority': ['Deferment', 'Flood Alert', 'Automation-RTU Issue', 'Automation-RTU Issue'],
+                     'Priority_Level': [2., 1., 3., 3.],
+                     'Description': ['deferring', 'flooding', 'meter 1', 'meter 2'],
+                     'Calc_Date': ['2021-06-01 06:00:00']*4})
+    for column, values in changes.items():
+        df[column]=values
+    return df
+
+def published(engine):
+    return pd.read_sql('SELECT * FROM Priorities_Test', engine).sort_values(KEYS+['Description']).reset_index(drop=True)
+
+def test_first_publish_creates_the_table(engine):
+    assert soha_priorities.publish_priority_delta(priorities(), 'Priorities_Test', None, KEYS, engine)==(4, 0)
+    pd.testing.assert_frame_equal(published(engine), priorities())
+
+def test_unchanged_rerun_writes_nothing(engine):
+    soha_priorities.publish_priority_delta(priorities(), 'Priorities_Test', None, KEYS, engine)
+    #Row order and the calculation date don't count as changes
+    rerun=priorities(Calc_Date=['2021-06-02 06:00:00']*4).iloc[::-1]
+    assert soha_priorities.publish_priority_delta(rerun, 'Priorities_Test', None, KEYS, engine)==(0, 0)
+    pd.testing.assert_frame_equal(published(engine), priorities())
+
+def test_changed_and_resolved_keys_are_rewritten(engine):
+    soha_priorities.publish_priority_delta(priorities(), 'Priorities_Test', None, KEYS, engine)
+    #One meter of the RTU key changes, and the flood alert is resolved
+    changed=priorities(Description=['deferring', 'flooding', 'meter 1', 'meter 2 (changed)']).drop(index=1)
+    assert soha_priorities.publish_priority_delta(changed, 'Priorities_Test', None, KEYS, engine)==(2, 2)
+    pd.testing.assert_frame_equal(published(engine), changed.reset_index(drop=True))
+    assert soha_priorities.publish_priority_delta(changed, 'Priorities_Test', None, KEYS, engine)==(0, 0)
+
+def test_rerun_reads_back_only_the_key_hashes(engine, monkeypatch):
+    soha_priorities.publish_priority_delta(priorities(), 'Priorities_Test', None, KEYS, engine)
+    read_sql=pd.read_sql
+    tables=[]
+
+    def recording_read_sql(statement, connection, *args, **kwargs):
+        tables.append(statement.get_final_froms()[0].name)
+        return read_sql(statement, connection, *args, **kwargs)
+
+    monkeypatch.setattr(pd, 'read_sql', recording_read_sql)
+    soha_priorities.publish_priority_delta(priorities(), 'Priorities_Test', None, KEYS, engine)
+    assert tables==['Priorities_Test'+soha_priorities.PUBLISH_HASH_SUFFIX]
+
+@pytest.mark.parametrize('written', ['replaced', 'hashes dropped'])
+def test_hashes_are_rebuilt_after_the_table_is_written_another_way(engine, written):
+    soha_priorities.publish_priority_delta(priorities(), 'Priorities_Test', None, KEYS, engine)
+    if written=='replaced':
+        priorities().iloc[:2].to_sql('Priorities_Test', engine, if_exists='replace', index=False)
+    else:
+        with engine.begin() as connection:
+            soha_priorities.drop_key_hashes(connection, 'Priorities_Test', None)
+    soha_priorities.publish_priority_delta(priorities(), 'Priorities_Test', None, KEYS, engine)
+    pd.testing.assert_frame_equal(published(engine), priorities())
+    assert soha_priorities.publish_priority_delta(priorities(), 'Priorities_Test', None, KEYS, engine)==(0, 0)
+
+def test_column_mismatch_fails_without_touching_the_table(engine):
+    soha_priorities.publish_priority_delta(priorities(), 'Priorities_Test', None, KEYS, engine)
+    with pytest.raises(ValueError, match='Columns of Priorities_Test'):
+        soha_priorities.publish_priority_delta(priorities(Extra=1), 'Priorities_Test', None, KEYS, engine)
+    pd.testing.assert_frame_equal(published(engine), priorities())
+
+def test_empty_publish_clears_every_key(engine):
+    soha_priorities.publish_priority_delta(priorities(), 'Priorities_Test', None, KEYS, engine)
+    assert soha_priorities.publish_priority_delta(priorities().iloc[:0], 'Priorities_Test', None, KEYS, engine)==(0, 3)
+    assert len(published(engine))==0
+
+def create_live_table(engine):
+    """
+    The live table as a DBA would define it, with its own column types, a unique constraint and an index.
+    """
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text('CREATE TABLE Priorities_Test (Corp_ID VARCHAR(11) NOT NULL, Priority VARCHAR(40) NOT NULL, '
+                                           'Priority_Level FLOAT, Description VARCHAR(400), Calc_Date DATETIME, '
+                                           'UNIQUE (Corp_ID, Priority, Description))'))
+        connection.execute(sqlalchemy.text('CREATE INDEX ix_priorities_level ON Priorities_Test (Priority_Level)'))
+
+def table_definition(engine):
+    inspector=sqlalchemy.inspect(engine)
+    columns=[(c['name'], str(c['type']), c['nullable']) for c in inspector.get_columns('Priorities_Test')]
+    indexes=[(i['name'], i['column_names']) for i in inspector.get_indexes('Priorities_Test')]
+    unique=[c['column_names'] for c in inspector.get_unique_constraints('Priorities_Test')]
+    return columns, indexes, unique
+
+def test_swap_keeps_the_live_tables_definition(engine):
+    create_live_table(engine)
+    definition=table_definition(engine)
+    for run in range(2):
+        assert soha_priorities.publish_priority_swap(priorities(), 'Priorities_Test', None, engine)==4
+        assert table_definition(engine)==definition
+    pd.testing.assert_frame_equal(published(engine), priorities())
+    assert sqlalchemy.inspect(engine).get_table_names()==['Priorities_Test']
+
+def test_swap_creates_a_missing_table(engine):
+    assert soha_priorities.publish_priority_swap(priorities(), 'Priorities_Test', None, engine)==4
+    pd.testing.assert_frame_equal(published(engine), priorities())
+
+def test_swap_column_mismatch_fails_without_touching_the_table(engine):
+    soha_priorities.publish_priority_swap(priorities(), 'Priorities_Test', None, engine)
+    with pytest.raises(ValueError, match='Columns of Priorities_Test'):
+        soha_priorities.publish_priority_swap(priorities(Extra=1), 'Priorities_Test', None, engine)
+    pd.testing.assert_frame_equal(published(engine), priorities())
+
+def test_swap_clears_the_leftovers_of_a_failed_publish(engine):
+    create_live_table(engine)
+    for leftover in ['Priorities_Test_staging', 'Priorities_Test_retired']:
+        priorities().to_sql(leftover, engine, index=False)
+    soha_priorities.publish_priority_swap(priorities().iloc[:2], 'Priorities_Test', None, engine)
+    assert len(published(engine))==2
+    assert sqlalchemy.inspect(engine).get_table_names()==['Priorities_Test']
+
+def test_unavailable_publish_mode_falls_back_to_replace_with_a_warning(monkeypatch, telemetry, caplog):
+    monkeypatch.setattr(soha_priorities, 'PUBLISH_MODE', 'swap')
+    with caplog.at_level(logging.WARNING, logger='soha_priorities'):
+        soha_priorities.push_priorities(priorities(), table='Priorities_Test', schema='SoHa', key_columns=KEYS)
+    assert 'Publish mode swap needs sql_helpers.get_future_state_engine()' in caplog.text
+    record,=telemetry.report()['stages']
+    assert (record['mode'], record['requested_mode'])==('replace', 'swap')
+    assert [(schema, table) for schema, table, df in sql_helpers.PUSHES]==[('SoHa', 'Priorities_Test')]
+
+def test_unknown_publish_mode_is_rejected(monkeypatch):
+    monkeypatch.setattr(soha_priorities, 'PUBLISH_MODE', 'upsert')
+    with pytest.raises(ValueError, match="Unknown publish mode 'upsert'"):
+        soha_priorities.push_priorities(priorities(), table='Priorities_Test', schema='SoHa', key_columns=KEYS)
+    assert sql_helpers.PUSHES==[]
+
+def test_replace_is_the_default_publish_mode():
+    #Read at import, so check it in a fresh interpreter
+    env={name: value for name, value in os.environ.items() if name!='SOHA_PUBLISH_MODE'}
+    env['PYTHONPATH']=os.pathsep.join([os.path.dirname(sql_helpers.__file__), os.path.dirname(soha_priorities.__file__)])
+    output=subprocess.run([sys.executable, '-c', 'import soha_priorities; print(soha_priorities.PUBLISH_MODE)'], env=env,
+                          capture_output=True, text=True, check=True).stdout
+    assert output.strip()=='replace'
@@ -0,0 +1,143 @@
+"""
+Predicate and projection pushdown (SOURCE_PUSHDOWN): pulls pushed into a SQLite database against the same pulls
+narrowed locally, the RTU readings re-pull, and the keyed snapshot variants.
+"""
+import logging
+import os
+import time
+import pandas as pd
+import pytest
+import sqlalchemy
+import sql_helpers
+import soha_priorities
+
+#Sources on servers that can hand out an engine (see source_engine())
+PUSHED_SOURCES=[name for name in soha_priorities.SOURCE_PUSHDOWN if soha_priorities.SQL_SOURCES[name][1] not in ['Arrow', 'CurrentState']]
+
+@pytest.fixture
+def database(fleet, tmp_path, monkeypatch):
+    """
+    The fleet in a SQLite database, with a .sql file per source selecting its table, handed out as every server's engine.
+    """
+    engine=sqlalchemy.create_engine('sqlite:///'+str(tmp_path/'fleet.sqlite'))
+    os.makedirs(soha_priorities.SQL_QUERY_DIR)
+    for query, df in fleet.items():
+        table=os.path.splitext(query)[0]
+        df.to_sql(table, engine, index=False)
+        with open(os.path.join(soha_priorities.SQL_QUERY_DIR, query), 'w') as f:
+            f.write('SELECT * FROM "%s";\n' % table)
+    monkeypatch.setattr(sql_helpers, 'get_future_state_engine', lambda server: engine, raising=False)
+    yield engine
+    engine.dispose()
+
+def keys(fleet, share=3):
+    wells=fleet['well_metadata.sql'].iloc[::share]
+    return {'API': list(wells['API'].str[:10]), 'Corp_ID': list(wells['Corp_ID'])}
+
+def comparable(df):
+    df=df.astype(str)
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+@pytest.mark.parametrize('name', PUSHED_SOURCES)
+@pytest.mark.parametrize('keyed, filtered', [(False, True), (True, True), (True, False)])
+def test_pushed_down_pulls_match_local_narrowing(database, fleet, telemetry, monkeypatch, name, keyed, filtered):
+    pull_keys=keys(fleet) if keyed else None
+    pushed=soha_priorities.pull_sql_source(name, keys=pull_keys, filtered=filtered)
+    monkeypatch.delattr(sql_helpers, 'get_future_state_engine')
+    monkeypatch.setattr(soha_priorities, 'SOURCE_ENGINES', {})
+    local=soha_priorities.pull_sql_source(name, keys=pull_keys, filtered=filtered)
+    assert [record['pushed_down'] for record in telemetry.report()['stages']]==[True, False]
+    assert pushed.attrs['pushed_down'] and not local.attrs['pushed_down']
+    #Sources pulled whole are left for their generator to filter
+    if filtered and not soha_priorities.SOURCE_PUSHDOWN[name].get('local_filters', True):
+        local=local[soha_priorities.pushdown_filter(local, name)]
+    assert list(pushed.columns)==soha_priorities.SOURCE_PUSHDOWN[name]['columns']
+    assert [str(dtype) for dtype in pushed.dtypes]==[str(dtype) for dtype in local.dtypes]
+    pd.testing.assert_frame_equal(comparable(pushed), comparable(local))
+
+def test_filters_and_keys_narrow_the_pull(database, fleet):
+    pull_keys=keys(fleet)
+    df=soha_priorities.pull_sql_source('site_inspections', keys=pull_keys)
+    assert len(df)>0 and (df['DaysSinceLastInspection']>60).all()
+    assert set(df['APINumber'].astype(str).str[:10])<=set(pull_keys['API'])
+    assert len(soha_priorities.pull_sql_source('site_inspections', keys=pull_keys, filtered=False))>len(df)
+
+def test_sources_can_be_given_keys_of_their_own(fleet):
+    pull_keys=keys(fleet)
+    own_keys={'Corp_ID': pull_keys['Corp_ID'][:5]}
+    sources=soha_priorities.fetch_sql_sources(['battery_voltages', 'percent_successful_comms'], keys=pull_keys, filtered=False,
+                                              keys_by_source={'battery_voltages': own_keys})
+    assert set(sources['battery_voltages']['Corp_ID'])<=set(own_keys['Corp_ID'])
+    assert set(sources['percent_successful_comms']['Corp_ID'])>set(own_keys['Corp_ID'])
+
+def rtu_priorities():
+    sources, well_metadata=soha_priorities.fetch_run_sources(soha_priorities.pull_well_specific_data)
+    return comparable(soha_priorities.RTU_comms_priorities(well_metadata, sources))
+
+def test_rtu_readings_are_completed_from_the_other_source(database, telemetry, monkeypatch):
+    pushed=rtu_priorities()
+    #The re-pull is a fetch wave of its own
+    record,=[record for record in telemetry.report()['stages'] if record['stage']=='fetch:rtu_readings']
+    assert record['rows_in']==2 and record['failed_sources']=={}
+    monkeypatch.setattr(soha_priorities, 'PUSHDOWN_ENABLED', False)
+    pd.testing.assert_frame_equal(pushed, rtu_priorities())
+
+def test_rtu_readings_pulled_whole_are_not_pulled_again(database, telemetry, monkeypatch):
+    pushed=rtu_priorities()
+    monkeypatch.delattr(sql_helpers, 'get_future_state_engine')
+    monkeypatch.setattr(soha_priorities, 'SOURCE_ENGINES', {})
+    telemetry.stages.clear()
+    pd.testing.assert_frame_equal(rtu_priorities(), pushed)
+    stages=[record['stage'] for record in telemetry.report()['stages']]
+    #With nothing pushed down, the keyed sources join the first wave and each RTU source is pulled once
+    assert 'fetch:keyed' not in stages and 'fetch:rtu_readings' not in stages
+    assert stages.count('pull:battery_voltages')==1 and stages.count('pull:percent_successful_comms')==1
+
+def test_completed_rtu_sources_are_not_completed_again(database, telemetry):
+    sources, well_metadata=soha_priorities.fetch_run_sources(soha_priorities.pull_well_specific_data)
+    soha_priorities.complete_rtu_sources(sources)
+    telemetry.stages.clear()
+    soha_priorities.RTU_comms_priorities(well_metadata, sources)
+    assert not [record for record in telemetry.report()['stages'] if record['stage'].startswith(('fetch', 'pull'))]
+
+def test_failed_rtu_readings_fail_the_rtu_priorities(database, monkeypatch):
+    sources, well_metadata=soha_priorities.fetch_run_sources(soha_priorities.pull_well_specific_data)
+    pull=soha_priorities.pull_sql_source
+    def failing_pull(name, *args, filtered=True, **kwargs):
+        if not filtered:
+            raise ConnectionError(name)
+        return pull(name, *args, filtered=filtered, **kwargs)
+    monkeypatch.setattr(soha_priorities, 'pull_sql_source', failing_pull)
+    with pytest.raises(ConnectionError):
+        soha_priorities.RTU_comms_priorities(well_metadata, sources)
+    soha_priorities.complete_rtu_sources(sources)
+    assert isinstance(sources['battery_voltages'], ConnectionError)
+
+def test_rejected_subqueries_are_pulled_whole(database, caplog):
+    #A trailing comment swallows the closing parenthesis of the subquery
+    with open(os.path.join(soha_priorities.SQL_QUERY_DIR, 'site_inspections.sql'), 'w') as f:
+        f.write('SELECT * FROM "site_inspections" -- latest inspection per well\n')
+    with caplog.at_level(logging.WARNING, logger='soha_priorities'):
+        df=soha_priorities.pull_sql_source('site_inspections')
+    assert not df.attrs['pushed_down'] and (df['DaysSinceLastInspection']>60).all()
+    assert 'site_inspections' in caplog.records[0].getMessage()
+
+def test_expired_variant_snapshots_are_pruned(fleet, monkeypatch):
+    monkeypatch.setattr(soha_priorities, 'SNAPSHOT_MODE', 'cache')
+    soha_priorities.pull_sql_source('battery_voltages')
+    expired_keys, fresh_keys, new_keys=keys(fleet, share=3), keys(fleet, share=4), keys(fleet, share=5)
+    soha_priorities.pull_sql_source('battery_voltages', keys=expired_keys)
+    expired_path=soha_priorities.snapshot_path('battery_voltages', variant=soha_priorities.pull_variant('battery_voltages', expired_keys))
+    expired=time.time()-soha_priorities.SNAPSHOT_TTLS['battery_voltages']-1
+    os.utime(expired_path, (expired, expired))
+    soha_priorities.pull_sql_source('battery_voltages', keys=fresh_keys)
+    soha_priorities.pull_sql_source('battery_voltages', keys=new_keys, filtered=False)
+    #Only the expired variant goes, the plain snapshot and the variants within their TTL stay
+    variants=['', soha_priorities.pull_variant('battery_voltages', fresh_keys),
+              soha_priorities.pull_variant('battery_voltages', new_keys, filtered=False)]
+    assert sorted(os.listdir(os.path.dirname(expired_path)))==sorted('rtu_battery_voltages'+variant+'.parquet' for variant in variants)
+
+def test_shard_workers_make_no_pulls(database, telemetry):
+    soha_priorities.run_sharded_priorities('Route', max_workers=2)
+    stages=[record['stage'] for record in telemetry.report()['stages'] if record['stage'].startswith('shard[')]
+    assert stages and not [stage for stage in stages if ':pull:' in stage or ':fetch' in stage]
@@ -0,0 +1,75 @@
+"""
+The priority source registry (PRIORITY_SOURCES): enabling sources, the sources a run fetches for them, failed
+generators and running them on a thread pool.
+"""
+import logging
+import pandas as pd
+import pytest
+import sql_helpers
+import soha_priorities
+
+def published_priorities(run=soha_priorities.run_priorities):
+    sql_helpers.PUSHES.clear()
+    run()
+    df,=[df for schema, table, df in sql_helpers.PUSHES if table=='Priorities_Test']
+    return set(df['Priority'].astype(str))
+
+def run_sources(names=None, max_workers=None):
+    names=soha_priorities.enabled_priority_sources(names)
+    sources, well_metadata=soha_priorities.fetch_run_sources(soha_priorities.pull_well_specific_data,
+                                                             soha_priorities.priority_run_sources(names))
+    sources.update(soha_priorities.local_priority_sources(well_metadata, names))
+    return soha_priorities.run_priority_sources(well_metadata, sources, names, max_workers=max_workers)
+
+def comparable(df):
+    df=df.astype(str)
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+def test_enabled_sources_keep_the_combine_order():
+    names=['RTU_comms_priorities', 'gas_deferment_priorities']
+    assert soha_priorities.enabled_priority_sources(names)==['gas_deferment_priorities', 'RTU_comms_priorities']
+    assert soha_priorities.enabled_priority_sources([])==[]
+
+def test_unknown_sources_are_rejected(monkeypatch):
+    with pytest.raises(ValueError, match='Unknown priority sources: flood_priority'):
+        soha_priorities.enabled_priority_sources(['flood_priority'])
+    monkeypatch.setattr(soha_priorities, 'ENABLED_PRIORITY_SOURCES', ['gas_deferment_priorities', 'rtu'])
+    with pytest.raises(ValueError, match='rtu'):
+        soha_priorities.enabled_priority_sources()
+
+def test_a_run_fetches_only_what_its_sources_read():
+    fetched=soha_priorities.priority_run_sources(['flood_priorities'])
+    assert 'flood_data' in fetched and set(fetched)-{'flood_data'}<=set(soha_priorities.WELL_INDEX_SOURCES)
+    every=soha_priorities.priority_run_sources(list(soha_priorities.PRIORITY_SOURCES))
+    assert {'battery_voltages', 'percent_successful_comms', 'site_inspections', 'work_management'}<=set(every)
+
+def test_disabled_sources_publish_nothing(fleet, monkeypatch):
+    every=published_priorities()
+    assert {'Flood Alert', 'Site Inspection'}<=every
+    monkeypatch.setattr(soha_priorities, 'DEFERMENT_STATE_PATH', soha_priorities.DEFERMENT_STATE_PATH+'.disabled')
+    monkeypatch.setattr(soha_priorities, 'ENABLED_PRIORITY_SOURCES',
+                        [name for name in soha_priorities.PRIORITY_SOURCES if name not in ['flood_priorities', 'site_inspection_priorities']])
+    assert published_priorities()==every-{'Flood Alert', 'Site Inspection'}
+
+def test_a_failed_source_is_logged_and_drops_only_its_own_priorities(fleet, telemetry, monkeypatch, caplog):
+    def failing(well_metadata, sources):
+        raise KeyError('FloodLevel')
+    monkeypatch.setitem(soha_priorities.PRIORITY_SOURCES['flood_priorities'], 'pandas', failing)
+    with caplog.at_level(logging.ERROR, logger='soha_priorities'):
+        priorities=run_sources()
+    assert priorities['flood_priorities'] is None
+    assert all(df is not None for name, df in priorities.items() if name!='flood_priorities')
+    record,=[record for record in caplog.records if 'flood_priorities' in record.getMessage()]
+    assert record.exc_info[0] is KeyError
+    stage,=[stage for stage in telemetry.report()['stages'] if stage['stage']=='priorities:flood_priorities']
+    assert stage['error']=='KeyError' and stage['priority_type']=='Flood Alert'
+    combined=soha_priorities.combine_priorities(priorities.values())
+    assert len(combined)>0 and 'Flood Alert' not in set(combined['Priority'].astype(str))
+
+def test_threaded_sources_match_the_serial_run(fleet, monkeypatch):
+    serial=run_sources(max_workers=1)
+    monkeypatch.setattr(soha_priorities, 'DEFERMENT_STATE_PATH', soha_priorities.DEFERMENT_STATE_PATH+'.threads')
+    threaded=run_sources(max_workers=4)
+    assert list(threaded)==list(serial)
+    for name in serial:
+        pd.testing.assert_frame_equal(comparable(threaded[name]), comparable(serial[name]))
@@ -0,0 +1,92 @@
+"""
+Priority rule tables (PRIORITY_RULES, apply_priority_rules()) against the chained .loc threshold blocks they replaced.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import soha_priorities
+
+def baseline_flood(df):
+    df.loc[df['HoursUntilFlood']<24, 'Priority_Level']=1
+    df.loc[df['HoursUntilFlood']>=24, 'Priority_Level']=2
+    df.loc[df['HoursUntilFlood']>=48, 'Priority_Level']=3
+    df.loc[df['HoursUntilFlood']>=72, 'Priority_Level']=4
+    df.loc[df['HoursUntilFlood']>=96, 'Priority_Level']=5
+    df.loc[df['HoursUntilFlood']<24, 'Description']='Well is already flooding or is predicted to flood within the next 24 hours. '
+    df.loc[df['HoursUntilFlood']>=24, 'Description']='Well is predicted to flood between 1 to 2 days. '
+    df.loc[df['HoursUntilFlood']>=48, 'Description']='Well is predicted to flood between 2 and 3 days. '
+    df.loc[df['HoursUntilFlood']>=72, 'Description']='Well is predicted to flood between 3 and 4 days. '
+    df.loc[df['HoursUntilFlood']>=96, 'Description']='Well is predicted to flood between 4 and 5 days. '
+    return df
+
+def baseline_deferment(df):
+    df.loc[df['DefermentQuantile']<.25, 'Priority_Level']=2
+    df.loc[df['DefermentQuantile']>=.25, 'Priority_Level']=3
+    df.loc[df['DefermentQuantile']>=.50, 'Priority_Level']=4
+    df.loc[df['DefermentQuantile']>=.75, 'Priority_Level']=5
+    df.loc[df['DefermentQuantile']<.25, 'Description']='Top 25% deferring wells: '
+    df.loc[df['DefermentQuantile']>=.25, 'Description']='Top 25%-50% wells deferring: '
+    df.loc[df['DefermentQuantile']>=.5, 'Description']='Top 50%-75% wells deferring: '
+    df.loc[df['DefermentQuantile']>=.75, 'Description']='Bottom 25% wells deferring: '
+    return df
+
+def baseline_cumulative_deferment(df):
+    df.loc[(df['CumulativeDeferment']>=1000) & (df['CumulativeDeferment']<2000), 'Priority_Level']=5
+    df.loc[(df['CumulativeDeferment']>=2000) & (df['CumulativeDeferment']<3000), 'Priority_Level']=4
+    df.loc[(df['CumulativeDeferment']>=3000) & (df['CumulativeDeferment']<4000), 'Priority_Level']=3
+    df.loc[(df['CumulativeDeferment']>=4000) & (df['CumulativeDeferment']<5000), 'Priority_Level']=2
+    df['Description']='Well has a cumulative deferment of '
+    return df
+
+def baseline_site_inspection(df):
+    df.loc[(df['DaysSinceLastInspection']>=60) & (df['DaysSinceLastInspection']<75), 'Priority_Level']=5
+    df.loc[(df['DaysSinceLastInspection']>=75) & (df['DaysSinceLastInspection']<90), 'Priority_Level']=4
+    df.loc[df['DaysSinceLastInspection']>=90, 'Priority_Level']=3
+    df['Description']='Site Inspection Due: '
+    return df
+
+def baseline_rtu(df):
+    comms=df['PercentSuccessfulComms'].astype('float')
+    df.loc[(comms<=50) | (df['BatteryVoltage'].astype('float')<=11), 'Priority_Level']=3
+    df.loc[(comms>50) & (comms<=60), 'Priority_Level']=4
+    df.loc[(comms>60) & (comms<=75), 'Priority_Level']=5
+    df.loc[:, 'Description']='RTU Comms Issue Detected: '
+    return df
+
+def values(boundaries, rng, low, high):
+    """
+    Every boundary, a hair either side of it, a null, and random values in [low, high).
+    """
+    edges=np.array(boundaries, dtype='float64')
+    return np.concatenate([edges, edges-1e-9, edges+1e-9, [np.nan], rng.uniform(low, high, 200)])
+
+CASES={'Flood Alert': (baseline_flood, lambda rng: {'HoursUntilFlood': values([0, 24, 48, 72, 96, 120], rng, -10, 150)}),
+       'Deferment': (baseline_deferment, lambda rng: {'DefermentQuantile': values([0, .25, .5, .75, 1], rng, 0, 1)}),
+       'Cumulative Deferment': (baseline_cumulative_deferment,
+                                lambda rng: {'CumulativeDeferment': values([1000, 2000, 3000, 4000, 5000], rng, 0, 6000)}),
+       'Site Inspection': (baseline_site_inspection, lambda rng: {'DaysSinceLastInspection': values([60, 75, 90], rng, 0, 120)}),
+       'Automation-RTU Issue': (baseline_rtu, lambda rng: {'PercentSuccessfulComms': np.tile(values([50, 60, 75], rng, 0, 100), 2),
+                                                           'BatteryVoltage': np.repeat([10.5, 12.5], 210)})}
+
+@pytest.mark.parametrize('priority_type', list(CASES))
+def test_levels_and_descriptions_match_the_threshold_blocks(priority_type):
+    baseline, columns=CASES[priority_type]
+    df=pd.DataFrame(columns(np.random.default_rng(0)))
+    expected=baseline(df.copy())
+    actual=soha_priorities.apply_priority_rules(df.copy(), priority_type)
+    assert (actual['Priority']==priority_type).all()
+    np.testing.assert_array_equal(actual['Priority_Level'].to_numpy(dtype='float64'),
+                                  expected['Priority_Level'].to_numpy(dtype='float64'))
+    #Each templated row starts with the description the threshold blocks gave it, and the rest have none
+    templates=[None if pd.isna(t) else soha_priorities.DESCRIPTION_TEMPLATES[int(t)] for t in actual['Description_Template']]
+    for template, description in zip(templates, expected['Description']):
+        if pd.isna(description):
+            assert template is None
+        else:
+            assert template.startswith(description)
+
+def test_unbanded_rows_keep_their_table_description():
+    df=soha_priorities.apply_priority_rules(pd.DataFrame({'DaysSinceLastInspection': [30.]}), 'Site Inspection')
+    assert np.isnan(df['Priority_Level'].iloc[0])
+    template=soha_priorities.DESCRIPTION_TEMPLATES[int(df['Description_Template'].iloc[0])]
+    assert template==soha_priorities.PRIORITY_RULES['Site Inspection']['details']
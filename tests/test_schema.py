@@ -0,0 +1,51 @@
+"""
+Declared source schemas (SOURCE_SCHEMAS, apply_schema()) applied as every source is pulled.
+"""
+import pandas as pd
+import pytest
+import soha_priorities
+
+def test_each_declared_type_is_applied():
+    df=pd.DataFrame({'Area': ['North', 'South', 'North'], 'Date': ['2021-06-01', 'not a date', None],
+                     'Count': ['1', '2', None], 'Small': [1, 2, 3], 'Reading': ['11.5', 'x', '12'], 'Gas': [1, 2, 3]})
+    df=soha_priorities.apply_schema(df, {'Area': 'category', 'Date': 'datetime', 'Count': 'integer', 'Small': 'integer',
+                                         'Reading': 'float32', 'Gas': 'float64'})
+    assert isinstance(df['Area'].dtype, pd.CategoricalDtype)
+    assert df['Date'].tolist()[0]==pd.Timestamp('2021-06-01') and df['Date'].isna().tolist()==[False, True, True]
+    #Nulls keep an integer column as floats
+    assert df['Count'].dtype=='float64'
+    assert df['Small'].dtype=='int8'
+    assert df['Reading'].dtype=='float32' and df['Reading'].isna().tolist()==[False, True, False]
+    assert df['Gas'].dtype=='float64'
+
+def test_applying_a_schema_twice_changes_nothing():
+    schema=soha_priorities.SOURCE_SCHEMAS['battery_voltages']
+    df=pd.DataFrame({'Corp_ID': ['SOHA0000001'], 'LastBatteryVoltageReading': ['2021-06-01 05:00'], 'BatteryVoltage': ['10.9']})
+    once=soha_priorities.apply_schema(df.copy(), schema)
+    pd.testing.assert_frame_equal(soha_priorities.apply_schema(once.copy(), schema), once)
+
+def test_missing_and_undeclared_columns_are_left_alone():
+    df=pd.DataFrame({'Corp_ID': ['SOHA0000001'], 'Extra': ['1']})
+    df=soha_priorities.apply_schema(df, soha_priorities.SOURCE_SCHEMAS['cumulative_deferment'])
+    assert list(df.columns)==['Corp_ID', 'Extra'] and df['Extra'].tolist()==['1']
+
+@pytest.mark.parametrize('name', ['well_metadata', 'well_codes', 'flood_data', 'battery_voltages'])
+def test_pulls_come_back_with_their_schema(fleet, telemetry, name):
+    df=soha_priorities.pull_sql_source(name)
+    for column, kind in soha_priorities.SOURCE_SCHEMAS[name].items():
+        assert df[column].dtype==soha_priorities.SCHEMA_CONVERTERS[kind](df[column]).dtype
+    record,=[record for record in telemetry.report()['stages'] if record['stage']=='pull:'+name]
+    assert record['bytes']<=record['raw_bytes']
+
+def test_cached_snapshots_load_with_their_schema(fleet, monkeypatch):
+    monkeypatch.setattr(soha_priorities, 'SNAPSHOT_MODE', 'cache')
+    pulled=soha_priorities.pull_sql_source('well_codes')
+    cached=soha_priorities.pull_sql_source('well_codes')
+    pd.testing.assert_frame_equal(cached, pulled)
+
+def test_combined_priorities_get_their_categoricals_back():
+    frames=[pd.DataFrame({'Area': pd.Categorical([area]), 'Priority': pd.Categorical([priority])})
+            for area, priority in [('North', 'Deferment'), ('South', 'Flood Alert')]]
+    combined=soha_priorities.apply_schema(pd.concat(frames, ignore_index=True), soha_priorities.PRIORITY_SCHEMA)
+    assert isinstance(combined['Area'].dtype, pd.CategoricalDtype)
+    assert combined['Priority'].tolist()==['Deferment', 'Flood Alert']
@@ -0,0 +1,71 @@
+"""
+Job sequencing (sequence_group(), sequence_jobs()): each group's travel order, Job_Rank and JobTime.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import soha_priorities
+
+def haversine_km(latitude, longitude, other_latitude, other_longitude):
+    latitude, longitude, other_latitude, other_longitude=map(np.radians, [latitude, longitude, other_latitude, other_longitude])
+    a=np.sin((other_latitude-latitude)/2)**2+np.cos(latitude)*np.cos(other_latitude)*np.sin((other_longitude-longitude)/2)**2
+    return 2*soha_priorities.EARTH_RADIUS_KM*np.arcsin(np.sqrt(a))
+
+def jobs(count, seed=0):
+    rng=np.random.default_rng(seed)
+    return 31+rng.random(count)*2, -94.5+rng.random(count)*2, rng.integers(1, 6, count).astype('float64')
+
+def test_chord_distances_are_great_circle_distances():
+    latitude, longitude, levels=jobs(50)
+    points=soha_priorities.unit_vectors(latitude, longitude)
+    km=soha_priorities.chord_to_km(np.linalg.norm(points-points[0], axis=1))
+    np.testing.assert_allclose(km, haversine_km(latitude[0], longitude[0], latitude, longitude), atol=1e-6)
+    np.testing.assert_allclose(soha_priorities.km_to_chord(km), np.linalg.norm(points-points[0], axis=1), atol=1e-12)
+
+@pytest.mark.parametrize('count', [2, 50, 600])
+def test_kd_tree_order_matches_brute_force(count, monkeypatch):
+    pytest.importorskip('scipy')
+    latitude, longitude, levels=jobs(count, seed=count)
+    points=soha_priorities.unit_vectors(latitude, longitude)
+    weights=pd.Series(levels).map(soha_priorities.JOB_PRIORITY_WEIGHTS).to_numpy(dtype='float64')
+    monkeypatch.setattr(soha_priorities, 'JOB_BRUTE_FORCE_LIMIT', count)
+    brute_order, brute_legs=soha_priorities.sequence_group(points, weights)
+    monkeypatch.setattr(soha_priorities, 'JOB_BRUTE_FORCE_LIMIT', 0)
+    tree_order, tree_legs=soha_priorities.sequence_group(points, weights)
+    np.testing.assert_array_equal(tree_order, brute_order)
+    np.testing.assert_allclose(tree_legs, brute_legs)
+
+def test_each_step_takes_the_least_distance_per_weight():
+    latitude, longitude, levels=jobs(40, seed=3)
+    points=soha_priorities.unit_vectors(latitude, longitude)
+    weights=pd.Series(levels).map(soha_priorities.JOB_PRIORITY_WEIGHTS).to_numpy(dtype='float64')
+    order, legs=soha_priorities.sequence_group(points, weights)
+    assert sorted(order)==list(range(40)) and order[0]==np.argmax(weights) and legs[0]==0
+    for step in range(1, 40):
+        left=order[step:]
+        km=haversine_km(latitude[order[step-1]], longitude[order[step-1]], latitude[left], longitude[left])
+        assert np.isclose(km[0]/weights[order[step]], (km/weights[left]).min())
+        assert np.isclose(km[0], legs[step])
+
+def test_ranks_run_from_one_within_each_group():
+    latitude, longitude, levels=jobs(300, seed=1)
+    latitude[[5, 17]]=np.nan
+    groups=np.random.default_rng(1).choice(['Route 1', 'Route 2', None], 300)
+    types=np.full(300, 'Deferment', dtype=object)
+    ranks, ranked, minutes=soha_priorities.sequence_jobs(latitude, longitude, groups, levels, types)
+    assert not ranked[[5, 17]].any() and np.isnan(minutes[[5, 17]]).all() and (ranks[[5, 17]]==0).all()
+    for group in ['Route 1', 'Route 2', None]:
+        rows=np.flatnonzero((groups==group) & ranked) if group else np.flatnonzero(pd.isna(groups) & ranked)
+        assert sorted(ranks[rows])==list(range(1, len(rows)+1))
+
+def test_job_time_is_the_drive_plus_the_time_on_site():
+    latitude=np.array([31., 31., 31.5])
+    longitude=np.array([-94., -94.01, -94.])
+    types=np.array(['Flood Alert', 'Enbase Work Management', 'Unknown'], dtype=object)
+    ranks, ranked, minutes=soha_priorities.sequence_jobs(latitude, longitude, ['Route 1']*3, [1., 2., None], types)
+    assert ranks.tolist()==[1, 2, 3]
+    drive=lambda km: km*soha_priorities.JOB_ROAD_FACTOR/soha_priorities.JOB_TRAVEL_SPEED_KMH*60
+    expected=[soha_priorities.JOB_SERVICE_MINUTES['Flood Alert'],
+              drive(haversine_km(31., -94., 31., -94.01))+soha_priorities.JOB_SERVICE_MINUTES['Enbase Work Management'],
+              drive(haversine_km(31., -94.01, 31.5, -94.))+soha_priorities.JOB_DEFAULT_SERVICE_MINUTES]
+    np.testing.assert_allclose(minutes, np.round(expected, 1))
@@ -0,0 +1,91 @@
+"""
+The long running priority service (PriorityService): refreshes, recomputes and publishes.
+"""
+import logging
+import time
+import pytest
+import sql_helpers
+import soha_priorities
+
+@pytest.fixture
+def pulls(fleet, monkeypatch):
+    """
+    Count the stand-in's pulls by query file. Queries in pulls['failing'] raise.
+    """
+    pull=sql_helpers._pull
+    counts={'failing': set()}
+
+    def counting_pull(query):
+        if query in counts['failing']:
+            raise ConnectionError(query+' is down')
+        counts[query]=counts.get(query, 0)+1
+        return pull(query)
+
+    monkeypatch.setattr(sql_helpers, '_pull', counting_pull)
+    return counts
+
+def published_tables():
+    return [(schema, table) for schema, table, df in sql_helpers.PUSHES]
+
+def test_refresh_goes_to_the_database_in_cache_mode(pulls, monkeypatch):
+    monkeypatch.setattr(soha_priorities, 'SNAPSHOT_MODE', 'cache')
+    soha_priorities.pull_sql_source('well_codes')
+    service=soha_priorities.PriorityService()
+    service.run_cycle()
+    assert pulls['most_recent_well_coding.sql']==2
+
+def test_sources_are_stamped_with_their_pull_time(pulls):
+    service=soha_priorities.PriorityService()
+    before=time.time()
+    #The cycle's clock says an hour ago, but the data was pulled just now
+    service.run_cycle(now=before-3600)
+    assert all(before<=fetched_at<=time.time() for fetched_at in service.fetched_at.values())
+
+def test_unchanged_cycle_does_not_publish(pulls):
+    service=soha_priorities.PriorityService()
+    now=time.time()
+    assert service.run_cycle(now)
+    assert not service.run_cycle(now+1)
+    assert len(sql_helpers.PUSHES)==2
+
+def test_failed_publish_is_retried_on_the_next_cycle(pulls, monkeypatch):
+    service=soha_priorities.PriorityService()
+    publish=soha_priorities.publish_priorities
+    monkeypatch.setattr(soha_priorities, 'publish_priorities', lambda df: 1/0)
+    now=time.time()
+    with pytest.raises(ZeroDivisionError):
+        service.run_cycle(now)
+    monkeypatch.setattr(soha_priorities, 'publish_priorities', publish)
+    #Nothing is due, and nothing changed since the failed publish
+    assert service.run_cycle(now+1)
+    assert published_tables()==[('SoHa', 'Priorities_Test'), ('VRP_Details', 'SoHa_Priorities')]
+
+def test_priorities_that_all_go_stale_are_published_empty(pulls):
+    service=soha_priorities.PriorityService()
+    now=time.time()
+    service.run_cycle(now)
+    pulls['failing'].update(query for query, server in soha_priorities.SQL_SOURCES.values())
+    later=now+10*max(soha_priorities.SERVICE_STALENESS_LIMITS.values())
+    assert service.run_cycle(later)
+    assert service.priorities=={}
+    assert [len(df) for schema, table, df in sql_helpers.PUSHES[2:]]==[0, 0]
+    #And only once
+    assert not service.run_cycle(later+1)
+
+def test_stale_source_only_drops_its_own_priorities(pulls):
+    service=soha_priorities.PriorityService(staleness_limits={**soha_priorities.SERVICE_STALENESS_LIMITS, 'flood_data': 60})
+    now=time.time()
+    service.run_cycle(now)
+    assert 'flood_priorities' in service.priorities
+    pulls['failing'].add('Flood_Priorities_Prediction.sql')
+    assert service.run_cycle(now+soha_priorities.SERVICE_REFRESH_INTERVALS['flood_data'])
+    assert 'flood_priorities' not in service.priorities
+    assert 'Flood Alert' not in set(sql_helpers.PUSHES[-1][2]['PriorityType'])
+
+def test_failed_cycle_is_logged(monkeypatch, caplog):
+    service=soha_priorities.PriorityService()
+    monkeypatch.setattr(service, 'run_cycle', lambda: 1/0)
+    with caplog.at_level(logging.ERROR, logger='soha_priorities'):
+        service.run_forever(max_cycles=1)
+    record,=caplog.records
+    assert record.exc_info[0] is ZeroDivisionError
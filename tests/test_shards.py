@@ -0,0 +1,51 @@
+"""
+Sharded execution (run_sharded_priorities()) against an unsharded run.
+"""
+import pandas as pd
+import pytest
+import sqlalchemy
+import soha_priorities
+
+@pytest.mark.parametrize('column', ['Area', 'Route'])
+def test_sharded_run_publishes_what_an_unsharded_run_does(fleet, deferment_state, published, telemetry, monkeypatch, column):
+    unsharded=published(soha_priorities.run_priorities)
+    #Each run updates the deferment state, so start the sharded run from the same one
+    monkeypatch.setattr(soha_priorities, 'DEFERMENT_STATE_PATH', soha_priorities.DEFERMENT_STATE_PATH+'.sharded')
+    soha_priorities.write_snapshot(deferment_state, soha_priorities.DEFERMENT_STATE_PATH)
+    sharded=published(lambda: soha_priorities.run_sharded_priorities(column, max_workers=2))
+    assert 'Cumulative Deferment' in set(unsharded['PriorityType'])
+    pd.testing.assert_frame_equal(sharded, unsharded)
+    #The shards' stages come back from the worker processes
+    assert any(record['stage'].startswith('shard[') for record in telemetry.report()['stages'])
+
+def test_shards_split_every_source_by_well(fleet):
+    sources=soha_priorities.fetch_sql_sources(soha_priorities.PRIORITY_RUN_SOURCES)
+    well_metadata=soha_priorities.pull_well_specific_data(sources)
+    shards=soha_priorities.shard_priority_inputs(well_metadata, sources, 'Area')
+    assert [value for value, wells, shard_sources in shards]==sorted(set(well_metadata.frame['Area']))
+    assert sum(len(wells) for value, wells, shard_sources in shards)==len(well_metadata)
+    #Every row of a known well lands in exactly one shard
+    for name, (left_on, key) in soha_priorities.SHARD_SOURCE_KEYS.items():
+        if name in sources:
+            values=sources[name][left_on].astype(str).str[:10] if key=='API' else sources[name][left_on]
+            known=values.isin(set(well_metadata.frame[key])).sum()
+            assert sum(len(shard_sources[name]) for value, wells, shard_sources in shards)==known>0
+
+def test_failed_sources_reach_every_shard(fleet):
+    sources=soha_priorities.fetch_sql_sources(soha_priorities.PRIORITY_RUN_SOURCES)
+    well_metadata=soha_priorities.pull_well_specific_data(sources)
+    sources['flood_data']=TimeoutError()
+    shards=soha_priorities.shard_priority_inputs(well_metadata, sources, 'Area')
+    assert all(shard_sources['flood_data'] is sources['flood_data'] for value, wells, shard_sources in shards)
+
+def test_workers_drop_the_engines_they_inherit(tmp_path, monkeypatch):
+    engine=sqlalchemy.create_engine('sqlite:///'+str(tmp_path/'source.sqlite'))
+    with engine.connect() as connection:
+        connection.execute(sqlalchemy.text('SELECT 1'))
+    monkeypatch.setattr(soha_priorities, 'SOURCE_ENGINES', {'EnterpriseDataHub': engine})
+    pool=engine.pool
+    assert pool.checkedin()==1
+    soha_priorities.dispose_inherited_engines()
+    #The worker gets a pool of its own, the inherited connection is left to the parent
+    assert engine.pool is not pool and engine.pool.checkedin()==0 and pool.checkedin()==1
+    engine.dispose()
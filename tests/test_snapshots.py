@@ -0,0 +1,64 @@
+"""
+Parquet snapshots of the SQL pulls: live, cache and replay modes (pull_sql_source()).
+"""
+import os
+import time
+import pandas as pd
+import pytest
+import sql_helpers
+import soha_priorities
+
+@pytest.fixture
+def pulls(fleet, monkeypatch):
+    """
+    Count the stand-in's pulls by query file.
+    """
+    pull=sql_helpers._pull
+    counts={}
+
+    def counting_pull(query):
+        counts[query]=counts.get(query, 0)+1
+        return pull(query)
+
+    monkeypatch.setattr(sql_helpers, '_pull', counting_pull)
+    return counts
+
+def pull_origin(telemetry, name):
+    return [record['origin'] for record in telemetry.report()['stages'] if record['stage']=='pull:'+name]
+
+def test_live_mode_never_writes_snapshots(pulls, telemetry):
+    soha_priorities.pull_sql_source('well_codes', mode='live')
+    soha_priorities.pull_sql_source('well_codes', mode='live')
+    assert pulls['most_recent_well_coding.sql']==2
+    assert not os.path.exists(soha_priorities.snapshot_path('well_codes'))
+    assert pull_origin(telemetry, 'well_codes')==['database', 'database']
+
+def test_cache_mode_reuses_a_fresh_snapshot(pulls, telemetry):
+    first=soha_priorities.pull_sql_source('well_codes', mode='cache')
+    second=soha_priorities.pull_sql_source('well_codes', mode='cache')
+    assert pulls['most_recent_well_coding.sql']==1
+    assert pull_origin(telemetry, 'well_codes')==['database', 'snapshot']
+    pd.testing.assert_frame_equal(first, second)
+
+def test_cache_mode_refreshes_an_expired_snapshot(pulls):
+    soha_priorities.pull_sql_source('well_codes', mode='cache')
+    path=soha_priorities.snapshot_path('well_codes')
+    expired=time.time()-soha_priorities.SNAPSHOT_TTLS['well_codes']-1
+    os.utime(path, (expired, expired))
+    soha_priorities.pull_sql_source('well_codes', mode='cache')
+    assert pulls['most_recent_well_coding.sql']==2
+
+def test_replay_mode_runs_off_snapshots_only(pulls, monkeypatch):
+    cached=soha_priorities.pull_sql_source('site_inspections', mode='cache')
+    monkeypatch.setattr(sql_helpers, '_pull', lambda query: pytest.fail('replay went to the database'))
+    pd.testing.assert_frame_equal(soha_priorities.pull_sql_source('site_inspections', mode='replay'), cached)
+    with pytest.raises(FileNotFoundError):
+        soha_priorities.pull_sql_source('flood_data', mode='replay')
+
+def test_replayed_pushes_are_written_under_the_snapshot_directory(monkeypatch):
+    monkeypatch.setattr(soha_priorities, 'SNAPSHOT_MODE', 'replay')
+    df=pd.DataFrame({'Corp_ID': ['SOHA0000001'], 'Priority': ['Deferment']})
+    soha_priorities.push_priorities(df, table='Priorities_Test', schema='SoHa', key_columns=['Corp_ID', 'Priority'])
+    assert sql_helpers.PUSHES==[]
+    written=pd.read_parquet(os.path.join(soha_priorities.SNAPSHOT_DIR, 'replay_output', 'SoHa.Priorities_Test.parquet'))
+    pd.testing.assert_frame_equal(written, df)
@@ -0,0 +1,85 @@
+"""
+Per-stage run telemetry (RunTelemetry, telemetry_stage()) and the run report.
+"""
+import json
+import os
+import threading
+import pandas as pd
+import pytest
+import soha_priorities
+
+def test_stage_records_rows_and_time(telemetry):
+    with soha_priorities.telemetry_stage('merge:well_codes', rows_in=10) as record:
+        record['rows_out']=8
+    record,=telemetry.report()['stages']
+    assert (record['stage'], record['rows_in'], record['rows_out'], record['error'])==('merge:well_codes', 10, 8, None)
+    assert record['seconds']>=0
+
+def test_failed_stage_is_recorded_and_reraised(telemetry):
+    with pytest.raises(KeyError):
+        with soha_priorities.telemetry_stage('attach:API'):
+            raise KeyError('Corp_ID')
+    report=telemetry.report()
+    assert report['failed_stages']==['attach:API']
+    assert report['stages'][0]['error']=='KeyError'
+    assert report['stages'][0]['error_message']=="'Corp_ID'"
+
+def test_stages_outside_a_run_are_not_recorded():
+    with soha_priorities.telemetry_stage('combine') as record:
+        record['rows_out']=1
+    assert soha_priorities.CURRENT_TELEMETRY is None
+
+def test_stages_from_several_threads_are_all_kept(telemetry):
+
+    def record_stages(thread):
+        for stage in range(50):
+            with soha_priorities.telemetry_stage('pull:%d.%d' % (thread, stage)):
+                pass
+
+    threads=[threading.Thread(target=record_stages, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(telemetry.report()['stages'])==400
+
+def test_failing_generator_is_dropped_and_recorded(telemetry):
+
+    def failing_generator(wells):
+        raise ValueError('no flood predictions')
+
+    assert soha_priorities.run_priority_generator('flood_priorities', failing_generator, None) is None
+    record,=telemetry.report()['stages']
+    assert (record['stage'], record['error'], record['error_message'])==('priorities:flood_priorities', 'ValueError',
+                                                                        'no flood predictions')
+
+def test_prometheus_text_sums_repeated_stages(telemetry):
+    for rows in [3, 4]:
+        with soha_priorities.telemetry_stage('push:SoHa.Priorities_Test', rows_in=rows) as record:
+            record['rows_out']=rows
+    with pytest.raises(ZeroDivisionError):
+        with soha_priorities.telemetry_stage('classify'):
+            1/0
+    lines=telemetry.prometheus_text().splitlines()
+    assert 'soha_stage_rows_out{stage="push:SoHa.Priorities_Test"} 7' in lines
+    assert 'soha_stage_failures{stage="push:SoHa.Priorities_Test"} 0' in lines
+    assert 'soha_stage_failures{stage="classify"} 1' in lines
+    assert '# TYPE soha_run_seconds gauge' in lines
+
+def test_run_report_and_prometheus_file_are_written(telemetry, tmp_path, monkeypatch):
+    monkeypatch.setattr(soha_priorities, 'PROMETHEUS_PATH', str(tmp_path/'soha.prom'))
+    with soha_priorities.telemetry_stage('combine') as record:
+        record['rows_out']=0
+    soha_priorities.write_run_report(telemetry)
+    with open(soha_priorities.RUN_REPORT_PATH) as f:
+        assert [record['stage'] for record in json.load(f)['stages']]==['combine']
+    with open(soha_priorities.PROMETHEUS_PATH) as f:
+        assert 'soha_stage_rows_out{stage="combine"} 0' in f.read()
+
+def test_profiled_stages_write_their_stats(tmp_path, monkeypatch):
+    telemetry=soha_priorities.RunTelemetry(profile_stages=['rules:*'], profile_dir=str(tmp_path/'profiles'))
+    monkeypatch.setattr(soha_priorities, 'CURRENT_TELEMETRY', telemetry)
+    soha_priorities.apply_priority_rules(pd.DataFrame({'DefermentQuantile': [.1, .6]}), 'Deferment')
+    record,=telemetry.report()['stages']
+    assert os.path.exists(record['profile'])
+    assert record['traced_peak_bytes']>0
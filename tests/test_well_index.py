@@ -0,0 +1,52 @@
+"""
+WellIndex.attach() against the per-generator merges it replaced.
+"""
+import pandas as pd
+import pytest
+import soha_priorities
+
+def wells():
+    return pd.DataFrame({'API': ['4200000001', '4200000002', '4200000003'],
+                         'Corp_ID': ['SOHA0000001', 'SOHA0000002', 'SOHA0000003'],
+                         'WellName': ['A 1', 'B 2', 'C 3'],
+                         'Area': ['North', 'North', 'South']})
+
+def priorities():
+    #Out of order, a repeated well and one that isn't in the metadata
+    return pd.DataFrame({'Corp_ID': ['SOHA0000003', 'SOHA0000001', 'SOHA0000009', 'SOHA0000003'],
+                         'Priority_Level': [1., 2., 3., 4.]})
+
+def merged(df, wells, left_on, key, columns):
+    columns=[c for c in columns if c!=left_on]
+    df=df.drop(columns=[c for c in columns if c in df.columns])
+    if key==left_on:
+        return pd.merge(df, wells[list(dict.fromkeys([key]+columns))], on=key, how='inner')
+    return pd.merge(df, wells[list(dict.fromkeys([key]+columns))], left_on=left_on, right_on=key, how='inner')
+
+def test_attach_matches_an_inner_merge():
+    columns=['WellName', 'API', 'Area']
+    attached=soha_priorities.WellIndex(wells()).attach(priorities(), 'Corp_ID', key='Corp_ID', columns=columns)
+    pd.testing.assert_frame_equal(attached, merged(priorities(), wells(), 'Corp_ID', 'Corp_ID', columns))
+
+def test_attach_on_another_column_name():
+    df=pd.DataFrame({'apinumber': ['4200000002', '4200000004'], 'Priority_Level': [5., 5.]})
+    attached=soha_priorities.WellIndex(wells()).attach(df, 'apinumber', key='API', columns=['Corp_ID', 'WellName'])
+    assert attached.to_dict('records')==[{'apinumber': '4200000002', 'Priority_Level': 5., 'Corp_ID': 'SOHA0000002',
+                                          'WellName': 'B 2'}]
+
+def test_attached_columns_replace_the_frames_own():
+    df=priorities().assign(Area='stale')
+    attached=soha_priorities.WellIndex(wells()).attach(df, 'Corp_ID', key='Corp_ID', columns=['Area'])
+    assert attached['Area'].tolist()==['South', 'North', 'South']
+
+def test_duplicate_keys_fall_back_to_a_merge():
+    duplicated=pd.concat([wells(), wells().iloc[[0]].assign(WellName='A 1 ST')], ignore_index=True)
+    columns=['WellName']
+    attached=soha_priorities.WellIndex(duplicated).attach(priorities(), 'Corp_ID', key='Corp_ID', columns=columns)
+    pd.testing.assert_frame_equal(attached, merged(priorities(), duplicated, 'Corp_ID', 'Corp_ID', columns))
+    assert sorted(attached.loc[attached['Corp_ID']=='SOHA0000001', 'WellName'])==['A 1', 'A 1 ST']
+
+def test_attach_records_its_stage(telemetry):
+    soha_priorities.WellIndex(wells()).attach(priorities(), 'Corp_ID', key='Corp_ID', columns=['Area'])
+    record,=[record for record in telemetry.report()['stages'] if record['stage']=='attach:Corp_ID']
+    assert (record['rows_in'], record['rows_out'])==(4, 3)